@@ -21,15 +21,37 @@ DEV_MODE = True
 PHASE_A_END = time(hour=8)
 PHASE_B_END = time(hour=23)
 
+# Window lengths (hours) for the "best time to use an appliance" table.
+USAGE_WINDOW_HOURS = [0.5, 1, 2, 3, 4, 6]
+
+# Appliance load profiles - kWh drawn in each half-hour after switching on.
+APPLIANCE_PROFILES = {
+    "Washing machine": [0.8, 0.2, 0.1, 0.1],
+    "Dishwasher": [0.6, 0.1, 0.1, 0.5],
+    "Tumble dryer": [1.2, 1.2, 0.6],
+}
+
 OCTOPUS_USERNAME = "sk_live_xxx"
 OCTOPUS_ZONE = "H"                  # H = Southern England
+OCTOPUS_PRODUCT = "AGILE-18-02-21"  # Import tariff
+OCTOPUS_EXPORT_PRODUCT = "AGILE-OUTGOING-19-05-13"
 OCTOPUS_ELEC_MPAN = ""
 OCTOPUS_ELEC_MSN = ""
 OCTOPUS_GAS_MPRN = ""
 OCTOPUS_GAS_MSN = ""
 
+SITE_IMPORT_LIMIT_KW = 14.4         # Most the house may draw at once (60A supply)
+HW_HEATER_KW = 3.0                  # Immersion heater power
+HW_HEATING_SLOTS = 4                # Half-hours of water heating per night
+
+EV_CHARGER_KW = 7.2                 # Power the car charges at
+EV_START_PENALTY = 10               # Pence added per charging start when planning with fewest starts
+EV_MIN_RUN_SLOTS = 2                # Shortest run (half-hours) when planning with fewest starts
+
 TESLA_USERNAME = ""
 TESLA_PASSWORD = ""
+TESLA_PREWAKE_MINUTES = 3           # Wake the car this long before each charging start
+TESLA_STATE_TTL_MINUTES = 15        # Reuse the car's last charge state for this long before waking it again
 
 PI_IP = "127.0.0.1"
 PI_ELEC_WATER_HEATER_PIN = 19
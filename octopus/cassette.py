@@ -0,0 +1,136 @@
+"""Record and replay Octopus API responses.
+
+A cassette is a JSON file of responses keyed by request. Record one against the real API (or a
+FakeOctopusServer) once, then replay it as often as you like with no network - so fetch paths can
+be timed and tested against exactly the same data every run:
+
+    with recording_session("prices.json") as session:
+        client = OctopusAPIClient(..., session=session)
+        client.get_elec_price(start)                # Real requests, saved to prices.json on close
+
+    client = OctopusAPIClient(..., session=replay_session("prices.json"))
+    client.get_elec_price(start)                    # Served from prices.json
+
+Auth headers are never written to the cassette.
+"""
+
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import json
+import os
+import threading
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+def request_key(method: str, url: str) -> str:
+    """
+    Key a request by method and URL, with query parameters sorted and the scheme/host dropped - so a
+    cassette recorded against one server replays against any base_url with the same paths.
+    """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f"{method.upper()} {urlunsplit(('', '', parts.path, query, ''))}"
+
+
+class Cassette:
+    """
+    Recorded responses, {request_key: {"status", "headers", "body"}}, loaded from and saved to `path`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.interactions = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.interactions = json.load(f)
+
+    def __len__(self):
+        return len(self.interactions)
+
+    def record(self, key: str, response: requests.Response) -> None:
+        with self._lock:
+            self.interactions[key] = {"status": response.status_code,
+                                      "headers": {"Content-Type": response.headers.get("Content-Type",
+                                                                                       "application/json")},
+                                      "body": response.text}
+
+    def play(self, key: str) -> dict:
+        return self.interactions.get(key)
+
+    def save(self) -> None:
+        with self._lock:
+            with open(self.path, "w") as f:
+                json.dump(self.interactions, f, indent=1, sort_keys=True)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    Sends requests for real and records every successful response. The cassette is saved when the
+    session is closed.
+    """
+
+    def __init__(self, cassette: Cassette, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        if response.ok:
+            self.cassette.record(request_key(request.method, request.url), response)
+        return response
+
+    def close(self):
+        super().close()
+        self.cassette.save()
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Answers requests from a cassette. Anything that wasn't recorded fails as a connection error, as
+    if we were offline.
+    """
+
+    def __init__(self, cassette: Cassette):
+        super().__init__()
+        self.cassette = cassette
+        self.replayed = 0
+
+    def send(self, request, **kwargs):
+        recorded = self.cassette.play(request_key(request.method, request.url))
+        if recorded is None:
+            raise requests.ConnectionError(f"No recorded response for {request.method} {request.url}",
+                                           request=request)
+
+        response = requests.Response()
+        response.status_code = recorded["status"]
+        response.headers = CaseInsensitiveDict(recorded["headers"])
+        response._content = recorded["body"].encode()
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.reason = "Replayed"
+        self.replayed += 1
+        return response
+
+    def close(self):
+        pass
+
+
+def _session(adapter) -> requests.Session:
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def recording_session(path: str) -> requests.Session:
+    """A Session that records every response to the cassette at `path` (written when it's closed)."""
+    return _session(RecordingAdapter(Cassette(path)))
+
+
+def replay_session(path: str) -> requests.Session:
+    """A Session that only ever answers from the cassette at `path`."""
+    return _session(ReplayAdapter(Cassette(path)))
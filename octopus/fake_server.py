@@ -0,0 +1,164 @@
+"""A local stand-in for the parts of the Octopus API we use.
+
+Serves paginated `standard-unit-rates` and `consumption` responses from in-memory data, so
+OctopusAPIClient (and everything built on it) can be exercised without an account or network:
+
+    with FakeOctopusServer(prices=prices) as server:
+        client = OctopusClient(..., base_url=server.base_url)
+
+"""
+
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+import json
+import re
+import threading
+import time
+
+from .octopus_api import OCTOPUS_MAX_PAGE_SIZE
+
+DEFAULT_PAGE_SIZE = 100
+
+UNIT_RATES_PATH = re.compile(r"^/v1/products/[^/]+/electricity-tariffs/[^/]+/standard-unit-rates/?$")
+CONSUMPTION_PATH = re.compile(r"^/v1/(electricity|gas)-meter-points/[^/]+/meters/[^/]+/consumption/?$")
+
+
+def format_datetime(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_datetime(date_str: str) -> datetime:
+    return datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S%z")
+
+
+class FakeOctopusServer:
+    """
+    Local HTTP server pretending to be https://api.octopus.energy/v1
+
+    :param prices: {datetime: p/kWh} served from standard-unit-rates
+    :param usage: {datetime: kWh} served from (electricity and gas) consumption
+    :param latency: Seconds to wait before answering each request.
+    :param max_page_size: Most results returned per page, whatever page_size is asked for.
+    :param fail_first: Respond to this many requests with `fail_status` before behaving.
+    :param fail_status: Status code for failed requests
+    """
+
+    def __init__(self,
+                 prices: dict = None,
+                 usage: dict = None,
+                 latency: float = 0,
+                 max_page_size: int = OCTOPUS_MAX_PAGE_SIZE,
+                 fail_first: int = 0,
+                 fail_status: int = 503,
+                 host: str = "127.0.0.1",
+                 port: int = 0):
+        self.prices = prices or {}
+        self.usage = usage or {}
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+
+        self.requests = []      # Paths of every request received, including failures
+        self._lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def respond(self, path: str, query: dict) -> (int, dict):
+        """
+        Build the response for a request. Returns (status, body).
+        """
+        with self._lock:
+            self.requests.append(path)
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return self.fail_status, {"detail": "Fake failure"}
+
+        if UNIT_RATES_PATH.match(path):
+            data, row = self.prices, self.unit_rate
+        elif CONSUMPTION_PATH.match(path):
+            data, row = self.usage, self.consumption
+        else:
+            return 404, {"detail": "Not found."}
+
+        times = sorted(data.keys(), reverse=True)       # Octopus returns newest first
+        if "period_from" in query:
+            period_from = parse_datetime(query["period_from"])
+            times = [t for t in times if t >= period_from]
+        if "period_to" in query:
+            period_to = parse_datetime(query["period_to"])
+            times = [t for t in times if t < period_to]
+
+        page = int(query.get("page", 1))
+        page_size = min(int(query.get("page_size", DEFAULT_PAGE_SIZE)), self.max_page_size)
+        results = times[(page - 1) * page_size:page * page_size]
+
+        next_url = None
+        if page * page_size < len(times):
+            next_url = f"{self.base_url}{path[len('/v1'):]}?{urlencode(query | {'page': page + 1})}"
+
+        return 200, {"count": len(times),
+                     "next": next_url,
+                     "previous": None,
+                     "results": [row(t, data[t]) for t in results]}
+
+    @staticmethod
+    def unit_rate(t: datetime, value: float) -> dict:
+        return {"value_exc_vat": round(value / 1.05, 4),
+                "value_inc_vat": value,
+                "valid_from": format_datetime(t),
+                "valid_to": format_datetime(t + timedelta(minutes=30))}
+
+    @staticmethod
+    def consumption(t: datetime, value: float) -> dict:
+        return {"consumption": value,
+                "interval_start": format_datetime(t),
+                "interval_end": format_datetime(t + timedelta(minutes=30))}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # Keep-alive, like the real thing
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                if server.latency:
+                    time.sleep(server.latency)
+                status, body = server.respond(url.path, query)
+
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
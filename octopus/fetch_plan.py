@@ -0,0 +1,85 @@
+"""Work out which upstream requests are needed to fill the holes in cached data.
+
+Each upstream request is a (possibly paginated) round-trip to Octopus, so it is cheaper to
+re-fetch a few slots we already have than to make another request. Nearby holes are merged,
+up to a maximum span per request.
+"""
+
+import numpy
+
+from .price_series import from_slot
+
+# Holes separated by this many cached slots or fewer are fetched in one request.
+FETCH_MERGE_GAP = 4
+# Most slots to ask for in one request (30 days).
+FETCH_MAX_SPAN = 48 * 30
+
+
+class FetchPlan:
+    """
+    The upstream requests needed for a range, as (start, stop) slot pairs. Stop is exclusive.
+
+    Iterating gives (start_time, end_time) datetimes ready to pass to the API client.
+    """
+
+    def __init__(self, ranges: list[tuple[int, int]]):
+        self.ranges = ranges
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __iter__(self):
+        for start, stop in self.ranges:
+            yield from_slot(start), from_slot(stop)
+
+    def __repr__(self):
+        return f"<FetchPlan(requests={len(self)}, slots={self.slots})>"
+
+    @property
+    def slots(self) -> int:
+        """Total number of slots that will be requested."""
+        return sum(stop - start for start, stop in self.ranges)
+
+
+def plan_fetches(cached_slots: numpy.ndarray,
+                 start_slot: int,
+                 stop_slot: int,
+                 merge_gap: int = FETCH_MERGE_GAP,
+                 max_span: int = FETCH_MAX_SPAN) -> FetchPlan:
+    """
+    Plan the fewest requests to fill the slots in [start_slot, stop_slot) that aren't cached.
+
+    stop_slot should already be clipped to the last slot that can possibly have been published,
+    so that nothing unpublishable is asked for.
+
+    :param cached_slots: Slot indices we already have, any order.
+    :param start_slot: First slot wanted
+    :param stop_slot: Slot after the last one wanted
+    :param merge_gap: Merge holes separated by this many cached slots or fewer.
+    :param max_span: Split any request longer than this many slots.
+    """
+    assert max_span > 0, "max_span must be at least one slot"
+
+    if stop_slot <= start_slot:
+        return FetchPlan([])
+
+    cached_slots = numpy.asarray(cached_slots, dtype=numpy.int64)
+    cached = numpy.zeros(stop_slot - start_slot, dtype=bool)
+    in_range = cached_slots[(cached_slots >= start_slot) & (cached_slots < stop_slot)]
+    cached[in_range - start_slot] = True
+
+    missing = numpy.flatnonzero(~cached)
+    if not len(missing):
+        return FetchPlan([])
+
+    # A new request starts wherever the run of cached slots since the last hole is too long to re-fetch.
+    breaks = numpy.flatnonzero(numpy.diff(missing) > merge_gap + 1)
+    starts = numpy.concatenate(([missing[0]], missing[breaks + 1])) + start_slot
+    stops = numpy.concatenate((missing[breaks] + 1, [missing[-1] + 1])) + start_slot
+
+    ranges = []
+    for start, stop in zip(starts.tolist(), stops.tolist()):
+        for chunk_start in range(start, stop, max_span):
+            ranges.append((chunk_start, min(chunk_start + max_span, stop)))
+
+    return FetchPlan(ranges)
@@ -1,9 +1,21 @@
 import logging
+from collections import deque, namedtuple
 from config import *
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
-from datetime import datetime, timedelta, timezone
+from urllib3.util.retry import Retry
+from datetime import datetime, time, timedelta, timezone
 import pytz
+import time as timer
+
+# Octopus won't return more than this many results per page.
+OCTOPUS_MAX_PAGE_SIZE = 1500
+
+# Flat gas unit rate (p/kWh).
+GAS_PRICE = 3.0135
+
+RequestTiming = namedtuple("RequestTiming", ["url", "status", "seconds", "results"])
 
 
 def read_datetime(date_str):
@@ -13,18 +25,90 @@ def read_datetime(date_str):
     return d
 
 
+def price_horizon(now: datetime = None) -> datetime:
+    """
+    End of the last slot that Agile prices can have been published for.
+
+    Prices for the day from 2300 (UK) are published around 1600 (UK) the day before. So before 1600
+    we will never have data beyond 2300 tonight, and after it we will never have data beyond 2300
+    tomorrow.
+
+    :param now: Defaults to now.
+    """
+    if now is None:
+        now = datetime.now(tz=timezone.utc)
+
+    local_now = now.astimezone(TIMEZONE)
+    horizon_date = local_now.date()
+    if local_now.hour >= 16:
+        horizon_date += timedelta(days=1)
+
+    return TIMEZONE.localize(datetime.combine(horizon_date, time(hour=23))).astimezone(timezone.utc)
+
+
+def next_price_publication(now: datetime = None) -> datetime:
+    """
+    The next time (1600 UK) that new Agile prices can be published - i.e. when price_horizon moves.
+
+    :param now: Defaults to now.
+    """
+    if now is None:
+        now = datetime.now(tz=timezone.utc)
+
+    local_now = now.astimezone(TIMEZONE)
+    publication_date = local_now.date()
+    if local_now.hour >= 16:
+        publication_date += timedelta(days=1)
+
+    return TIMEZONE.localize(datetime.combine(publication_date, time(hour=16))).astimezone(timezone.utc)
+
+
+def make_session(retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 pool_size: int = 10) -> requests.Session:
+    """
+    A requests Session that keeps connections alive between calls and retries (with exponential
+    backoff) on rate limiting and server errors.
+
+    :param retries: Max retries per request
+    :param backoff_factor: Sleep backoff_factor * 2^(retry - 1) seconds between retries.
+    :param pool_size: Connections to keep open
+    """
+    retry = Retry(total=retries,
+                  backoff_factor=backoff_factor,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["GET"]),
+                  respect_retry_after_header=True)
+    adapter = HTTPAdapter(max_retries=retry,
+                          pool_connections=pool_size,
+                          pool_maxsize=pool_size)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 class OctopusAPIClient:
     def __init__(self, username, zone,
                  e_mpan, e_msn,
-                 g_mprn, g_msn):
+                 g_mprn, g_msn,
+                 product: str = OCTOPUS_PRODUCT,
+                 export_product: str = OCTOPUS_EXPORT_PRODUCT,
+                 base_url: str = "https://api.octopus.energy/v1",
+                 page_size: int = OCTOPUS_MAX_PAGE_SIZE,
+                 timeout: (float, float) = (5, 30),
+                 session: requests.Session = None):
         # https://octopus.energy/dashboard/developer/
         self.USERNAME = username
         self.PASSWORD = ""          # This is not a mistake. Username is secret.
         self.OCTOPUS_ZONE = zone
+        self.product = product                  # e.g. AGILE-18-02-21
+        self.export_product = export_product    # e.g. AGILE-OUTGOING-19-05-13
 
-        self.GAS_PRICE = 3.0135
+        self.GAS_PRICE = GAS_PRICE
 
-        self.base_url = "https://api.octopus.energy/v1"
+        self.base_url = base_url
         self.e_mpan = e_mpan
         self.e_msn = e_msn
         self.g_mprn = g_mprn
@@ -32,6 +116,41 @@ class OctopusAPIClient:
 
         self.auth = HTTPBasicAuth(self.USERNAME, self.PASSWORD)
 
+        self.page_size = page_size
+        self.timeout = timeout      # (connect, read) seconds
+        self.session = session if session is not None else make_session()
+
+        # Most recent requests, newest last.
+        self.request_timings = deque(maxlen=100)
+
+    def get_pages(self, url, params, auth=None) -> list:
+        """
+        Get the results from every page of a paginated API response.
+
+        :param url: First page URL
+        :param params: Query parameters for the first page. Subsequent "next" URLs include them already.
+        :param auth: Optional auth
+        """
+        results = []
+        params = params | {"page_size": self.page_size}
+
+        while url is not None:
+            t = timer.perf_counter()
+            r = self.session.get(url, auth=auth, params=params, timeout=self.timeout)
+            seconds = timer.perf_counter() - t
+            r.raise_for_status()
+            response = r.json()
+
+            page = response.get("results", [])
+            self.request_timings.append(RequestTiming(r.url, r.status_code, seconds, len(page)))
+            logging.info(f"Octopus API request: {r.url} ({seconds * 1000:.0f}ms, {len(page)} results)")
+
+            results += page
+            url = response.get("next", None)
+            params = None
+
+        return results
+
     def get_gas_price(self, start_time):
         # Generates a flat-line based on a fixed cost until 2200 tomorrow.
 
@@ -56,17 +175,19 @@ class OctopusAPIClient:
         This function gets electricity prices, but includes a little contextual knowledge about what data
         is likely to be available before just heading off to get it blindly.
         """
-        now = datetime.now(tz=timezone.utc)
+        return self.get_unit_rates(self.product, start_time, end_time)
 
-        # We will never have more data than this
-        if start_time > now.replace(hour=21, minute=30,
-                                    second=0, microsecond=0) + timedelta(days=1):
-            logging.info(f"Data won't be available that far in the future ({start_time}).")
-            return {}
+    def get_export_price(self, start_time, end_time=None):
+        """What we are paid for exported electricity, on export_product."""
+        return self.get_unit_rates(self.export_product, start_time, end_time)
+
+    def get_unit_rates(self, product, start_time, end_time=None):
+        """
+        Half-hourly unit rates (p/kWh inc. VAT) of an electricity product in our zone.
 
-        # Before 1600 (UK) - we know we won't have data for anything beyond 2200 (UTC) tonight.
-        if now.astimezone(TIMEZONE).hour < 16 and start_time > now.replace(hour=21, minute=30,
-                                                                           second=0, microsecond=0):
+        :param product: Octopus product code, e.g. AGILE-18-02-21
+        """
+        if start_time >= price_horizon():
             logging.info(f"Data won't be available that far in the future ({start_time}).")
             return {}
 
@@ -76,20 +197,14 @@ class OctopusAPIClient:
               "{tc}/electricity-tariffs/" \
               "E-1R-{tc}-{zone}/" \
               "standard-unit-rates".format(base=self.base_url,
-                                           tc="AGILE-18-02-21",
+                                           tc=product,
                                            zone=self.OCTOPUS_ZONE)
 
-        prices = []
         params = {"period_from": datetime.strftime(start_time, "%Y-%m-%dT%H:%M:%S%z")}
         if end_time is not None:
             params["period_to"] = datetime.strftime(end_time, "%Y-%m-%dT%H:%M:%S%z")
 
-        while url is not None:
-            logging.info(f"Octopus API request: {url}")
-            r = requests.get(url, params=params)
-            response = r.json()
-            prices += response.get('results', [])
-            url = response.get("next", None)
+        prices = self.get_pages(url, params)
 
         price_list = {}
         for i in prices:
@@ -123,17 +238,11 @@ class OctopusAPIClient:
             logging.info(f"Data won't be available in the future ({start_time}).")
             return {}
 
-        usage = []
         params = {"period_from": datetime.strftime(start_time, "%Y-%m-%dT%H:%M:%S%z")}
         if end_time is not None:
             params["period_to"] = datetime.strftime(end_time, "%Y-%m-%dT%H:%M:%S%z")
 
-        while url is not None:
-            logging.info(f"Octopus API request: {url}")
-            r = requests.get(url, auth=self.auth, params=params)
-            response = r.json()
-            usage += response["results"]
-            url = response.get("next", None)
+        usage = self.get_pages(url, params, auth=self.auth)
 
         usage_dict = {}
         for i in usage:
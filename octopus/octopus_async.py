@@ -0,0 +1,123 @@
+"""Asyncio flavour of OctopusAPIClient for long backfills.
+
+Pagination has to be followed page by page, so a long range is slow however good the
+connection is. AsyncOctopusAPIClient splits a range into chunks and fetches them concurrently
+(each chunk still paginated by the synchronous client, in a worker thread sharing the
+pooled session). Results come back in the same {datetime: value} shape.
+
+    with AsyncOctopusAPIClient(...) as client:
+        usage = asyncio.run(client.get_elec_usage(start_time, end_time))
+
+Use `blocking` to hand one of its functions to cached_time_series.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from .octopus_api import OctopusAPIClient, make_session, price_horizon
+
+
+def blocking(coroutine_function):
+    """
+    Wrap an async client function so it can be called like the synchronous one
+    (e.g. as the `super_func` of cached_time_series).
+    """
+    def wrapper(*args, **kwargs):
+        return asyncio.run(coroutine_function(*args, **kwargs))
+    return wrapper
+
+
+def split_range(start_time: datetime, end_time: datetime, chunk: timedelta) -> list[(datetime, datetime)]:
+    """
+    Split [start_time, end_time) into consecutive chunks of at most `chunk`.
+    """
+    ranges = []
+    while start_time < end_time:
+        ranges.append((start_time, min(start_time + chunk, end_time)))
+        start_time += chunk
+    return ranges
+
+
+class AsyncOctopusAPIClient(OctopusAPIClient):
+    """
+    Same methods as OctopusAPIClient, but coroutines that fetch `chunk`-sized pieces of the
+    requested range, at most `max_concurrency` at a time (the size of its thread pool).
+
+    Close it (or use it as a context manager) to shut the pool down.
+    """
+
+    def __init__(self, *args,
+                 chunk: timedelta = timedelta(days=7),
+                 max_concurrency: int = 8,
+                 **kwargs):
+        self._owns_session = kwargs.get("session") is None
+        if self._owns_session:
+            kwargs["session"] = make_session(pool_size=max_concurrency)
+        super().__init__(*args, **kwargs)
+
+        self.chunk = chunk
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def close(self) -> None:
+        """Shut down the worker threads, and the session if we made it."""
+        self.executor.shutdown(wait=True)
+        if self._owns_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    async def fetch_range(self, func, start_time: datetime, end_time: datetime) -> dict:
+        """
+        Call a (synchronous) client function over [start_time, end_time) chunk by chunk, concurrently,
+        and merge the results. The executor's max_workers is what limits concurrency.
+        """
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[loop.run_in_executor(self.executor, func, s, e)
+                                         for s, e in split_range(start_time, end_time, self.chunk)])
+
+        merged = {}
+        for r in results:
+            merged |= r
+        return merged
+
+    async def get_gas_price(self, start_time):
+        return super().get_gas_price(start_time)
+
+    async def get_elec_price(self, start_time, end_time=None):
+        if end_time is None:
+            end_time = price_horizon()
+        return await self.fetch_range(super().get_elec_price, start_time, end_time)
+
+    async def get_export_price(self, start_time, end_time=None):
+        if end_time is None:
+            end_time = price_horizon()
+        return await self.fetch_range(super().get_export_price, start_time, end_time)
+
+    async def get_elec_usage(self, start_time, end_time=None):
+        url = f"{self.base_url}/" \
+              f"electricity-meter-points/{self.e_mpan}/" \
+              f"meters/{self.e_msn}/" \
+              f"consumption/"
+        return await self.get_usage(url, start_time, end_time)
+
+    async def get_gas_usage(self, start_time, end_time=None):
+        url = f"{self.base_url}/" \
+              f"gas-meter-points/{self.g_mprn}/" \
+              f"meters/{self.g_msn}/" \
+              f"consumption/"
+        return await self.get_usage(url, start_time, end_time)
+
+    async def get_usage(self, url, start_time, end_time=None):
+        if end_time is None:
+            end_time = datetime.now(tz=timezone.utc)
+
+        def fetch(chunk_start, chunk_end):
+            return super(AsyncOctopusAPIClient, self).get_usage(url, chunk_start, chunk_end)
+
+        return await self.fetch_range(fetch, start_time, end_time)
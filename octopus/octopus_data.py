@@ -1,62 +1,203 @@
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
+import logging
+import threading
 
-from .octopus_api import OctopusAPIClient
-from planner.models import EnergyPrices, EnergyUsage
+import numpy
+from django.db import transaction
 
+from .fetch_plan import plan_fetches, FETCH_MERGE_GAP, FETCH_MAX_SPAN
+from .octopus_api import OctopusAPIClient, price_horizon, next_price_publication
+from .price_series import PriceSeries, first_slot_from, to_slot, to_slots
+from planner.models import SeriesValue, TimeSeries
 
-def cached_time_series(model, super_func, start_time, end_time):
-    if end_time is not None:
-        r = model.objects.filter(time__gte=start_time, time__lte=end_time).order_by('time')
-    else:
-        r = model.objects.filter(time__gte=start_time).order_by('time')
+# Rows per INSERT when writing new data to the cache.
+BULK_CREATE_BATCH_SIZE = 500
 
-    existing_data = {row.time: row.data for row in r}
 
-    new_data = {}
+def store_time_series(series, data: dict, batch_size: int = BULK_CREATE_BATCH_SIZE) -> None:
+    """
+    Write {time: value} rows to a TimeSeries in a single transaction, batch_size rows per INSERT.
+
+    (series, slot) is unique, so conflicting rows are skipped (ON CONFLICT DO NOTHING) rather than
+    raising. That keeps two workers filling the same gap at the same time safe.
+    """
+    rows = [SeriesValue(series=series, slot=slot, data=v)
+            for slot, v in zip(to_slots(data.keys()).tolist(), data.values())]
+    with transaction.atomic():
+        SeriesValue.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+
+
+def _stored_slots(series, first_slot: int, stop_slot: int = None) -> (numpy.ndarray, numpy.ndarray):
+    """(slots, values) of a TimeSeries from first_slot up to stop_slot - read from the key's index alone."""
+    r = SeriesValue.objects.filter(series=series, slot__gte=first_slot)
+    if stop_slot is not None:
+        r = r.filter(slot__lt=stop_slot)
+    rows = list(r.values_list('slot', 'data'))
+    return (numpy.fromiter((row[0] for row in rows), dtype=numpy.int64, count=len(rows)),
+            numpy.fromiter((row[1] for row in rows), dtype=numpy.float64, count=len(rows)))
+
+
+def stored_time_series(series, start_time: datetime, end_time: datetime) -> PriceSeries:
+    """
+    Get [start_time, end_time) of a TimeSeries from the database only - nothing is fetched.
+    """
+    return PriceSeries.from_slots(*_stored_slots(series, first_slot_from(start_time), first_slot_from(end_time)))
+
+
+def cached_time_series(series, super_func, start_time, end_time=None,
+                       horizon: datetime = None,
+                       merge_gap: int = FETCH_MERGE_GAP,
+                       max_span: int = FETCH_MAX_SPAN) -> PriceSeries:
+    """
+    Get [start_time, end_time) of a TimeSeries from the database, fetching (and storing) any holes
+    from `super_func`.
 
-    if existing_data:
-        # If we have some data in the requested range, just get what we need
-
-        # Missing data in the middle
-        periods = sorted(existing_data.keys())
-        for i in range(len(periods) - 1):
-            if periods[i] + timedelta(minutes=30) != periods[i + 1]:
-                new_data |= super_func(
-                    start_time=periods[i] + timedelta(minutes=30),
-                    end_time=periods[i + 1])
-
-        # Missing data at the start
-        earliest_data = min(existing_data.keys())
-        if earliest_data > start_time:
-            new_data |= super_func(
-                start_time=start_time,
-                end_time=earliest_data)
-        # Missing data at the end
-        latest_data = max(existing_data.keys())
-        if end_time is None or latest_data < end_time:
-            new_data |= super_func(
-                start_time=latest_data + timedelta(minutes=30),
-                end_time=end_time)
-
-    else:
-        new_data = super_func(
-            start_time=start_time,
-            end_time=end_time)
+    :param series: The TimeSeries, e.g. TimeSeries.usage(TimeSeries.GAS)
+    :param super_func: The API client function to fill holes with.
+    :param start_time: Start of the range
+    :param end_time: End of the range, or None for everything up to `horizon`.
+    :param horizon: Nothing at or beyond this can have been published, so it is never requested.
+                    Defaults to now.
+    :param merge_gap: See plan_fetches
+    :param max_span: See plan_fetches
+    """
+    if horizon is None:
+        horizon = datetime.now(tz=timezone.utc)
+    stop_time = horizon if end_time is None else min(end_time, horizon)
+
+    # The slot start_time falls in is wanted (and stored) even if start_time is part way through it.
+    first_slot = to_slot(start_time)
+    slots, values = _stored_slots(series, first_slot, None if end_time is None else to_slot(end_time))
+
+    plan = plan_fetches(slots, first_slot, to_slot(stop_time),
+                        merge_gap=merge_gap, max_span=max_span)
+    if len(plan):
+        logging.info(f"Filling {series!r} from {start_time}: {plan}")
+
+    new_data = {}
+    for fetch_start, fetch_end in plan:
+        new_data |= super_func(start_time=fetch_start,
+                               end_time=fetch_end)
 
     if new_data:
-        for period_start in new_data:
-            existing_data[period_start] = new_data[period_start]
-            model(time=period_start,
-                  price=new_data[period_start]).save()
+        store_time_series(series, new_data)
+        # New values last, so they win where a merged request re-fetched something we had.
+        slots = numpy.concatenate((slots, to_slots(new_data.keys())))
+        values = numpy.concatenate((values, numpy.fromiter(new_data.values(), dtype=numpy.float64,
+                                                           count=len(new_data))))
+
+    return PriceSeries.from_slots(slots, values).slice(start_time, end_time)
+
+
+class PriceCache:
+    """
+    In-process cache of the current price horizon.
+
+    Agile prices only change once a day (see price_horizon) so once we hold everything up to the
+    horizon there is nothing new to fetch until the next publication. If we are past 1600 and
+    Octopus haven't published yet, we check again after `retry`.
 
-    return existing_data
+    Only open-ended (end_time=None) requests are stored - that's what the planner makes.
+    """
+
+    def __init__(self, retry: timedelta = timedelta(minutes=5)):
+        self.retry = retry
+        self.hits = 0
+        self.misses = 0
+
+        self._start = None
+        self._series = PriceSeries.empty()
+        self._expires = None
+        self._lock = threading.Lock()
+
+    def get(self, start_time: datetime, end_time: datetime = None, now: datetime = None) -> PriceSeries:
+        """
+        Get prices from the cache, or None if they need fetching.
+        """
+        if now is None:
+            now = datetime.now(tz=timezone.utc)
+
+        with self._lock:
+            start, series, expires = self._start, self._series, self._expires
+            fresh = (expires is not None and now < expires
+                     and to_slot(start_time) >= start
+                     and (end_time is None or (len(series) and end_time <= series.end)))
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if not fresh:
+            return None
+        return series.slice(start_time, end_time)
+
+    def put(self, start_time: datetime, series: PriceSeries, now: datetime = None) -> None:
+        """
+        Store the result of an open-ended request from `start_time`. The cached values are made
+        read-only as every hit hands out a view of them.
+        """
+        if now is None:
+            now = datetime.now(tz=timezone.utc)
+
+        if series.end is not None and series.end >= price_horizon(now):
+            expires = next_price_publication(now)
+        else:
+            expires = min(next_price_publication(now), now + self.retry)
+
+        series.values.flags.writeable = False
+        with self._lock:
+            self._start, self._series, self._expires = to_slot(start_time), series, expires
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._expires = None
+
+    def stats(self) -> dict:
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "expires": self._expires}
 
 
 class OctopusClient(OctopusAPIClient):
-    def get_elec_price(self, start_time, end_time=None):
-        return cached_time_series(EnergyPrices, super().get_elec_price,
-                                  start_time, end_time)
+    def __init__(self, *args,
+                 fetch_merge_gap: int = FETCH_MERGE_GAP,
+                 fetch_max_span: int = FETCH_MAX_SPAN,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.price_cache = PriceCache()
+        self.fetch_merge_gap = fetch_merge_gap
+        self.fetch_max_span = fetch_max_span
+
+    def _cached_time_series(self, series, super_func, start_time, end_time, horizon=None):
+        return cached_time_series(series, super_func, start_time, end_time,
+                                  horizon=horizon,
+                                  merge_gap=self.fetch_merge_gap,
+                                  max_span=self.fetch_max_span)
+
+    def get_gas_price(self, start_time) -> PriceSeries:
+        return PriceSeries.from_dict(super().get_gas_price(start_time))
+
+    def get_elec_price(self, start_time, end_time=None) -> PriceSeries:
+        series = self.price_cache.get(start_time, end_time)
+        if series is not None:
+            return series
+
+        series = self._cached_time_series(TimeSeries.prices(self.product, self.OCTOPUS_ZONE), super().get_elec_price,
+                                          start_time, end_time, horizon=price_horizon())
+        if end_time is None:
+            self.price_cache.put(start_time, series)
+        logging.debug(f"Price cache: {self.price_cache.stats()}")
+        return series
+
+    def get_export_price(self, start_time, end_time=None) -> PriceSeries:
+        return self._cached_time_series(TimeSeries.prices(self.export_product, self.OCTOPUS_ZONE,
+                                                          direction=TimeSeries.EXPORT),
+                                        super().get_export_price, start_time, end_time, horizon=price_horizon())
+
+    def get_elec_usage(self, start_time, end_time=None) -> PriceSeries:
+        return self._cached_time_series(TimeSeries.usage(TimeSeries.ELEC), super().get_elec_usage,
+                                        start_time, end_time)
 
-    def get_elec_usage(self, start_time, end_time=None):
-        return cached_time_series(EnergyUsage, super().get_elec_usage,
-                                  start_time, end_time)
+    def get_gas_usage(self, start_time, end_time=None) -> PriceSeries:
+        return self._cached_time_series(TimeSeries.usage(TimeSeries.GAS), super().get_gas_usage,
+                                        start_time, end_time)
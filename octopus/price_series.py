@@ -0,0 +1,224 @@
+"""Compact half-hourly time series.
+
+Octopus data always comes in 30 minute slots, so rather than carrying a dict of tz-aware
+datetimes around we hold a contiguous float64 array of values and the integer index of the
+first slot (half-hours since the unix epoch). Missing slots are NaN.
+
+A pandas view is available (PriceSeries.to_df) for the visualisation code.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import numpy
+import pandas
+
+SLOT_SECONDS = 30 * 60
+SLOT = timedelta(seconds=SLOT_SECONDS)
+
+
+def to_slot(dt: datetime) -> int:
+    """
+    Get the index of the half-hour slot containing a (tz aware) datetime.
+
+    :param dt: datetime
+    """
+    assert dt.tzinfo, "datetimes must be timezone aware"
+    return int(dt.timestamp()) // SLOT_SECONDS
+
+
+def first_slot_from(dt: datetime) -> int:
+    """
+    Get the index of the first half-hour slot starting at or after a (tz aware) datetime.
+
+    :param dt: datetime
+    """
+    slot = to_slot(dt)
+    return slot if slot * SLOT_SECONDS == dt.timestamp() else slot + 1
+
+
+def to_slots(times) -> numpy.ndarray:
+    """
+    Slot indices for an iterable of (tz aware) datetimes.
+
+    :param times: datetimes
+    """
+    return numpy.fromiter((int(t.timestamp()) for t in times), dtype=numpy.int64) // SLOT_SECONDS
+
+
+def from_slot(slot: int) -> datetime:
+    """
+    Get the (UTC) start time of a half-hour slot.
+
+    :param slot: Slot index
+    """
+    return datetime.fromtimestamp(int(slot) * SLOT_SECONDS, tz=timezone.utc)
+
+
+def local_days(slots, tz) -> numpy.ndarray:
+    """
+    The local calendar day (as days since 1970-01-01) that each slot starts on.
+
+    :param slots: Slot indices
+    :param tz: Timezone, e.g. config.TIMEZONE
+    """
+    starts = pandas.to_datetime(numpy.asarray(slots, dtype=numpy.int64) * SLOT_SECONDS, unit='s', utc=True)
+    local = starts.tz_convert(tz).tz_localize(None)
+    return numpy.asarray((local - pandas.Timestamp(0)) // pandas.Timedelta(days=1), dtype=numpy.int64)
+
+
+def slot_runs(slots: numpy.ndarray) -> list[tuple[int, int]]:
+    """
+    Get (start, stop) slot pairs for contiguous runs of slot indices. Stop is exclusive.
+
+    :param slots: Slot indices, any order.
+    """
+    slots = numpy.sort(numpy.asarray(slots, dtype=numpy.int64))
+    if not len(slots):
+        return []
+
+    breaks = numpy.flatnonzero(numpy.diff(slots) != 1)
+    starts = numpy.concatenate(([slots[0]], slots[breaks + 1]))
+    stops = numpy.concatenate((slots[breaks] + 1, [slots[-1] + 1]))
+
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+class PriceSeries:
+    """
+    Half-hourly values from slot `origin` onwards. NaN marks a slot with no data (or one that
+    has been excluded).
+    """
+
+    __slots__ = ("origin", "values")
+
+    def __init__(self, origin: int, values):
+        self.origin = int(origin)
+        self.values = numpy.ascontiguousarray(values, dtype=numpy.float64)
+
+    @classmethod
+    def empty(cls):
+        return cls(0, numpy.empty(0))
+
+    @classmethod
+    def from_slots(cls, slots, values):
+        """
+        Build a series from (possibly unordered, possibly gappy) slot indices and their values.
+        """
+        slots = numpy.asarray(slots, dtype=numpy.int64)
+        if not len(slots):
+            return cls.empty()
+
+        origin = slots.min()
+        data = numpy.full(slots.max() - origin + 1, numpy.nan)
+        data[slots - origin] = values
+        return cls(origin, data)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """
+        Build a series from a {datetime: value} dict, as returned by OctopusAPIClient.
+        """
+        return cls.from_slots(to_slots(data.keys()),
+                              numpy.fromiter(data.values(), dtype=numpy.float64, count=len(data)))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return f"<PriceSeries(start={self.start}, slots={len(self)}, valid={self.count()})>"
+
+    @property
+    def stop_slot(self) -> int:
+        return self.origin + len(self.values)
+
+    @property
+    def slots(self) -> numpy.ndarray:
+        return numpy.arange(self.origin, self.stop_slot, dtype=numpy.int64)
+
+    @property
+    def valid(self) -> numpy.ndarray:
+        return ~numpy.isnan(self.values)
+
+    @property
+    def start(self) -> datetime:
+        """Start of the first slot."""
+        return from_slot(self.origin) if len(self) else None
+
+    @property
+    def end(self) -> datetime:
+        """End of the last slot."""
+        return from_slot(self.stop_slot) if len(self) else None
+
+    @property
+    def last_time(self) -> datetime:
+        """Start of the last slot that has data."""
+        valid = numpy.flatnonzero(self.valid)
+        return from_slot(self.origin + valid[-1]) if len(valid) else None
+
+    def count(self) -> int:
+        return int(numpy.count_nonzero(self.valid))
+
+    def mean(self) -> float:
+        if not self.count():
+            return numpy.nan
+        return float(numpy.nanmean(self.values))
+
+    def slice(self, start: datetime = None, stop: datetime = None):
+        """
+        Get the part of the series in [start, stop). This is a view - no data is copied.
+        """
+        i = 0 if start is None else min(max(to_slot(start) - self.origin, 0), len(self))
+        j = len(self) if stop is None else min(max(to_slot(stop) - self.origin, i), len(self))
+        return PriceSeries(self.origin + i, self.values[i:j])
+
+    def excluding(self, periods: list[tuple[datetime, datetime]]):
+        """
+        Get a copy of the series with the slots in each (start, stop) period set to NaN.
+        """
+        values = self.values.copy()
+        for start, stop in periods:
+            i = max(to_slot(start) - self.origin, 0)
+            j = min(to_slot(stop) - self.origin, len(values))
+            if i < j:
+                values[i:j] = numpy.nan
+        return PriceSeries(self.origin, values)
+
+    def prefix_sums(self) -> (numpy.ndarray, numpy.ndarray):
+        """
+        Running totals of the values (NaN counted as 0) and of the number of valid slots, each with
+        a leading 0. Window sums for any length can be read off these without re-scanning.
+        """
+        valid = self.valid
+        sums = numpy.concatenate(([0.0], numpy.cumsum(numpy.where(valid, self.values, 0.0))))
+        counts = numpy.concatenate(([0], numpy.cumsum(valid)))
+        return sums, counts
+
+    def window_means(self, periods: int, prefix_sums: (numpy.ndarray, numpy.ndarray) = None) -> numpy.ndarray:
+        """
+        Mean value of every window of `periods` consecutive slots. Element i is the window starting
+        at slot `origin + i`. Windows that touch a NaN slot are NaN.
+
+        :param periods: Window length in slots
+        :param prefix_sums: From self.prefix_sums(), to share between several window lengths.
+        """
+        assert periods >= 1, "windows must be at least one slot"
+        if periods > len(self):
+            return numpy.empty(0)
+
+        sums, counts = self.prefix_sums() if prefix_sums is None else prefix_sums
+
+        window_sums = sums[periods:] - sums[:-periods]
+        window_counts = counts[periods:] - counts[:-periods]
+        return numpy.where(window_counts == periods, window_sums / periods, numpy.nan)
+
+    def to_dict(self) -> dict:
+        valid = numpy.flatnonzero(self.valid)
+        return {from_slot(self.origin + i): float(self.values[i]) for i in valid}
+
+    def to_df(self, column_name: str = 'electricity price') -> pandas.DataFrame:
+        """
+        A pandas view of the series, indexed by UTC slot start times. Slots with no data are dropped.
+        """
+        valid = self.valid
+        index = pandas.to_datetime(self.slots[valid] * SLOT_SECONDS, unit='s', utc=True)
+        return pandas.DataFrame({column_name: self.values[valid]}, index=index)
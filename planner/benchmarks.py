@@ -0,0 +1,305 @@
+"""Benchmarks for the planner's hot paths, over synthetic Agile-like prices.
+
+synthetic_prices makes any number of days of half-hourly prices with the shape of the real thing:
+a cheap night, a 1600-1900 peak, seasonal drift, the occasional windy night that goes negative, and
+the odd missing slot. Each benchmark is timed (best and median of several runs) and then run once
+more under tracemalloc for its peak allocation. Results can be saved as a baseline and later runs
+compared against it, so a change to the planner can be judged on numbers:
+
+    python manage.py benchmark_planner --save-baseline
+    ... change something ...
+    python manage.py benchmark_planner              # Fails if anything got slower or hungrier
+
+Timings only mean something against the same machine, so no baseline is shipped: save one where
+the benchmarks are run. It goes in the user's cache directory, or AE_BENCHMARK_BASELINE if set.
+
+Anything a benchmark writes to the database is rolled back.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timezone
+from statistics import median
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import numpy
+import pandas
+from django.conf import settings
+from django.db import transaction
+
+from config import TIMEZONE
+from octopus.octopus_api import GAS_PRICE
+from octopus.octopus_data import cached_time_series, store_time_series
+from octopus.price_series import SLOT_SECONDS, PriceSeries, to_slot
+
+from .insights import EnergyPlanner
+from .insights.data_tools import drop_periods_from_df, find_contiguous_periods, start_of_current_period
+from .insights.visualisation_tools import plot_html, plot_png, render_cache
+from .models import SystemStatus, TimeSeries
+
+# Named lengths of price history to benchmark over, in days.
+BENCHMARK_SIZES = {"1d": 1, "1w": 7, "1m": 30, "1y": 365, "5y": 1826}
+
+# A run is a regression if it's this many times slower (or bigger) than the baseline...
+TIME_THRESHOLD = 1.25
+MEMORY_THRESHOLD = 1.25
+# ...and by more than this much, so timer noise on tiny functions doesn't count.
+TIME_NOISE_SECONDS = 0.001
+MEMORY_NOISE_KB = 64
+
+DEFAULT_BASELINE = os.environ.get("AE_BENCHMARK_BASELINE",
+                                  os.path.join(os.path.expanduser("~"), ".cache", "agile-energy",
+                                               "benchmark_baseline.json"))
+
+# Where cached_time_series data is written - well before any real data.
+SYNTHETIC_HISTORY_START = datetime(1990, 1, 1, tzinfo=timezone.utc)
+# ...under a tariff of its own.
+SYNTHETIC_PRODUCT = "SYNTHETIC"
+
+Benchmark = namedtuple("Benchmark", ["name", "setup", "max_days"])
+BenchmarkResult = namedtuple("BenchmarkResult", ["name", "size", "seconds", "median", "peak_kb"])
+
+
+def synthetic_prices(days: int,
+                     start: datetime = None,
+                     seed: int = 0,
+                     plunge_rate: float = 0.03,
+                     gap_rate: float = 0.001) -> PriceSeries:
+    """
+    Agile-like half-hourly prices (p/kWh).
+
+    :param days: Length
+    :param start: First slot. Defaults to the current one.
+    :param seed: Same seed, same prices.
+    :param plunge_rate: Chance of any night having a negative plunge.
+    :param gap_rate: Chance of a run of missing slots starting at any slot.
+    """
+    rng = numpy.random.default_rng(seed)
+    origin = to_slot(start or start_of_current_period())
+    n = days * 48
+
+    local = pandas.to_datetime((origin + numpy.arange(n)) * SLOT_SECONDS, unit='s', utc=True).tz_convert(TIMEZONE)
+    hour = local.hour.to_numpy() + local.minute.to_numpy() / 60
+    day = (numpy.arange(n) + int(hour[0] * 2)) // 48      # Local day number, near enough
+    winter = numpy.cos(2 * numpy.pi * local.dayofyear.to_numpy() / 365.25)
+
+    prices = (14
+              + 3 * winter
+              - 5 * numpy.exp(-((hour - 4) / 2.5) ** 2)
+              + 3 * numpy.exp(-((hour - 8) / 1.5) ** 2)
+              + 14 * numpy.exp(-((hour - 17.5) / 1.3) ** 2)
+              + rng.normal(0, 1.5, day[-1] + 1)[day]
+              + rng.normal(0, 1.2, n))
+
+    plunge = rng.uniform(10, 25, day[-1] + 1) * (rng.random(day[-1] + 1) < plunge_rate)
+    prices -= numpy.where(hour < 6, plunge[day], 0)
+
+    prices = numpy.minimum(numpy.round(prices, 2), 35.0)
+    for gap in numpy.flatnonzero(rng.random(n) < gap_rate):
+        prices[gap:gap + rng.integers(1, 7)] = numpy.nan
+
+    return PriceSeries(origin, prices)
+
+
+class SyntheticPriceProvider:
+    """
+    Stands in for OctopusClient, serving a fixed PriceSeries and a flat gas price.
+    """
+
+    def __init__(self, series: PriceSeries, gas_price: float = GAS_PRICE):
+        self.series = series
+        self.gas_price = gas_price
+
+    def get_elec_price(self, start_time, end_time=None) -> PriceSeries:
+        return self.series.slice(start_time, end_time)
+
+    def get_gas_price(self, start_time) -> PriceSeries:
+        origin = to_slot(start_time)
+        return PriceSeries(origin, numpy.full(max(self.series.stop_slot - origin, 0), self.gas_price))
+
+
+def _planner(series: PriceSeries) -> EnergyPlanner:
+    return EnergyPlanner(SyntheticPriceProvider(series))
+
+
+def _cheap_times(series: PriceSeries) -> pandas.DatetimeIndex:
+    """Start times of the cheapest quarter of slots - lots of short contiguous periods."""
+    df = series.to_df()
+    return df.index[df.iloc[:, 0] < df.iloc[:, 0].quantile(0.25)]
+
+
+def _bench_ep_df_from_now(series):
+    return _planner(series).ep_df_from_now
+
+
+def _bench_plan_usage_periods(series):
+    planner = _planner(series)
+    return lambda: planner.plan_usage_periods(hours=3)
+
+
+def _bench_plan_car_charging(series):
+    planner = _planner(series)
+    return lambda: planner.plan_car_charging(departure=series.end, energy_needed=40)
+
+
+def _bench_plan_water_heating(series):
+    SystemStatus.objects.update_or_create(id=settings.AE_SITE_ID,
+                                          defaults={"system_id": settings.AE_SITE_ID,
+                                                    "hw_nest_override": True,
+                                                    "hw_elec_heater_on": False,
+                                                    "hw_gas_heater_on": False,
+                                                    "ev_charge_override": False,
+                                                    "ev_charging": False,
+                                                    "ev_soc": 0,
+                                                    "ev_last_updated": datetime.now(tz=timezone.utc)})
+    return _planner(series).plan_water_heating
+
+
+def _bench_find_contiguous_periods(series):
+    times = _cheap_times(series)
+    return lambda: find_contiguous_periods(times)
+
+
+def _bench_drop_periods_from_df(series):
+    df = series.to_df()
+    periods = find_contiguous_periods(_cheap_times(series))
+    return lambda: drop_periods_from_df(df, periods)
+
+
+def _bench_cached_time_series(series):
+    history = PriceSeries(to_slot(SYNTHETIC_HISTORY_START), series.values)
+    prices = TimeSeries.prices(SYNTHETIC_PRODUCT, "Z")
+    store_time_series(prices, history.to_dict())
+
+    def upstream(start_time, end_time):
+        return history.slice(start_time, end_time).to_dict()
+
+    # A warm read - everything is stored, so only the gaps are asked for (and come back empty).
+    return lambda: cached_time_series(prices, upstream, history.start, history.end, horizon=history.end)
+
+
+def _bench_plot_html(series):
+    dfs = [series.to_df('electricity price'), _planner(series).gp_df_from_now()]
+
+    def run():
+        render_cache.clear()
+        return plot_html(dfs, max_points=2000)
+    return run
+
+
+def _bench_plot_png(series):
+    dfs = [series.to_df('electricity price'), _planner(series).gp_df_from_now()]
+
+    def run():
+        render_cache.clear()
+        return plot_png(dfs)
+    return run
+
+
+BENCHMARKS = [
+    Benchmark("ep_df_from_now", _bench_ep_df_from_now, None),
+    Benchmark("plan_usage_periods", _bench_plan_usage_periods, None),
+    Benchmark("plan_car_charging", _bench_plan_car_charging, None),
+    Benchmark("plan_water_heating", _bench_plan_water_heating, None),
+    Benchmark("find_contiguous_periods", _bench_find_contiguous_periods, None),
+    Benchmark("drop_periods_from_df", _bench_drop_periods_from_df, None),
+    Benchmark("cached_time_series", _bench_cached_time_series, None),
+    Benchmark("plot_html", _bench_plot_html, None),
+    # The emailed graph is labelled as a single day (or overnight) range.
+    Benchmark("plot_png", _bench_plot_png, 1),
+]
+
+
+def measure(fn, repeat: int = 5) -> (float, float, float):
+    """
+    Time `fn` (best and median of `repeat` runs), then run it once more under tracemalloc.
+
+    :return: (best seconds, median seconds, peak KiB allocated)
+    """
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return min(times), median(times), peak / 1024
+
+
+def run_benchmarks(names: list = None, sizes: list = None, repeat: int = 5, seed: int = 0) -> list:
+    """
+    Run benchmarks (all by default) at each size in BENCHMARK_SIZES (all by default).
+
+    :return: BenchmarkResults
+    """
+    benchmarks = [b for b in BENCHMARKS if names is None or b.name in names]
+    sizes = list(BENCHMARK_SIZES) if sizes is None else sizes
+
+    results = []
+    for size in sizes:
+        days = BENCHMARK_SIZES[size]
+        series = synthetic_prices(days, seed=seed)
+        for benchmark in benchmarks:
+            if benchmark.max_days is not None and days > benchmark.max_days:
+                continue
+            with transaction.atomic():
+                fn = benchmark.setup(series)
+                seconds, median_seconds, peak_kb = measure(fn, repeat)
+                transaction.set_rollback(True)
+            results.append(BenchmarkResult(benchmark.name, size, seconds, median_seconds, peak_kb))
+    return results
+
+
+def result_key(result: BenchmarkResult) -> str:
+    return f"{result.name}@{result.size}"
+
+
+def save_baseline(results: list, path: str = DEFAULT_BASELINE) -> None:
+    baseline = {"created": datetime.now(tz=timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "numpy": numpy.__version__,
+                "results": {result_key(r): {"seconds": r.seconds, "peak_kb": r.peak_kb} for r in results}}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+
+
+def load_baseline(path: str = DEFAULT_BASELINE) -> dict:
+    """
+    {"name@size": {"seconds", "peak_kb"}}, or None if there's no baseline.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def regressions(results: list, baseline: dict,
+                time_threshold: float = TIME_THRESHOLD,
+                memory_threshold: float = MEMORY_THRESHOLD) -> list:
+    """
+    Results that are slower or use more memory than their baseline by more than the thresholds.
+
+    :return: [(BenchmarkResult, reason)]
+    """
+    found = []
+    for result in results:
+        base = baseline.get(result_key(result))
+        if base is None:
+            continue
+        if result.seconds > base["seconds"] * time_threshold \
+                and result.seconds - base["seconds"] > TIME_NOISE_SECONDS:
+            found.append((result, f"time {result.seconds / base['seconds']:.2f}x baseline"))
+        if result.peak_kb > base["peak_kb"] * memory_threshold \
+                and result.peak_kb - base["peak_kb"] > MEMORY_NOISE_KB:
+            found.append((result, f"memory {result.peak_kb / base['peak_kb']:.2f}x baseline"))
+    return found
@@ -0,0 +1,26 @@
+from django.core.checks import Tags, Warning, register
+from django.db import connections
+
+from .models import SeriesValue
+
+
+@register(Tags.database)
+def check_series_value_key(app_configs, databases=None, **kwargs):
+    """
+    SeriesValue must be unique on (series, slot): store_time_series relies on it to skip values
+    already stored, and every read looks values up by it. Where the covering key can't be made,
+    migration 0014 adds a plain one - warn if neither is there.
+    """
+    errors = []
+    for alias in databases or []:
+        connection = connections[alias]
+        table = SeriesValue._meta.db_table
+        with connection.cursor() as cursor:
+            if table not in connection.introspection.table_names(cursor):
+                continue
+            constraints = connection.introspection.get_constraints(cursor, table).values()
+        if not any(c["unique"] and c["columns"] == ["series_id", "slot"] for c in constraints):
+            errors.append(Warning(f"{table} has no unique key on (series_id, slot) in database '{alias}'.",
+                                  hint="Run the planner migrations, which add one for this database.",
+                                  obj=SeriesValue, id="planner.W001"))
+    return errors
@@ -1,4 +1,5 @@
 from .insights import EnergyPlanner
+from .vehicle_state import VehicleState
 from octopus import OctopusClient
 from config import *
 
@@ -9,4 +10,4 @@ energy_provider = OctopusClient(username=OCTOPUS_USERNAME,
                                 g_mprn=OCTOPUS_GAS_MPRN,
                                 g_msn=OCTOPUS_GAS_MSN)
 
-energy_planner = EnergyPlanner(energy_provider)
+energy_planner = EnergyPlanner(energy_provider, car=VehicleState())
@@ -0,0 +1,340 @@
+"""Runs SystemScheduleTasks at their action_time.
+
+A long-running Dispatcher keeps the pending tasks in a heap ordered by action_time and sleeps until
+the next one is due (or until it is time to check for new tasks), so a task runs within a moment of
+its scheduled second rather than at the next cron tick.
+
+Several runners (dispatchers, or cron-driven `scheduled_tasks`) can share the table. A runner
+claims a task before running it - setting claimed_by and a lease with a conditional UPDATE, or for
+a batch, SELECT ... FOR UPDATE SKIP LOCKED where the database has it - and marks it completed
+afterwards. If a runner dies in between, the lease runs out and someone else picks the task up, so
+tasks must be safe to repeat (starting a car that is already charging is harmless).
+
+Task names are looked up in a registry (planner.tasks.TASKS) rather than exec'd, and are called
+with the id of the task they're running for.
+"""
+
+from collections import deque
+from datetime import datetime, timedelta, timezone
+import heapq
+import logging
+import os
+import socket
+import time
+
+from django.db import connection, transaction
+from django.db.models import Count, Max, Q
+
+from config import TESLA_PREWAKE_MINUTES
+
+from .models import CarChargingPeriod, SystemScheduleTasks, SystemScheduleTasksArchive
+
+# Seconds between checks for newly scheduled (or cancelled) tasks.
+DISPATCH_POLL_INTERVAL = 10
+
+# How long a claim lasts before another runner may take the task over.
+TASK_LEASE = timedelta(minutes=5)
+
+# Completed tasks older than this are moved to the archive.
+TASK_ARCHIVE_AFTER = timedelta(days=7)
+
+
+def schedule_charging_session(charge_session, prewake: timedelta = None):
+    """
+    Create the tasks for each period of a CarChargingSession: wake the car `prewake` before the start
+    (waking can take tens of seconds), start, and stop. Each task has an idempotency key, so
+    scheduling a session twice doesn't create any more.
+    """
+    if prewake is None:
+        prewake = timedelta(minutes=TESLA_PREWAKE_MINUTES)
+
+    def task(function, period, action_time):
+        task, _ = SystemScheduleTasks.objects.get_or_create(idempotency_key=charging_task_key(function, period),
+                                                            defaults={"action_time": action_time,
+                                                                      "function": function})
+        return task
+
+    with transaction.atomic():
+        for period in charge_session.carchargingperiod_set.all():
+            if prewake:
+                task("tesla_wake_up", period, period.start_time - prewake)
+            period.start_task_id = task("tesla_start_charging", period, period.start_time)
+            period.stop_task_id = task("tesla_stop_charging", period, period.stop_time)
+            period.save()
+
+        charge_session.scheduled = True
+        charge_session.save()
+
+
+def charging_task_key(function: str, period) -> str:
+    return f"{function}:{period.pk}"
+
+
+def cancel_charging_session(charge_session):
+    """
+    Delete a CarChargingSession and its pending tasks, so the car isn't woken or started for it. A
+    period that has already started keeps its stop task, so the car isn't left charging.
+    """
+    with transaction.atomic():
+        keys = []
+        for period in charge_session.carchargingperiod_set.all():
+            start_key = charging_task_key("tesla_start_charging", period)
+            started = SystemScheduleTasks.objects.filter(idempotency_key=start_key, completed=True).exists()
+            functions = ["tesla_wake_up", "tesla_start_charging"] + ([] if started else ["tesla_stop_charging"])
+            keys += [charging_task_key(function, period) for function in functions]
+
+        SystemScheduleTasks.objects.filter(idempotency_key__in=keys, completed=False).delete()
+        charge_session.delete()
+
+
+def record_charging_start(task_id: int, started: datetime = None):
+    """
+    Note when the period started by task `task_id` actually started charging.
+    """
+    if started is None:
+        started = datetime.now(tz=timezone.utc)
+    CarChargingPeriod.objects.filter(start_task_id=task_id).update(actual_start=started)
+
+
+def start_latencies(limit: int = 100) -> list:
+    """
+    Seconds late that each of the most recent `limit` charging periods actually started.
+    """
+    periods = CarChargingPeriod.objects.filter(actual_start__isnull=False).order_by('-start_time')[:limit]
+    return [period.start_latency for period in periods]
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claimable(now: datetime) -> Q:
+    """Pending tasks nobody holds a live lease on."""
+    return Q(completed=False) & (Q(lease_expires__isnull=True) | Q(lease_expires__lt=now))
+
+
+def claim_task(pk: int, worker: str, now: datetime, lease: timedelta = TASK_LEASE) -> bool:
+    """
+    Claim one task, if it's still claimable and due - it may have been moved later since we looked.
+    A single conditional UPDATE, so only one runner can win.
+    """
+    return bool(SystemScheduleTasks.objects.filter(claimable(now), pk=pk, action_time__lte=now)
+                .update(claimed_by=worker, lease_expires=now + lease))
+
+
+def claim_due_tasks(worker: str, now: datetime, lease: timedelta = TASK_LEASE, limit: int = 100) -> list:
+    """
+    Claim up to `limit` due tasks, oldest first. On Postgres rows another runner is claiming are
+    skipped (SKIP LOCKED) rather than waited for. Elsewhere two runners may pick the same rows, so
+    the UPDATE is conditional on them still being claimable, and only what we won is returned.
+
+    :return: The claimed SystemScheduleTasks
+    """
+    with transaction.atomic():
+        due = SystemScheduleTasks.objects.filter(claimable(now), action_time__lte=now).order_by('action_time')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        pks = list(due.values_list('pk', flat=True)[:limit])
+        SystemScheduleTasks.objects.filter(claimable(now), pk__in=pks) \
+            .update(claimed_by=worker, lease_expires=now + lease)
+        return list(SystemScheduleTasks.objects.filter(pk__in=pks, claimed_by=worker, lease_expires=now + lease)
+                    .order_by('action_time'))
+
+
+def complete_task(pk: int, worker: str, now: datetime) -> bool:
+    """
+    Mark a task we hold as completed. False if our lease ran out and someone else took it.
+    """
+    return bool(SystemScheduleTasks.objects.filter(pk=pk, claimed_by=worker, completed=False)
+                .update(completed=True, completed_at=now))
+
+
+def archive_completed_tasks(older_than: timedelta = TASK_ARCHIVE_AFTER, batch_size: int = 1000) -> int:
+    """
+    Move tasks completed more than `older_than` ago into SystemScheduleTasksArchive.
+
+    :return: Number of tasks moved
+    """
+    cutoff = datetime.now(tz=timezone.utc) - older_than
+    moved = 0
+    while True:
+        with transaction.atomic():
+            tasks = list(SystemScheduleTasks.objects.filter(completed=True)
+                         .filter(Q(completed_at__lt=cutoff) | Q(completed_at__isnull=True, action_time__lt=cutoff))
+                         .order_by('id')[:batch_size])
+            if not tasks:
+                return moved
+
+            SystemScheduleTasksArchive.objects.bulk_create(
+                [SystemScheduleTasksArchive(task_id=task.pk,
+                                            action_time=task.action_time,
+                                            function=task.function,
+                                            idempotency_key=task.idempotency_key,
+                                            claimed_by=task.claimed_by,
+                                            completed_at=task.completed_at) for task in tasks],
+                ignore_conflicts=True)
+            SystemScheduleTasks.objects.filter(pk__in=[task.pk for task in tasks]).delete()
+        moved += len(tasks)
+
+
+def default_registry() -> dict:
+    from .tasks import TASKS    # planner.tasks imports record_charging_start from here
+    return TASKS
+
+
+class Dispatcher:
+    """
+    :param registry: {function name: callable}. Defaults to planner.tasks.TASKS.
+    :param poll_interval: Seconds between checks for new tasks.
+    :param lease: How long our claim on a task lasts.
+    :param worker: Name recorded against claimed tasks. Defaults to host:pid.
+    :param clock: Returns the time now, as unix seconds.
+    :param sleep: Sleeps for a number of seconds.
+    """
+
+    def __init__(self,
+                 registry: dict = None,
+                 poll_interval: float = DISPATCH_POLL_INTERVAL,
+                 lease: timedelta = TASK_LEASE,
+                 worker: str = None,
+                 clock=time.time,
+                 sleep=time.sleep):
+        self._registry = registry
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.worker = worker or worker_name()
+        self.clock = clock
+        self.sleep = sleep
+
+        self.lags = deque(maxlen=1000)      # Seconds between action_time and the task being started
+        self.dispatched = 0
+        self.failed = 0
+
+        self._heap = []
+        self._signature = None
+
+    @property
+    def registry(self) -> dict:
+        if self._registry is None:
+            self._registry = default_registry()
+        return self._registry
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Reload the pending tasks if any have been added, removed, moved or completed elsewhere since
+        we last looked. Checking is a single aggregate query.
+
+        :return: Whether the tasks were reloaded.
+        """
+        pending = SystemScheduleTasks.objects.filter(completed=False)
+        signature = tuple(pending.aggregate(count=Count('id'), last_id=Max('id'), last_edit=Max('updated')).values())
+        if signature == self._signature and not force:
+            return False
+
+        self._signature = signature
+        self._heap = [(action_time.timestamp(), pk, function)
+                      for pk, action_time, function in pending.values_list('id', 'action_time', 'function')]
+        heapq.heapify(self._heap)
+        logging.debug(f"Dispatcher: {len(self._heap)} pending tasks")
+        return True
+
+    def next_due(self) -> float:
+        """Unix time of the next pending task, or None."""
+        return self._heap[0][0] if self._heap else None
+
+    def run_due(self) -> int:
+        """
+        Run every task that is due now.
+
+        :return: Number of tasks run.
+        """
+        ran = 0
+        while self._heap and self._heap[0][0] <= self.clock():
+            action_time, pk, function = heapq.heappop(self._heap)
+            if self.dispatch(pk, function, action_time):
+                ran += 1
+        return ran
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self.clock(), tz=timezone.utc)
+
+    def dispatch(self, pk: int, function: str, action_time: float) -> bool:
+        """
+        Claim a task and run it.
+
+        :return: Whether we ran it.
+        """
+        if not claim_task(pk, self.worker, self.now(), self.lease):
+            logging.info(f"Task {pk} ({function}) done, claimed elsewhere or moved. Skipping")
+            return False
+        self.execute(pk, function, action_time)
+        return True
+
+    def sweep(self) -> int:
+        """
+        Claim and run anything due that isn't in our heap - e.g. tasks whose runner died, once their
+        lease is up.
+
+        :return: Number of tasks run.
+        """
+        tasks = claim_due_tasks(self.worker, self.now(), self.lease)
+        for task in tasks:
+            self.execute(task.pk, task.function, task.action_time.timestamp())
+        return len(tasks)
+
+    def execute(self, pk: int, function: str, action_time: float):
+        """
+        Run a task we've claimed, and mark it completed.
+        """
+        lag = self.clock() - action_time
+        self.lags.append(lag)
+        self.dispatched += 1
+        logging.info(f"Executing {function} (task {pk}), {lag:.2f}s after its action time")
+
+        try:
+            self.registry[function](task_id=pk)
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Failed executing {function}. {e}")
+
+        if not complete_task(pk, self.worker, self.now()):
+            logging.warning(f"Lost the lease on task {pk} ({function}) while running it")
+
+    def run_forever(self):
+        next_poll = self.clock()
+        while True:
+            now = self.clock()
+            ran = 0
+            if now >= next_poll:
+                self.refresh()
+                ran += self.sweep()
+                next_poll = now + self.poll_interval
+
+            ran += self.run_due()
+            if ran:
+                logging.info(f"Dispatcher: {self.stats()}")
+
+            wake = next_poll if self.next_due() is None else min(next_poll, self.next_due())
+            self.sleep(max(wake - self.clock(), 0))
+
+    def stats(self) -> dict:
+        """
+        Dispatch lag (seconds late) of recent tasks.
+        """
+        lags = sorted(self.lags)
+        if not lags:
+            return {"dispatched": self.dispatched, "failed": self.failed}
+        return {"dispatched": self.dispatched,
+                "failed": self.failed,
+                "lag_mean": sum(lags) / len(lags),
+                "lag_p95": lags[min(int(len(lags) * 0.95), len(lags) - 1)],
+                "lag_max": lags[-1]}
+
+
+def run_due_tasks(registry: dict = None) -> int:
+    """
+    Run everything due now, once - for running from cron.
+    """
+    ran = Dispatcher(registry).sweep()
+    logging.info(f"Ran {ran} tasks at {datetime.now(tz=timezone.utc)}")
+    return ran
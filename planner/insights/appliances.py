@@ -0,0 +1,59 @@
+"""Appliance load profiles, and the cost of running one from every possible start time.
+
+A profile is the kWh an appliance draws in each half-hour after it is switched on - e.g. a
+washing machine draws most of its energy heating water in the first 30 minutes. Costing every
+start time is a correlation of the profile against the price array.
+"""
+
+import numpy
+
+from config import APPLIANCE_PROFILES
+
+# Profiles at least this many slots long are correlated via FFT rather than directly.
+FFT_MIN_PROFILE = 64
+
+APPLIANCES = {}
+
+
+def register_appliance(name: str, kwh_per_slot: list[float]) -> numpy.ndarray:
+    """
+    Register (or replace) an appliance's load profile.
+
+    :param name: Shown on the dashboard and in emails
+    :param kwh_per_slot: kWh drawn in each half-hour after switching on
+    """
+    profile = numpy.asarray(kwh_per_slot, dtype=numpy.float64)
+    assert profile.ndim == 1 and len(profile), "A profile needs at least one half-hour"
+    assert (profile >= 0).all(), "A profile can't have negative usage"
+
+    APPLIANCES[name] = profile
+    return profile
+
+
+def start_costs(prices: numpy.ndarray, profile: numpy.ndarray) -> numpy.ndarray:
+    """
+    Cost of running `profile` from each start slot. Element i is sum(prices[i + j] * profile[j]) - pence,
+    for prices in p/kWh. NaN where any price in the run is missing.
+
+    :param prices: Half-hourly prices (NaN for missing/excluded)
+    :param profile: kWh per half-hour
+    """
+    n, m = len(prices), len(profile)
+    if m > n:
+        return numpy.empty(0)
+
+    missing = numpy.isnan(prices)
+    filled = numpy.where(missing, 0.0, prices)
+
+    if m >= FFT_MIN_PROFILE:
+        size = 1 << (n + m - 1).bit_length()
+        costs = numpy.fft.irfft(numpy.fft.rfft(filled, size) * numpy.fft.rfft(profile[::-1], size), size)[m - 1:n]
+    else:
+        costs = numpy.correlate(filled, profile, mode="valid")
+
+    missing_counts = numpy.concatenate(([0], numpy.cumsum(missing)))
+    return numpy.where(missing_counts[m:] - missing_counts[:-m] > 0, numpy.nan, costs)
+
+
+for appliance_name, appliance_profile in APPLIANCE_PROFILES.items():
+    register_appliance(appliance_name, appliance_profile)
@@ -0,0 +1,279 @@
+"""Replaying stored price history to see what the planners would have saved.
+
+Each day of history is one decision. At `decision_hour` every strategy plans the coming night using
+only the prices that had been published by then (see price_horizon), and is then charged what those
+slots actually cost. Days are stacked into 2-D arrays - a row per day, a column per slot of the
+night's window - so a strategy is a few numpy operations over a whole chunk of days, and chunks are
+spread over a process pool.
+
+Car strategies, plugged in CAR_WINDOW:
+
+* overnight - a dumb timer: charge flat out from OVERNIGHT_START_HOUR until done.
+* immediate - charge flat out from plugging in.
+* cheapest / fewest_starts - as plan_car_charging.
+
+Hot water strategies, in HOT_WATER_WINDOW:
+
+* hot_water - as plan_water_heating: the cheapest heating_slots, electric where that beats gas.
+* hot_water_gas - the boiler's own timer, all on gas.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time, timedelta
+import logging
+
+import django
+import numpy
+from django.conf import settings
+
+from config import (EV_CHARGER_KW, EV_MIN_RUN_SLOTS, EV_START_PENALTY, HW_HEATER_KW, HW_HEATING_SLOTS, OCTOPUS_PRODUCT,
+                    OCTOPUS_ZONE, TIMEZONE)
+from octopus.octopus_api import GAS_PRICE, price_horizon
+from octopus.octopus_data import stored_time_series
+from octopus.price_series import PriceSeries, to_slot
+
+from ..models import TimeSeries
+
+from .charging import SLOT_HOURS, cheapest_charge_rows, fewest_starts_charge_rows, slots_for_energy
+
+# Local hour each day's plan is made. Prices for the coming night are published at 1600.
+BACKTEST_DECISION_HOUR = 16
+
+# (day offset, local hour) of the start and end of each load's window, from the decision day.
+CAR_WINDOW = ((0, 18), (1, 7))
+HOT_WATER_WINDOW = ((1, 0), (1, 6))
+
+# When a dumb overnight charging timer comes on (local hour).
+OVERNIGHT_START_HOUR = 0
+
+# kWh the car needs each night.
+CAR_ENERGY_KWH = 30
+
+# Days per unit of work sent to the process pool.
+BACKTEST_CHUNK_DAYS = 32
+
+Windows = namedtuple("Windows", ["starts", "in_window", "actual", "known"])
+
+
+class BacktestParams:
+    """
+    :param car_energy: kWh the car needs each night
+    :param charger_power: kW
+    :param start_penalty: See fewest_starts_charge
+    :param min_run: See fewest_starts_charge
+    :param heater_power: kW of the immersion heater (and heat from the boiler in the same time)
+    :param heating_slots: Half-hours of hot water each night
+    :param gas_price: p/kWh
+    :param gas_efficiency: Boiler efficiency. Defaults to settings.AE_GAS_EFFICIENCY.
+    """
+
+    def __init__(self,
+                 car_energy: float = CAR_ENERGY_KWH,
+                 charger_power: float = EV_CHARGER_KW,
+                 start_penalty: float = EV_START_PENALTY,
+                 min_run: int = EV_MIN_RUN_SLOTS,
+                 heater_power: float = HW_HEATER_KW,
+                 heating_slots: int = HW_HEATING_SLOTS,
+                 gas_price: float = GAS_PRICE,
+                 gas_efficiency: float = None):
+        self.car_energy = car_energy
+        self.charger_power = charger_power
+        self.start_penalty = start_penalty
+        self.min_run = min_run
+        self.heater_power = heater_power
+        self.heating_slots = heating_slots
+        self.gas_price = gas_price
+        self.gas_efficiency = settings.AE_GAS_EFFICIENCY if gas_efficiency is None else gas_efficiency
+
+    def power(self, load: str) -> float:
+        return self.charger_power if load == "car" else self.heater_power
+
+
+def stored_prices(start: datetime, end: datetime,
+                  product: str = OCTOPUS_PRODUCT,
+                  zone: str = OCTOPUS_ZONE) -> PriceSeries:
+    """
+    Electricity prices in [start, end) from the database only - nothing is fetched.
+    """
+    return stored_time_series(TimeSeries.prices(product, zone), start, end)
+
+
+def _local(day: date, offset_hour: (int, int)) -> datetime:
+    offset, hour = offset_hour
+    return TIMEZONE.localize(datetime.combine(day + timedelta(days=offset), time(hour=hour)))
+
+
+def day_windows(prices: PriceSeries, days: list, window, decision_hour: int = BACKTEST_DECISION_HOUR) -> Windows:
+    """
+    Stack each day's window of prices into rows.
+
+    :param prices: Price history
+    :param days: Local dates the decisions are made on
+    :param window: CAR_WINDOW, HOT_WATER_WINDOW or similar
+    :param decision_hour: Local hour the decision is made
+    :return: Windows of the first slot of each row, which columns are inside each day's window
+             (they differ in length across clock changes), the actual prices, and the prices that
+             had been published by the decision time (NaN where not).
+    """
+    starts = numpy.array([to_slot(_local(day, window[0])) for day in days], dtype=numpy.int64)
+    stops = numpy.array([to_slot(_local(day, window[1])) for day in days], dtype=numpy.int64)
+    horizons = numpy.array([to_slot(price_horizon(_local(day, (0, decision_hour)))) for day in days],
+                           dtype=numpy.int64)
+
+    width = int((stops - starts).max()) if len(days) else 0
+    slots = starts[:, None] + numpy.arange(width)
+    in_window = slots < stops[:, None]
+
+    index = slots - prices.origin
+    stored = in_window & (index >= 0) & (index < len(prices))
+    actual = numpy.where(stored, prices.values[numpy.clip(index, 0, max(len(prices) - 1, 0))], numpy.nan) \
+        if len(prices) else numpy.full(slots.shape, numpy.nan)
+    known = numpy.where(slots < horizons[:, None], actual, numpy.nan)
+
+    return Windows(starts, in_window, actual, known)
+
+
+def _timer(in_window: numpy.ndarray, slots_needed: float, first: int) -> numpy.ndarray:
+    """Flat out from column `first` until done (or the window ends)."""
+    after = numpy.arange(in_window.shape[1]) - first
+    return numpy.clip(slots_needed - after, 0, 1) * (after >= 0) * in_window
+
+
+def overnight_charge(windows: Windows, params: BacktestParams) -> (numpy.ndarray, numpy.ndarray):
+    first = (OVERNIGHT_START_HOUR - CAR_WINDOW[0][1]) % 24 * 2
+    elec = _timer(windows.in_window, slots_for_energy(params.car_energy, params.charger_power), first)
+    return elec, numpy.zeros_like(elec)
+
+
+def immediate_charge(windows: Windows, params: BacktestParams) -> (numpy.ndarray, numpy.ndarray):
+    elec = _timer(windows.in_window, slots_for_energy(params.car_energy, params.charger_power), 0)
+    return elec, numpy.zeros_like(elec)
+
+
+def cheapest_planned_charge(windows: Windows, params: BacktestParams) -> (numpy.ndarray, numpy.ndarray):
+    elec = cheapest_charge_rows(windows.known, params.car_energy, params.charger_power)
+    return elec, numpy.zeros_like(elec)
+
+
+def fewest_starts_planned_charge(windows: Windows, params: BacktestParams) -> (numpy.ndarray, numpy.ndarray):
+    elec = fewest_starts_charge_rows(windows.known, params.car_energy, params.charger_power,
+                                     start_penalty=params.start_penalty,
+                                     min_run=params.min_run)
+    return elec, numpy.zeros_like(elec)
+
+
+def planned_hot_water(windows: Windows, params: BacktestParams) -> (numpy.ndarray, numpy.ndarray):
+    chosen = cheapest_charge_rows(windows.known, params.heating_slots * params.heater_power * SLOT_HOURS,
+                                  params.heater_power) > 0
+    elec = chosen & (windows.known <= params.gas_price / params.gas_efficiency)
+    return elec.astype(numpy.float64), (chosen & ~elec).astype(numpy.float64)
+
+
+def gas_hot_water(windows: Windows, params: BacktestParams) -> (numpy.ndarray, numpy.ndarray):
+    gas = _timer(windows.in_window, params.heating_slots, 0)
+    return numpy.zeros_like(gas), gas
+
+
+# name: (load, strategy)
+STRATEGIES = {
+    "overnight": ("car", overnight_charge),
+    "immediate": ("car", immediate_charge),
+    "cheapest": ("car", cheapest_planned_charge),
+    "fewest_starts": ("car", fewest_starts_planned_charge),
+    "hot_water": ("hot_water", planned_hot_water),
+    "hot_water_gas": ("hot_water", gas_hot_water),
+}
+
+# What each load's savings are measured against.
+BASELINES = {"car": "overnight", "hot_water": "hot_water_gas"}
+
+
+def evaluate(names: list, windows: dict, params: BacktestParams) -> dict:
+    """
+    Run strategies over stacked days and cost them at the actual prices.
+
+    :param names: Strategy names
+    :param windows: {load: Windows}
+    :return: {name: {"cost", "kwh", "gas_kwh", "switches"}}, each an array with an entry per day
+    """
+    results = {}
+    for name in names:
+        load, strategy = STRATEGIES[name]
+        w = windows[load]
+        elec, gas = strategy(w, params)
+
+        kwh = elec * params.power(load) * SLOT_HOURS
+        gas_kwh = gas * params.power(load) * SLOT_HOURS
+        on = (elec > 0) | (gas > 0)
+        results[name] = {"cost": numpy.nansum(kwh * w.actual, axis=1)
+                                 + gas_kwh.sum(axis=1) * params.gas_price / params.gas_efficiency,
+                         "kwh": kwh.sum(axis=1),
+                         "gas_kwh": gas_kwh.sum(axis=1),
+                         "switches": on[:, 0] + numpy.count_nonzero(on[:, 1:] & ~on[:, :-1], axis=1)}
+    return results
+
+
+def _chunk(windows: Windows, rows: slice) -> Windows:
+    return Windows(*(array[rows] for array in windows))
+
+
+def run_backtest(prices: PriceSeries,
+                 first_day: date,
+                 last_day: date,
+                 strategies: list = None,
+                 params: BacktestParams = None,
+                 decision_hour: int = BACKTEST_DECISION_HOUR,
+                 processes: int = None,
+                 chunk_days: int = BACKTEST_CHUNK_DAYS) -> dict:
+    """
+    Backtest strategies over every day from first_day to last_day (inclusive). Days where any slot
+    of a load's window has no stored price are left out for that load's strategies.
+
+    :param prices: Price history, e.g. from stored_prices
+    :param strategies: Names from STRATEGIES. Defaults to all of them.
+    :param decision_hour: Local hour each day's plans are made.
+    :param processes: Worker processes. None for one per CPU, 1 to run in this process.
+    :return: {name: {"days", "cost" (pence), "kwh", "gas_kwh", "switches", "average" (p/kWh),
+             "saving" (pence, against the load's baseline)}}
+    """
+    strategies = list(STRATEGIES) if strategies is None else strategies
+    params = BacktestParams() if params is None else params
+
+    days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    loads = {STRATEGIES[name][0] for name in strategies}
+    windows = {load: day_windows(prices, days, CAR_WINDOW if load == "car" else HOT_WATER_WINDOW, decision_hour)
+               for load in loads}
+    names = list(dict.fromkeys(strategies + [BASELINES[load] for load in loads]))
+
+    chunks = [slice(i, i + chunk_days) for i in range(0, len(days), chunk_days)]
+    work = [{load: _chunk(w, rows) for load, w in windows.items()} for rows in chunks]
+    if processes == 1:
+        parts = [evaluate(names, chunk, params) for chunk in work]
+    else:
+        # Unpickling evaluate imports this module, and with it the models - so workers that are
+        # spawned rather than forked (macOS, Windows) need Django set up first.
+        with ProcessPoolExecutor(max_workers=processes, initializer=django.setup) as pool:
+            parts = list(pool.map(evaluate, [names] * len(work), work, [params] * len(work)))
+
+    results = {}
+    for name in names:
+        load = STRATEGIES[name][0]
+        w = windows[load]
+        complete = ~(w.in_window & numpy.isnan(w.actual)).any(axis=1)
+        daily = {key: numpy.concatenate([part[name][key] for part in parts])[complete]
+                 for key in ("cost", "kwh", "gas_kwh", "switches")}
+        energy = daily["kwh"].sum() + daily["gas_kwh"].sum()
+        results[name] = {"days": int(complete.sum()),
+                         "cost": float(daily["cost"].sum()),
+                         "kwh": float(daily["kwh"].sum()),
+                         "gas_kwh": float(daily["gas_kwh"].sum()),
+                         "switches": int(daily["switches"].sum()),
+                         "average": float(daily["cost"].sum() / energy) if energy else numpy.nan}
+        if complete.sum() < len(days):
+            logging.info(f"Backtest {name}: {len(days) - complete.sum()} days without complete prices left out")
+
+    for name, result in results.items():
+        result["saving"] = results[BASELINES[STRATEGIES[name][0]]]["cost"] - result["cost"]
+
+    return {name: results[name] for name in strategies}
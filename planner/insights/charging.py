@@ -0,0 +1,297 @@
+"""Choosing half-hour slots to charge an EV in.
+
+Everything here works on a plain array of half-hourly prices (NaN = can't charge then) and
+returns, for each slot, the fraction of it to charge for. Turning that into periods and
+saving them is EnergyPlanner's job.
+"""
+
+import math
+
+import numpy
+
+from octopus.price_series import SLOT_SECONDS
+
+SLOT_HOURS = SLOT_SECONDS / 3600
+
+CHARGING_MODES = ("cheapest", "fewest_starts")
+
+
+def slots_for_energy(energy_needed: float, charger_power: float) -> float:
+    """
+    Number of (possibly fractional) slots needed to deliver energy_needed kWh at charger_power kW.
+    """
+    assert charger_power > 0, "charger_power must be positive"
+    # Rounded so that e.g. 4.0000000001 slots doesn't become a sliver of a fifth.
+    return round(max(energy_needed, 0) / (charger_power * SLOT_HOURS), 6)
+
+
+def cheapest_charge(prices: numpy.ndarray,
+                    energy_needed: float,
+                    charger_power: float) -> numpy.ndarray:
+    """
+    Charge in the cheapest slots, the most expensive of which may be partial.
+
+    Only the slots needed are found (argpartition) and sorted, so this is O(n + k log k) for n
+    slots of which k are used. If there aren't enough slots it charges in all of them.
+
+    :param prices: Half-hourly prices, NaN for slots we can't charge in.
+    :param energy_needed: kWh
+    :param charger_power: kW
+    :return: Fraction of each slot to charge for (0-1)
+    """
+    slots_needed = slots_for_energy(energy_needed, charger_power)
+    fractions = numpy.zeros(len(prices))
+
+    candidates = numpy.flatnonzero(~numpy.isnan(prices))
+    k = min(math.ceil(slots_needed), len(candidates))
+    if k == 0:
+        return fractions
+
+    if k < len(candidates):
+        candidates = candidates[numpy.argpartition(prices[candidates], k - 1)[:k]]
+    chosen = candidates[numpy.lexsort((candidates, prices[candidates]))]
+
+    fractions[chosen] = 1.0
+    if k == math.ceil(slots_needed) and slots_needed % 1:
+        fractions[chosen[-1]] = slots_needed % 1
+
+    return fractions
+
+
+def cheapest_charge_rows(prices: numpy.ndarray,
+                         energy_needed: float,
+                         charger_power: float) -> numpy.ndarray:
+    """
+    cheapest_charge for every row of a 2-D array of prices (e.g. one row per night) at once. Ties
+    go to the earlier slot, as in cheapest_charge.
+
+    :return: Fraction of each slot to charge for, same shape as prices
+    """
+    slots_needed = slots_for_energy(energy_needed, charger_power)
+    missing = numpy.isnan(prices)
+
+    order = numpy.argsort(numpy.where(missing, numpy.inf, prices), axis=1, kind="stable")
+    rank = numpy.empty_like(order)
+    numpy.put_along_axis(rank, order, numpy.broadcast_to(numpy.arange(prices.shape[1]), prices.shape), axis=1)
+
+    fractions = numpy.clip(slots_needed - rank, 0, 1)
+    fractions[missing] = 0
+    return fractions
+
+
+def fewest_starts_charge(prices: numpy.ndarray,
+                         energy_needed: float,
+                         charger_power: float,
+                         start_penalty: float,
+                         min_run: int = 1) -> numpy.ndarray:
+    """
+    Charge for the lowest cost plus `start_penalty` for every time charging is started, with each
+    run lasting at least `min_run` slots.
+
+    Dynamic program over the slots: the state is (slots charged so far, slots into the current run,
+    capped at min_run), so it is O(n·k·min_run) for n slots of which k are used. If the energy can't
+    all be delivered, delivers as much as it can.
+
+    :param prices: Half-hourly prices (p/kWh), NaN for slots we can't charge in.
+    :param energy_needed: kWh
+    :param charger_power: kW
+    :param start_penalty: pence added to the cost of each start
+    :param min_run: Minimum slots per run - or all of them, if fewer are needed
+    :return: Fraction of each slot to charge for (0-1)
+    """
+    assert min_run >= 1, "min_run must be at least 1"
+    slots_needed = slots_for_energy(energy_needed, charger_power)
+    k = min(math.ceil(slots_needed), int(numpy.count_nonzero(~numpy.isnan(prices))))
+    n, m = len(prices), min(min_run, k)    # Needing less than min_run slots, one run of what's needed
+    fractions = numpy.zeros(n)
+    if k == 0:
+        return fractions
+
+    slot_costs = prices * charger_power * SLOT_HOURS
+
+    # cost[state, j]: cheapest way to have charged j slots so far, where state 0 is "not charging"
+    # and state r >= 1 is "r slots into a run" (m meaning m or more). pred[t, state, j] is the
+    # state at the previous slot; j drops by one if state >= 1.
+    cost = numpy.full((m + 1, k + 1), numpy.inf)
+    cost[0, 0] = 0
+    pred = numpy.zeros((n, m + 1, k + 1), dtype=numpy.int8 if m < 127 else numpy.int32)
+
+    for t in range(n):
+        new = numpy.full_like(cost, numpy.inf)
+
+        # Stop (or stay stopped). Runs shorter than min_run can't stop.
+        stop_from_run = cost[m] < cost[0]
+        new[0] = numpy.where(stop_from_run, cost[m], cost[0])
+        pred[t, 0] = numpy.where(stop_from_run, m, 0)
+
+        if not numpy.isnan(slot_costs[t]):
+            # Continue a run; runs already at min_run stay there.
+            for r in range(m, 0, -1):
+                target = min(r + 1, m)
+                better = cost[r, :-1] < new[target, 1:]
+                new[target, 1:] = numpy.where(better, cost[r, :-1], new[target, 1:])
+                pred[t, target, 1:] = numpy.where(better, r, pred[t, target, 1:])
+
+            # Start a run.
+            started = cost[0, :-1] + start_penalty
+            better = started < new[1, 1:]
+            new[1, 1:] = numpy.where(better, started, new[1, 1:])
+            pred[t, 1, 1:] = numpy.where(better, 0, pred[t, 1, 1:])
+
+            new[1:, 1:] += slot_costs[t]
+
+        cost = new
+
+    # Finish stopped or in a long enough run, with as many slots as possible.
+    final = numpy.minimum(cost[0], cost[m])
+    j = int(numpy.flatnonzero(numpy.isfinite(final))[-1])
+    state = 0 if cost[0, j] <= cost[m, j] else m
+
+    for t in range(n - 1, -1, -1):
+        previous = pred[t, state, j]
+        if state:
+            fractions[t] = 1.0
+            j -= 1
+        state = previous
+
+    if fractions.any() and fractions.sum() == math.ceil(slots_needed) and slots_needed % 1:
+        # Trim the most expensive slot at either end of a run, so no run is split.
+        on = fractions > 0
+        ends = on & ~(numpy.append(on[1:], False) & numpy.insert(on[:-1], 0, False))
+        candidates = numpy.flatnonzero(ends)
+        fractions[candidates[numpy.argmax(prices[candidates])]] = slots_needed % 1
+
+    return fractions
+
+
+def fewest_starts_charge_rows(prices: numpy.ndarray,
+                              energy_needed: float,
+                              charger_power: float,
+                              start_penalty: float,
+                              min_run: int = 1) -> numpy.ndarray:
+    """
+    fewest_starts_charge for every row of a 2-D array of prices (e.g. one row per night) at once.
+    The program steps through the columns once, with every row's states updated together - for one
+    row fewest_starts_charge is quicker.
+
+    :return: Fraction of each slot to charge for, same shape as prices
+    """
+    assert min_run >= 1, "min_run must be at least 1"
+    slots_needed = slots_for_energy(energy_needed, charger_power)
+    rows, n = prices.shape
+    k = math.ceil(slots_needed)
+    m = min(min_run, k)     # Needing less than min_run slots, one run of what's needed
+    fractions = numpy.zeros((rows, n))
+    if k == 0 or not rows:
+        return fractions
+
+    slot_costs = prices * charger_power * SLOT_HOURS
+    usable = ~numpy.isnan(slot_costs)
+
+    # cost[row, state, j]: cheapest way to have charged j slots so far, where state 0 is "not
+    # charging" and state r >= 1 is "r slots into a run" (m meaning m or more). pred[t, row, state, j]
+    # is the state at the previous slot; j drops by one if state >= 1.
+    cost = numpy.full((rows, m + 1, k + 1), numpy.inf)
+    cost[:, 0, 0] = 0
+    pred = numpy.zeros((n, rows, m + 1, k + 1), dtype=numpy.int8 if m < 127 else numpy.int32)
+
+    for t in range(n):
+        new = numpy.full_like(cost, numpy.inf)
+
+        # Stop (or stay stopped). Runs shorter than min_run can't stop.
+        stop_from_run = cost[:, m] < cost[:, 0]
+        new[:, 0] = numpy.where(stop_from_run, cost[:, m], cost[:, 0])
+        pred[t, :, 0] = numpy.where(stop_from_run, m, 0)
+
+        # Continue a run; runs already at min_run stay there.
+        for r in range(m, 0, -1):
+            target = min(r + 1, m)
+            better = cost[:, r, :-1] < new[:, target, 1:]
+            new[:, target, 1:] = numpy.where(better, cost[:, r, :-1], new[:, target, 1:])
+            pred[t, :, target, 1:] = numpy.where(better, r, pred[t, :, target, 1:])
+
+        # Start a run.
+        started = cost[:, 0, :-1] + start_penalty
+        better = started < new[:, 1, 1:]
+        new[:, 1, 1:] = numpy.where(better, started, new[:, 1, 1:])
+        pred[t, :, 1, 1:] = numpy.where(better, 0, pred[t, :, 1, 1:])
+
+        # Rows that can't charge in this slot can only be stopped.
+        on = usable[:, t, None, None]
+        slot_cost = numpy.where(usable[:, t], slot_costs[:, t], 0)[:, None, None]
+        new[:, 1:, 1:] = numpy.where(on, new[:, 1:, 1:] + slot_cost, numpy.inf)
+        pred[t, :, 1:] = numpy.where(on, pred[t, :, 1:], 0)
+
+        cost = new
+
+    # Finish stopped or in a long enough run, with as many slots as possible.
+    final = numpy.minimum(cost[:, 0], cost[:, m])
+    index = numpy.arange(rows)
+    j = k - numpy.argmax(numpy.isfinite(final[:, ::-1]), axis=1)
+    state = numpy.where(cost[index, 0, j] <= cost[index, m, j], 0, m)
+
+    for t in range(n - 1, -1, -1):
+        previous = pred[t, index, state, j]
+        charging = state > 0
+        fractions[charging, t] = 1.0
+        j = j - charging
+        state = previous
+
+    if slots_needed % 1:
+        # Trim the most expensive slot at either end of a run, so no run is split.
+        on = fractions > 0
+        ends = on & ~(numpy.pad(on[:, 1:], ((0, 0), (0, 1))) & numpy.pad(on[:, :-1], ((0, 0), (1, 0))))
+        trim = numpy.flatnonzero(fractions.sum(axis=1) == k)
+        ends_prices = numpy.where(ends[trim], prices[trim], -numpy.inf)
+        fractions[trim, numpy.argmax(ends_prices, axis=1)] = slots_needed % 1
+
+    return fractions
+
+
+def count_starts(fractions: numpy.ndarray) -> int:
+    """
+    Number of separate charging runs in a plan.
+    """
+    on = fractions > 0
+    return int(numpy.count_nonzero(on & ~numpy.insert(on[:-1], 0, False)))
+
+
+def charging_intervals(origin: int, fractions: numpy.ndarray) -> list[tuple[int, int]]:
+    """
+    Turn per-slot charging fractions into (start, stop) unix-time intervals, merging touching ones.
+
+    A partial slot charges at its start, unless the next slot is charging too, in which case it
+    charges at its end to save a stop/start.
+
+    :param origin: Slot index of fractions[0]
+    :param fractions: From cheapest_charge (or similar)
+    """
+    on = numpy.flatnonzero(fractions > 0)
+    if not len(on):
+        return []
+
+    f = fractions[on]
+    next_on = numpy.append(fractions[1:] > 0, False)[on]
+
+    starts = (origin + on) * SLOT_SECONDS + numpy.where((f < 1) & next_on, (1 - f) * SLOT_SECONDS, 0)
+    starts = numpy.round(starts).astype(numpy.int64)
+    stops = starts + numpy.round(f * SLOT_SECONDS).astype(numpy.int64)
+
+    breaks = numpy.flatnonzero(starts[1:] != stops[:-1])
+    run_starts = starts[numpy.concatenate(([0], breaks + 1))]
+    run_stops = stops[numpy.concatenate((breaks, [len(stops) - 1]))]
+
+    return list(zip(run_starts.tolist(), run_stops.tolist()))
+
+
+def charge_cost(prices: numpy.ndarray, fractions: numpy.ndarray, charger_power: float) -> (float, float):
+    """
+    Expected cost of a charging plan.
+
+    :return: (total cost in pence, average p/kWh - 0 if nothing is charged)
+    """
+    energy = fractions * charger_power * SLOT_HOURS
+    charging = energy > 0
+    total = float(numpy.dot(prices[charging], energy[charging]))
+    kwh = float(energy.sum())
+    return total, (total / kwh if kwh else 0.0)
@@ -0,0 +1,93 @@
+"""The dashboard and daily email, worked out once per set of published prices.
+
+Prices only change once a day, so best/peak windows, averages and graphs are built the first time
+they're asked for after new prices land, stored as a DailyInsights row keyed by price version, and
+read back with a single indexed lookup after that.
+"""
+
+import logging
+from datetime import datetime, timezone
+
+from django.db import IntegrityError, transaction
+
+from config import USAGE_WINDOW_HOURS
+from octopus.price_series import to_slot
+
+from ..models import DailyInsights
+
+from .exceptions import NoCrystalBall
+from .visualisation_tools import plot_html, plot_png
+
+# Window length (hours) headlined as "Best" and "Peak"
+HEADLINE_WINDOW_HOURS = 3
+
+
+def price_version(planner) -> int:
+    """
+    Version of the prices `planner` currently has: the slot index of the end of the data.
+    """
+    last_time = planner.ep_series_from_now().last_time
+    if last_time is None:
+        raise NoCrystalBall("No price data.")
+    return to_slot(last_time) + 1
+
+
+def build_daily_insights(planner, version: int) -> DailyInsights:
+    """
+    Work out and save the DailyInsights for the planner's current prices. If another worker saves
+    the same version first, theirs is returned.
+    """
+    ep_pd = planner.ep_df_from_now()
+    gp_pd = planner.gp_df_from_now()
+
+    windows = planner.plan_usage_windows(sorted(set(USAGE_WINDOW_HOURS) | {HEADLINE_WINDOW_HOURS}))
+    (best, best_price), = windows[HEADLINE_WINDOW_HOURS]["best"]
+    (peak, peak_price), = windows[HEADLINE_WINDOW_HOURS]["peak"]
+
+    window_rows = []
+    for hours in USAGE_WINDOW_HOURS:
+        if not windows[hours]["best"]:
+            continue        # Not enough data for a window this long
+        (best_window, best_window_price), = windows[hours]["best"]
+        (peak_window, peak_window_price), = windows[hours]["peak"]
+        window_rows.append([hours,
+                            best_window[0].isoformat(), best_window[1].isoformat(), best_window_price,
+                            peak_window[0].isoformat(), peak_window[1].isoformat(), peak_window_price])
+
+    appliance_rows = [[name, start.isoformat(), stop.isoformat(), cost]
+                      for name, ((start, stop), cost) in planner.plan_appliances().items()]
+
+    # The "now" marker would be stale for most of the day, so leave it off the stored dashboard graph.
+    graph_script, graph_div = plot_html([ep_pd, gp_pd], show_now_marker=False, starts_and_stops=[best, peak])
+    png = plot_png([ep_pd, gp_pd], starts_and_stops=[best, peak])
+
+    insights = DailyInsights(version=version,
+                             created=datetime.now(tz=timezone.utc),
+                             best_start=best[0], best_stop=best[1], best_price=best_price,
+                             peak_start=peak[0], peak_stop=peak[1], peak_price=peak_price,
+                             average=planner.average_price(),
+                             average_excluding_peak=planner.average_price(excluded_periods=[peak]),
+                             windows=window_rows,
+                             appliances=appliance_rows,
+                             graph_script=graph_script,
+                             graph_div=graph_div,
+                             png=png)
+    try:
+        with transaction.atomic():
+            insights.save()
+    except IntegrityError:
+        logging.info(f"DailyInsights for version {version} built concurrently. Using that.")
+        insights = DailyInsights.objects.get(version=version)
+
+    return insights
+
+
+def get_daily_insights(planner) -> DailyInsights:
+    """
+    Get the DailyInsights for the planner's current prices, building them if this is the first ask.
+    """
+    version = price_version(planner)
+    insights = DailyInsights.objects.filter(version=version).first()
+    if insights is None:
+        insights = build_daily_insights(planner, version)
+    return insights
@@ -1,5 +1,6 @@
 
 from datetime import timedelta, datetime, timezone
+import numpy
 import pandas
 
 from config import *
@@ -12,26 +13,18 @@ def find_contiguous_periods(target_times: pandas.DataFrame):
     :param target_times: List of start times for 30m slots..
     """
 
-    contiguous_periods = []
-
     # Sort them to make sure they are in date order, or things break
-    target_times = target_times.sort_values()
+    target_times = pandas.DatetimeIndex(target_times).sort_values()
 
     if not len(target_times):
-        return contiguous_periods
+        return []
 
-    start = target_times[0]
-    last_period = target_times[0]
-    for t in target_times[1:]:
-        if t != last_period + timedelta(minutes=30):
-            period = (start, last_period + timedelta(minutes=30))
-            contiguous_periods.append(period)
-            start = t
-        last_period = t
-    period = (start, last_period + timedelta(minutes=30))
-    contiguous_periods.append(period)
+    # A new period starts wherever the gap to the previous slot isn't 30m.
+    breaks = numpy.flatnonzero((target_times[1:] - target_times[:-1]) != timedelta(minutes=30))
+    starts = target_times[numpy.concatenate(([0], breaks + 1))]
+    stops = target_times[numpy.concatenate((breaks, [len(target_times) - 1]))] + timedelta(minutes=30)
 
-    return contiguous_periods
+    return list(zip(starts, stops))
 
 
 def start_of_current_period():
@@ -73,18 +66,33 @@ def format_short_date_range(ss: (datetime, datetime), tz=TIMEZONE):
     stop_local = stop.astimezone(tz)
     date_string = datetime.strftime(start_local, "%a %d %H%M")
     date_string += datetime.strftime(stop_local, "-%H%M")
-    if start.day != stop.day:
-        assert stop.day == start.day + 1, "Stop day must be same day, or the day after, start day."
+    if start_local.date() != stop_local.date():
+        assert stop_local.date() == start_local.date() + timedelta(days=1), \
+            "Stop day must be same day, or the day after, start day."
         date_string += "*"  # * indicates next day
     return date_string
 
 
 def drop_periods_from_df(df: pandas.DataFrame,
                          periods: list[(datetime, datetime)]) -> pandas.DataFrame:
+    """
+    Drop the rows in each (start, stop) period from a time-indexed DataFrame.
+
+    :param df: DataFrame indexed by (tz aware) slot start times
+    :param periods: (start, stop) periods to drop
+    """
+
+    if not periods or not len(df):
+        return df
+
+    periods = sorted(periods)
+    starts = pandas.to_datetime([start for start, _ in periods], utc=True)
+    # The last slot start in each period. Periods can overlap, so take the running max.
+    last_slots = numpy.maximum.accumulate(
+        pandas.to_datetime([stop for _, stop in periods], utc=True) - timedelta(minutes=30))
+
+    times = df.index.tz_convert("UTC")
+    i = starts.searchsorted(times, side="right") - 1
+    dropped = (i >= 0) & (times <= last_slots[numpy.maximum(i, 0)])
 
-    periods_to_drop = []
-    for period in periods:
-        (start, stop) = period
-        periods_to_drop += list(df[start:stop - timedelta(minutes=30)].index)
-    df = df.drop(index=periods_to_drop)
-    return df
\ No newline at end of file
+    return df[~dropped]
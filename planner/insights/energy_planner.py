@@ -1,11 +1,21 @@
 from datetime import datetime, timedelta, timezone
 from tzlocal import get_localzone
+import heapq
+import numpy
 import pandas
 import logging
 
+from config import (EV_CHARGER_KW, EV_MIN_RUN_SLOTS, EV_START_PENALTY, HW_HEATER_KW, HW_HEATING_SLOTS,
+                    SITE_IMPORT_LIMIT_KW, TIMEZONE)
+from octopus.price_series import PriceSeries, from_slot, local_days, slot_runs, to_slot
+
 from ..models import CarChargingSession, CarChargingPeriod, WaterHeatingPeriod, SystemStatus
 
-from .data_tools import find_contiguous_periods, start_of_current_period, drop_periods_from_df
+from .appliances import APPLIANCES, start_costs
+from .charging import (CHARGING_MODES, SLOT_HOURS, charge_cost, charging_intervals, cheapest_charge, count_starts,
+                       fewest_starts_charge, slots_for_energy)
+from .data_tools import start_of_current_period
+from .household import FlexibleLoad, ShiftableLoad, schedule_loads
 from .exceptions import NoSolutions, NoCrystalBall
 
 from django.conf import settings
@@ -19,31 +29,45 @@ class EnergyPlanner:
         self.energy_provider = energy_provider
         self.car = car
 
-    def ep_df_from_now(self,
-                       excluded_periods: list[(datetime, datetime)] = None,
-                       column_name: str = 'electricity price') -> pandas.DataFrame:
+    def ep_series_from_now(self,
+                           excluded_periods: list[(datetime, datetime)] = None,
+                           start_time: datetime = None) -> PriceSeries:
+        """
+        Get electricity prices from the start of the current period (or `start_time`) as a PriceSeries.
+        Excluded periods are set to NaN.
+        """
 
-        start_time = start_of_current_period()
+        if start_time is None:
+            start_time = start_of_current_period()
         ep = self.energy_provider.get_elec_price(start_time)
-        ep_pd = pandas.DataFrame.from_dict(ep, orient="index", columns=[column_name]).sort_index()
 
         if excluded_periods is not None:
-            ep_pd = drop_periods_from_df(ep_pd, excluded_periods)
+            ep = ep.excluding(excluded_periods)
 
-        return ep_pd
+        return ep
 
-    def gp_df_from_now(self,
-                       excluded_periods: (datetime, datetime) = None,
-                       column_name: str = 'gas price') -> pandas.DataFrame:
+    def gp_series_from_now(self,
+                           excluded_periods: list[(datetime, datetime)] = None) -> PriceSeries:
 
-        start_time = start_of_current_period()
-        gp = self.energy_provider.get_gas_price(start_time)
-        gp_pd = pandas.DataFrame.from_dict(gp, orient="index", columns=[column_name]).sort_index()
+        gp = self.energy_provider.get_gas_price(start_of_current_period())
 
         if excluded_periods is not None:
-            gp_pd = drop_periods_from_df(gp_pd, excluded_periods)
+            gp = gp.excluding(excluded_periods)
+
+        return gp
 
-        return gp_pd
+    def ep_df_from_now(self,
+                       excluded_periods: list[(datetime, datetime)] = None,
+                       column_name: str = 'electricity price',
+                       start_time: datetime = None) -> pandas.DataFrame:
+
+        return self.ep_series_from_now(excluded_periods, start_time).to_df(column_name)
+
+    def gp_df_from_now(self,
+                       excluded_periods: (datetime, datetime) = None,
+                       column_name: str = 'gas price') -> pandas.DataFrame:
+
+        return self.gp_series_from_now(excluded_periods).to_df(column_name)
 
     @property
     def tomorrows_data_available(self) -> bool:
@@ -56,9 +80,8 @@ class EnergyPlanner:
         :return: bool
         """
         now = datetime.now(tz=timezone.utc)
-        prices_dict = self.ep_df_from_now()
-        last_time = max(prices_dict.index)
-        if last_time.day > now.day:
+        last_time = self.ep_series_from_now().last_time
+        if last_time is not None and last_time.date() > now.date():
             return True
         return False
 
@@ -71,9 +94,144 @@ class EnergyPlanner:
         :return:
         """
 
-        ep_pd = self.ep_df_from_now(excluded_periods=excluded_periods)
+        return self.ep_series_from_now(excluded_periods=excluded_periods).mean()
 
-        return ep_pd.mean()[0]
+    def plan_usage_windows(self,
+                           durations: list[float],
+                           top_k: int = 1,
+                           excluded_periods: (datetime, datetime) = None) -> dict:
+        """
+        For several window lengths at once - find the contiguous periods with the lowest ("best")
+        and highest ("peak") average price.
+
+        The running totals are computed once and every window length is read off them, so a whole
+        table of durations costs about the same as one.
+
+        :param durations: Window lengths in hours (multiples of 0.5)
+        :param top_k: How many windows to return per duration and mode. These can overlap.
+        :param excluded_periods: (start, stop) periods to exclude from the averages
+        :return: {hours: {"best": [((start, stop), mean price), ...], "peak": [...]}}, cheapest/dearest first.
+        """
+
+        ep = self.ep_series_from_now(excluded_periods=excluded_periods)
+        prefix_sums = ep.prefix_sums()
+
+        windows = {}
+        for hours in durations:
+            assert hours > 0 and hours * 2 % 1 == 0, "hours must be a positive multiple of 0.5"
+            periods_needed = int(hours * 2)
+
+            # Element i is the mean of the window starting at slot (origin + i).
+            means = ep.window_means(periods_needed, prefix_sums)
+            windows[hours] = {"best": self._select_windows(ep, means, periods_needed, top_k),
+                              "peak": self._select_windows(ep, -means, periods_needed, top_k, negated=True)}
+
+        return windows
+
+    @staticmethod
+    def _select_windows(ep: PriceSeries,
+                        means: numpy.ndarray,
+                        periods: int,
+                        top_k: int,
+                        negated: bool = False) -> list:
+        """
+        The top_k windows with the lowest means, lowest first (earliest first on ties).
+        """
+        candidates = numpy.flatnonzero(~numpy.isnan(means))
+        if not len(candidates) or top_k < 1:
+            return []
+
+        if top_k == 1:
+            chosen = candidates[[numpy.argmin(means[candidates])]]
+        else:
+            if top_k < len(candidates):
+                candidates = candidates[numpy.argpartition(means[candidates], top_k - 1)[:top_k]]
+            chosen = candidates[numpy.lexsort((candidates, means[candidates]))]
+
+        sign = -1 if negated else 1
+        return [((from_slot(ep.origin + i), from_slot(ep.origin + i + periods)), sign * float(means[i]))
+                for i in chosen]
+
+    def plan_separate_windows(self,
+                              hours: float = 2,
+                              k: int = 3,
+                              mode: str = "best",
+                              per_day: bool = False,
+                              excluded_periods: (datetime, datetime) = None) -> list:
+        """
+        Find the k best (or peak) windows of a given length that don't overlap each other. e.g. "the
+        three best 2h slots", or with per_day, "the best 2h slot on each day".
+
+        Windows are taken cheapest first from a heap of every window mean, skipping any that overlap
+        one already chosen.
+
+        :param hours: Size of the window
+        :param k: Windows wanted (per local calendar day if per_day)
+        :param mode: "best" or "peak"
+        :param per_day: Choose k windows for each calendar day (config.TIMEZONE) that a window starts on.
+        :param excluded_periods: (start, stop) periods to exclude from the averages
+        :return: [((start, stop), mean price), ...] in time order. [ss for ss, _ in result] can be
+                 passed to plot_html/plot_png as starts_and_stops.
+        """
+
+        assert hours * 2 % 1 == 0, "smallest increment of hours is 0.5"
+        assert mode in ["best", "peak"], "'mode' must be 'best' or 'peak'"
+        periods_needed = int(hours * 2)
+
+        ep = self.ep_series_from_now(excluded_periods=excluded_periods)
+        means = ep.window_means(periods_needed)
+        sign = 1 if mode == "best" else -1
+
+        candidates = numpy.flatnonzero(~numpy.isnan(means))
+        days = local_days(ep.origin + candidates, TIMEZONE) if per_day else numpy.zeros(len(candidates), dtype=int)
+
+        heap = list(zip((sign * means[candidates]).tolist(), candidates.tolist(), days.tolist()))
+        heapq.heapify(heap)
+
+        occupied = numpy.zeros(len(ep), dtype=bool)
+        chosen_per_day = {}
+        chosen = []
+        wanted = k * len(numpy.unique(days))
+        while heap and len(chosen) < wanted:
+            _, i, day = heapq.heappop(heap)
+            if chosen_per_day.get(day, 0) >= k or occupied[i:i + periods_needed].any():
+                continue
+            occupied[i:i + periods_needed] = True
+            chosen_per_day[day] = chosen_per_day.get(day, 0) + 1
+            chosen.append(i)
+
+        return [((from_slot(ep.origin + i), from_slot(ep.origin + i + periods_needed)), float(means[i]))
+                for i in sorted(chosen)]
+
+    def plan_appliances(self,
+                        profiles: dict = None,
+                        excluded_periods: (datetime, datetime) = None) -> dict:
+        """
+        Find the cheapest time to start each appliance, accounting for when in its run it draws power
+        (see planner.insights.appliances).
+
+        :param profiles: {name: kWh per half-hour}. Defaults to all registered appliances.
+        :param excluded_periods: (start, stop) periods the appliance mustn't run in
+        :return: {name: ((start, stop), expected cost in pence)}. Appliances that can't fit in the
+                 available data are left out.
+        """
+
+        if profiles is None:
+            profiles = APPLIANCES
+
+        ep = self.ep_series_from_now(excluded_periods=excluded_periods)
+
+        plans = {}
+        for name, profile in profiles.items():
+            profile = numpy.asarray(profile, dtype=numpy.float64)
+            costs = start_costs(ep.values, profile)
+            if not len(costs) or numpy.isnan(costs).all():
+                continue
+
+            i = numpy.nanargmin(costs)
+            plans[name] = ((from_slot(ep.origin + i), from_slot(ep.origin + i + len(profile))), float(costs[i]))
+
+        return plans
 
     def plan_usage_periods(self,
                            hours: float = 2,
@@ -86,92 +244,137 @@ class EnergyPlanner:
         Useful to plan times to use (or not use) energy. Clearly assumes equal
         usage over the period which may well not be the case.
 
+        To get several durations, or both modes, use plan_usage_windows.
+
         :param excluded_periods: (start, stop) periods to exclude from the averages
         :param hours: Size of the window
         :param mode: "best" or "peak"
         :return: (start, stop), mean price
         """
 
-        assert hours * 2 % 1 == 0, "smallest increment of hours is 0.5"
-        periods_needed = int(hours * 2)
-
         assert mode in ["best", "peak"], "'mode' must be 'best' or 'peak'"
 
-        ep_pd = self.ep_df_from_now(excluded_periods=excluded_periods)
-
-        window = ep_pd.rolling(timedelta(minutes=30) * periods_needed, min_periods=periods_needed).mean()
-        # The window is backwards looking, so the result will be for the start of the last period.
-        # Hence, usage should stop 30m later, start time calculated from end time.
-        cheapest = window.min()[0]
-        cheapest_stop = window.idxmin()[0] + timedelta(minutes=30)
-        cheapest_start = cheapest_stop - timedelta(minutes=30) * periods_needed
-
-        dearest = window.max()[0]
-        dearest_stop = window.idxmax()[0] + timedelta(minutes=30)
-        dearest_start = dearest_stop - timedelta(minutes=30) * periods_needed
+        windows = self.plan_usage_windows([hours], excluded_periods=excluded_periods)[hours][mode]
+        if not windows:
+            raise NoSolutions(f"No {hours}h window available in the price data.")
 
-        if mode == "best":
-            starts_stops = [(cheapest_start, cheapest_stop)]
-            return starts_stops, cheapest
-
-        elif mode == "peak":
-            starts_stops = [(dearest_start, dearest_stop)]
-            return starts_stops, dearest
+        (start_stop, price), = windows
+        return [start_stop], price
 
     def plan_car_charging(self,
                           departure: datetime = None,
                           hours_needed: float = None,
-                          max_cost: float = None) -> [(datetime, datetime)]:
+                          max_cost: float = None,
+                          energy_needed: float = None,
+                          charger_power: float = None,
+                          mode: str = "cheapest") -> CarChargingSession:
         """
         Find the cheapest set of half-hour segments to charge car. Pass in a departure time
         (or will assume you want to depart at the end of the data available from energy API).
 
-        Assumes 100% usage across all hours needed (i.e. no probability distribution)
+        The last (most expensive) slot used may only be partly needed, in which case only that part
+        of it is planned.
 
         :param departure: Target departure time. If not provided, will use end time of price data returned by API.
-        :param hours_needed: Hours of charging wanted. If not provided, will use Tesla API to calculate based on SOC.
+        :param hours_needed: Hours of charging wanted, at charger_power.
         :param max_cost: Don't pay more than this per kWh.
-        :return:
+        :param energy_needed: kWh wanted. Takes precedence over hours_needed. If neither is provided, will
+                              use Tesla API to calculate based on SOC.
+        :param charger_power: kW the car charges at. Defaults to config.EV_CHARGER_KW.
+        :param mode: "cheapest" for the cheapest slots, however fragmented, or "fewest_starts" to trade
+                     price against config.EV_START_PENALTY per start, with runs of at least
+                     config.EV_MIN_RUN_SLOTS.
+        :return: The (unscheduled) CarChargingSession
+        """
+        ep, fractions, charger_power = self._plan_charging(departure, hours_needed, max_cost,
+                                                           energy_needed, charger_power, mode)
+        return self._save_charging_plan(ep, fractions, charger_power, departure)
+
+    def compare_charging_modes(self,
+                               departure: datetime = None,
+                               hours_needed: float = None,
+                               max_cost: float = None,
+                               energy_needed: float = None,
+                               charger_power: float = None) -> dict:
         """
+        Plan charging in each of CHARGING_MODES without saving anything, to compare them.
+        Takes the same arguments as plan_car_charging.
 
-        if hours_needed is None:
-            assert self.car is not None, "No car, either specific hours_needed, or re-initiate class with car."
-            periods = int(self.car.hours_to_target_soc * 2) + 1
-        else:
-            assert hours_needed * 2 % 1 == 0, "smallest increment of hours is 0.5"
-            periods = int(hours_needed * 2)
+        :return: {mode: {"cost": pence, "average_cost": p/kWh, "starts": number of starts}}
+        """
+        results = {}
+        for mode in CHARGING_MODES:
+            ep, fractions, power = self._plan_charging(departure, hours_needed, max_cost,
+                                                       energy_needed, charger_power, mode)
+            cost, average_cost = charge_cost(ep.values, fractions, power)
+            results[mode] = {"cost": cost, "average_cost": average_cost, "starts": count_starts(fractions)}
+        return results
+
+    def _plan_charging(self, departure, hours_needed, max_cost, energy_needed, charger_power, mode):
+        """
+        Work out which (parts of) slots to charge in. See plan_car_charging.
+
+        :return: (prices up to departure, per-slot charging fractions, charger_power)
+        """
+        if mode not in CHARGING_MODES:
+            raise ValueError(f"Unknown charging mode '{mode}'. Options: {', '.join(CHARGING_MODES)}")
+
+        if charger_power is None:
+            charger_power = EV_CHARGER_KW
 
-        ep_pd = self.ep_df_from_now()
-        data_end = max(ep_pd.index)
+        if energy_needed is None:
+            if hours_needed is None:
+                assert self.car is not None, "No car, either specific hours_needed, or re-initiate class with car."
+                hours_needed = self.car.hours_to_target_soc
+            energy_needed = hours_needed * charger_power
+
+        ep = self.ep_series_from_now()
+        data_end = ep.end
 
         if departure is not None:
             assert departure.tzinfo, "'before' must be supplied timezone aware"
-            if departure > data_end:
+            if data_end is None or departure > data_end:
                 raise NoCrystalBall(f"No data for requested 'before' time. Max: {data_end}")
-            ep_pd = ep_pd.loc[:departure - timedelta(minutes=30)]
+            ep = ep.slice(stop=departure)
         else:
             logging.warning(f"No 'before' specified. Using end-date of {data_end}")
 
+        prices = ep.values
         if max_cost is not None:
-            ep_pd = ep_pd.where(ep_pd <= max_cost).dropna()
+            prices = numpy.where(prices <= max_cost, prices, numpy.nan)
 
-        if not len(ep_pd):
+        if numpy.isnan(prices).all():
             raise NoSolutions("Sorry, no charging options given inputs.")
 
-        target_times = ep_pd.sort_values(by='electricity price')[:periods].sort_index().index
+        if mode == "fewest_starts":
+            fractions = fewest_starts_charge(prices, energy_needed, charger_power,
+                                             start_penalty=EV_START_PENALTY,
+                                             min_run=EV_MIN_RUN_SLOTS)
+        else:
+            fractions = cheapest_charge(prices, energy_needed, charger_power)
+
+        if fractions.sum() < slots_for_energy(energy_needed, charger_power):
+            logging.warning(f"Not enough slots to charge {energy_needed:.1f}kWh. Charging as much as possible.")
 
-        charging_periods = find_contiguous_periods(target_times)
+        return ep, fractions, charger_power
 
-        average_cost = sum([ep_pd.loc[time] for time in target_times])[0] / len(target_times)
+    @staticmethod
+    def _save_charging_plan(ep: PriceSeries,
+                            fractions: numpy.ndarray,
+                            charger_power: float,
+                            departure: datetime) -> CarChargingSession:
+        """
+        Save a CarChargingSession (and its periods) for per-slot charging fractions over `ep`.
+        """
+        _, average_cost = charge_cost(ep.values, fractions, charger_power)
         charge_session = CarChargingSession(departure=departure,
                                             average_cost=average_cost,
                                             scheduled=False)
         charge_session.save()
 
-        for period in charging_periods:
-            start, stop = period
-            period = CarChargingPeriod(start_time=start,
-                                       stop_time=stop,
+        for start, stop in charging_intervals(ep.origin, fractions):
+            period = CarChargingPeriod(start_time=datetime.fromtimestamp(start, tz=timezone.utc),
+                                       stop_time=datetime.fromtimestamp(stop, tz=timezone.utc),
                                        parent=charge_session)
             period.save()
 
@@ -192,58 +395,134 @@ class EnergyPlanner:
         ToDo: Account for uneven probability of usage
         ToDo: Account for higher power of gas heating
         """
-        n = datetime.now(tz=get_localzone()).replace(minute=0,
-                                                     second=0,
-                                                     microsecond=0)
-        phase_a = (n.replace(hour=0) + timedelta(days=1),
-                   n.replace(hour=6) + timedelta(days=1))
+        phase_a = self._water_heating_window()
 
         # phase_b = (n.replace(hour=10) + timedelta(days=1),
         #            n.replace(hour=18) + timedelta(days=1))
 
-        system_status = SystemStatus.objects.get(id=settings.AE_SITE_ID)
-
-        assert system_status.hw_nest_override, "Nest must be overridden."
-
-        if not self.tomorrows_data_available:
-            raise NoCrystalBall("Can't plan before we have data for tomorrow.")
-
-        ep_pd = self.ep_df_from_now()
-        gp_pd = self.gp_df_from_now()/settings.AE_GAS_EFFICIENCY # Adjust gas price to account for boiler efficiency.
-        fixed_gas_price = gp_pd.min()[0]    # It's a flat price all day
+        ep = self.ep_series_from_now()
+        fixed_gas_price = self._water_heating_gas_price()
 
-        elec_heating_periods = []
-        gas_heating_periods = []
+        elec_heating_slots = []
+        gas_heating_slots = []
 
         for phase in [phase_a]:
-            e = ep_pd[phase[0]:phase[1]-timedelta(minutes=30)]
+            e = ep.slice(phase[0], phase[1])
 
             # Running the boiler uses electricity. With a consistent gas-price - target times will be when
             # the electricity is cheapest.
 
-            target_times = e.sort_values(by='electricity price')[:4].sort_index().index
+            candidates = numpy.flatnonzero(e.valid)
+            target = candidates[numpy.argsort(e.values[candidates], kind="stable")[:HW_HEATING_SLOTS]]
+            elec = e.values[target] <= fixed_gas_price
 
-            for time in target_times:
-                if e.loc[time]['electricity price'] <= fixed_gas_price:
-                    elec_heating_periods.append(time)
-                else:
-                    gas_heating_periods.append(time)
+            elec_heating_slots.append(e.origin + target[elec])
+            gas_heating_slots.append(e.origin + target[~elec])
 
-        elec_heating_periods = find_contiguous_periods(pandas.DataFrame(elec_heating_periods))
-        gas_heating_periods = find_contiguous_periods(pandas.DataFrame(gas_heating_periods))
+        self._save_water_heating(numpy.concatenate(elec_heating_slots), numpy.concatenate(gas_heating_slots))
 
-        for period in elec_heating_periods:
-            start, stop = period
-            p = WaterHeatingPeriod(start_time=start,
-                                   stop_time=stop,
-                                   elec_heating=True)
-            p.save()
+        return
 
-        for period in gas_heating_periods:
-            start, stop = period
-            p = WaterHeatingPeriod(start_time=start,
-                                   stop_time=stop,
-                                   elec_heating=True)
-            p.save()
+    @staticmethod
+    def _water_heating_window() -> (datetime, datetime):
+        """Phase A: 0000-0600 tomorrow."""
+        n = datetime.now(tz=get_localzone()).replace(minute=0,
+                                                     second=0,
+                                                     microsecond=0)
+        return (n.replace(hour=0) + timedelta(days=1),
+                n.replace(hour=6) + timedelta(days=1))
 
-        return
+    def _water_heating_gas_price(self) -> float:
+        """
+        Check we're able to plan hot water, and get the gas price to compare electric heating against.
+        """
+        system_status = SystemStatus.objects.get(id=settings.AE_SITE_ID)
+
+        assert system_status.hw_nest_override, "Nest must be overridden."
+
+        if not self.tomorrows_data_available:
+            raise NoCrystalBall("Can't plan before we have data for tomorrow.")
+
+        gp = self.gp_series_from_now()
+        # Adjust gas price to account for boiler efficiency. It's a flat price all day.
+        return numpy.nanmin(gp.values) / settings.AE_GAS_EFFICIENCY
+
+    @staticmethod
+    def _save_water_heating(elec_slots: numpy.ndarray, gas_slots: numpy.ndarray):
+        """
+        Save WaterHeatingPeriods for the runs of electric and gas heating slots.
+        """
+        for slots, elec_heating in ((elec_slots, True), (gas_slots, False)):
+            for start, stop in slot_runs(slots):
+                p = WaterHeatingPeriod(start_time=from_slot(start),
+                                       stop_time=from_slot(stop),
+                                       elec_heating=elec_heating)
+                p.save()
+
+    def plan_household(self,
+                       departure: datetime = None,
+                       energy_needed: float = None,
+                       charger_power: float = None,
+                       hot_water: bool = True,
+                       appliances: dict = None,
+                       site_limit: float = None) -> (dict, CarChargingSession):
+        """
+        Plan car charging, hot water and appliances together, so that between them they never import
+        more than `site_limit` kW. Saves the car's CarChargingSession and the WaterHeatingPeriods, as
+        plan_car_charging and plan_water_heating would.
+
+        :param departure: Car departure time. No car charging is planned if not provided.
+        :param energy_needed: kWh for the car. If not provided, will use Tesla API to calculate based on SOC.
+        :param charger_power: kW the car charges at. Defaults to config.EV_CHARGER_KW.
+        :param hot_water: Plan hot water in phase A, as plan_water_heating.
+        :param appliances: {name: kWh per half-hour} to fit in, as plan_appliances. Defaults to none.
+        :param site_limit: kW. Defaults to config.SITE_IMPORT_LIMIT_KW.
+        :return: ({load name: LoadPlan}, the (unscheduled) CarChargingSession or None)
+        """
+        if charger_power is None:
+            charger_power = EV_CHARGER_KW
+        if site_limit is None:
+            site_limit = SITE_IMPORT_LIMIT_KW
+
+        ep = self.ep_series_from_now()
+        if not ep.count():
+            raise NoSolutions("No price data to plan with.")
+
+        def slot_offset(dt):
+            return to_slot(dt) - ep.origin
+
+        loads = []
+        if departure is not None:
+            assert departure.tzinfo, "'departure' must be supplied timezone aware"
+            if departure > ep.end:
+                raise NoCrystalBall(f"No data for requested departure time. Max: {ep.end}")
+            if energy_needed is None:
+                assert self.car is not None, "No car, either specify energy_needed, or re-initiate class with car."
+                energy_needed = self.car.hours_to_target_soc * charger_power
+            loads.append(FlexibleLoad("Car", charger_power, energy_needed, stop=slot_offset(departure)))
+
+        if hot_water:
+            start, stop = self._water_heating_window()
+            loads.append(FlexibleLoad("Hot water", HW_HEATER_KW, HW_HEATING_SLOTS * HW_HEATER_KW * SLOT_HOURS,
+                                      start=slot_offset(start), stop=slot_offset(stop),
+                                      fallback_price=self._water_heating_gas_price()))
+
+        for name, profile in (appliances or {}).items():
+            loads.append(ShiftableLoad(name, profile))
+
+        plans = schedule_loads(ep.values, loads, site_limit)
+
+        charge_session = None
+        if departure is not None:
+            car = plans["Car"]
+            if car.fractions.sum() < slots_for_energy(energy_needed, charger_power):
+                logging.warning(f"Can't fit {energy_needed:.1f}kWh of charging. Charging as much as possible.")
+            charge_session = self._save_charging_plan(ep, car.fractions, charger_power, departure)
+
+        if hot_water:
+            heating = plans["Hot water"]
+            on = heating.fractions > 0
+            self._save_water_heating(ep.origin + numpy.flatnonzero(on & ~heating.fallback),
+                                     ep.origin + numpy.flatnonzero(on & heating.fallback))
+
+        return plans, charge_session
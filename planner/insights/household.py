@@ -0,0 +1,182 @@
+"""Planning several loads together under a site-wide import limit.
+
+Planned separately, the car and the immersion heater both go for the cheapest half-hours and can
+end up stacked on top of each other, pulling more than the supply allows. Here every load is placed
+against one shared array of headroom (kW left under the limit in each slot):
+
+* ShiftableLoad - a fixed profile that runs once, from some start slot (an appliance).
+* FlexibleLoad - on/off at a fixed power within a window until enough energy is delivered
+  (the car, hot water). Optionally with a fallback (e.g. gas) that doesn't use the supply.
+
+Loads are placed greedily - shiftable loads first (they need contiguous headroom), then flexible
+loads least-slack first - each taking the cheapest slots that still have room for it. Every step is
+a handful of numpy operations over the horizon.
+"""
+
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .appliances import start_costs
+from .charging import SLOT_HOURS, charge_cost, cheapest_charge, slots_for_energy
+
+
+class ShiftableLoad:
+    """
+    A load that runs a fixed profile once, starting at any slot in [start, stop).
+
+    :param name: Name
+    :param profile: kWh drawn in each half-hour after switching on
+    :param start: First slot (index into the price array) it may start in
+    :param stop: Slot it must have finished by. Defaults to the end of the horizon.
+    """
+
+    def __init__(self, name: str, profile, start: int = 0, stop: int = None):
+        self.name = name
+        self.profile = numpy.asarray(profile, dtype=numpy.float64)
+        self.start = start
+        self.stop = stop
+
+
+class FlexibleLoad:
+    """
+    A load that draws `power` kW whenever it's on, until `energy` kWh has been delivered, within the
+    slots [start, stop). The last slot may be partly used.
+
+    :param name: Name
+    :param power: kW
+    :param energy: kWh needed
+    :param start: First slot (index into the price array) it may run in
+    :param stop: Slot it must have finished by. Defaults to the end of the horizon.
+    :param fallback_price: p/kWh of an alternative that doesn't draw on the supply (e.g. gas heating),
+                           used whenever it's cheaper or there's no headroom.
+    """
+
+    def __init__(self, name: str, power: float, energy: float, start: int = 0, stop: int = None,
+                 fallback_price: float = None):
+        self.name = name
+        self.power = power
+        self.energy = energy
+        self.start = start
+        self.stop = stop
+        self.fallback_price = fallback_price
+
+
+class LoadPlan:
+    """
+    Where a load ended up.
+
+    :param fractions: Fraction of each slot the load is on for
+    :param fallback: True for slots where the load runs on its fallback
+    :param cost: pence
+    """
+
+    def __init__(self, fractions: numpy.ndarray, fallback: numpy.ndarray, cost: float):
+        self.fractions = fractions
+        self.fallback = fallback
+        self.cost = cost
+
+    def __repr__(self):
+        return f"<LoadPlan(slots={self.fractions.sum():g}, cost={self.cost:.1f}p)>"
+
+
+def _window(n: int, start: int, stop: int) -> slice:
+    return slice(max(start, 0), n if stop is None else min(stop, n))
+
+
+def _place_shiftable(load: ShiftableLoad, prices: numpy.ndarray, headroom: numpy.ndarray) -> LoadPlan:
+    n, m = len(prices), len(load.profile)
+    window = _window(n, load.start, load.stop)
+    fractions = numpy.zeros(n)
+    fallback = numpy.zeros(n, dtype=bool)
+
+    costs = start_costs(prices[window], load.profile)
+    if len(costs):
+        kw = load.profile / SLOT_HOURS
+        fits = (sliding_window_view(headroom[window], m) >= kw).all(axis=1)
+        costs = numpy.where(fits, costs, numpy.nan)
+
+    if not len(costs) or numpy.isnan(costs).all():
+        return LoadPlan(fractions, fallback, numpy.nan)
+
+    first = window.start + int(numpy.nanargmin(costs))
+    fractions[first:first + m] = 1.0
+    headroom[first:first + m] -= load.profile / SLOT_HOURS
+    return LoadPlan(fractions, fallback, float(numpy.nanmin(costs)))
+
+
+def _place_flexible(load: FlexibleLoad, prices: numpy.ndarray, headroom: numpy.ndarray) -> LoadPlan:
+    n = len(prices)
+    window = _window(n, load.start, load.stop)
+
+    in_window = numpy.zeros(n, dtype=bool)
+    in_window[window] = True
+    on_supply = in_window & (headroom >= load.power) & ~numpy.isnan(prices)
+
+    effective = numpy.where(on_supply, prices, numpy.nan)
+    fallback = numpy.zeros(n, dtype=bool)
+    if load.fallback_price is not None:
+        fallback = in_window & ~(on_supply & (prices <= load.fallback_price))
+        effective = numpy.where(fallback, load.fallback_price, effective)
+
+    fractions = cheapest_charge(effective, load.energy, load.power)
+    fallback &= fractions > 0
+    cost, _ = charge_cost(effective, fractions, load.power)
+
+    headroom[(fractions > 0) & ~fallback] -= load.power
+    return LoadPlan(fractions, fallback, cost)
+
+
+def _slack(load: FlexibleLoad, prices: numpy.ndarray, headroom: numpy.ndarray) -> float:
+    """Slots the load could use beyond those it needs - the less, the sooner it should be placed."""
+    window = _window(len(prices), load.start, load.stop)
+    if load.fallback_price is not None:
+        usable = window.stop - window.start
+    else:
+        usable = numpy.count_nonzero((headroom[window] >= load.power) & ~numpy.isnan(prices[window]))
+    return usable - slots_for_energy(load.energy, load.power)
+
+
+def schedule_loads(prices: numpy.ndarray, loads: list, site_limit: float, base_load=0.0) -> dict:
+    """
+    Place every load in the cheapest slots that keep total import under `site_limit`.
+
+    :param prices: Half-hourly prices (p/kWh), NaN for unknown.
+    :param loads: ShiftableLoads and FlexibleLoads
+    :param site_limit: kW the site may import at once
+    :param base_load: kW already being drawn in each slot (scalar or array)
+    :return: {name: LoadPlan} in the order the loads were given. A load that doesn't fit at all has
+             cost NaN; a flexible load that only partly fits delivers what it can.
+    """
+    prices = numpy.asarray(prices, dtype=numpy.float64)
+    headroom = site_limit - numpy.broadcast_to(numpy.asarray(base_load, dtype=numpy.float64), prices.shape)
+    headroom = headroom.copy()
+
+    shiftable = sorted((load for load in loads if isinstance(load, ShiftableLoad)),
+                       key=lambda load: -load.profile.max())
+    flexible = [load for load in loads if isinstance(load, FlexibleLoad)]
+
+    plans = {}
+    for load in shiftable:
+        plans[load.name] = _place_shiftable(load, prices, headroom)
+
+    while flexible:
+        load = min(flexible, key=lambda l: _slack(l, prices, headroom))
+        flexible.remove(load)
+        plans[load.name] = _place_flexible(load, prices, headroom)
+
+    return {load.name: plans[load.name] for load in loads}
+
+
+def site_import(prices: numpy.ndarray, loads: list, plans: dict, base_load=0.0) -> numpy.ndarray:
+    """
+    Peak kW drawn from the supply in each slot under a set of plans.
+    """
+    total = numpy.zeros(len(prices)) + base_load
+    for load in loads:
+        plan = plans[load.name]
+        if isinstance(load, ShiftableLoad):
+            on = numpy.flatnonzero(plan.fractions)
+            total[on] += load.profile[:len(on)] / SLOT_HOURS
+        else:
+            total[(plan.fractions > 0) & ~plan.fallback] += load.power
+    return total
@@ -1,9 +1,15 @@
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
 from tzlocal import get_localzone
+import hashlib
+import io
+import threading
+
+import numpy
 import pandas
 
-import matplotlib
 import matplotlib.dates as mdates
+from matplotlib.figure import Figure
 
 from bokeh.plotting import figure
 from bokeh.models import Span
@@ -11,21 +17,177 @@ from bokeh.embed import components
 
 from planner.insights.data_tools import format_short_date_range
 
+# Number of rendered graphs (HTML components and PNGs together) kept in memory.
+RENDER_CACHE_SIZE = 32
+
+# The "now" marker is drawn at this resolution, so renders within it can share a cache entry.
+NOW_MARKER_RESOLUTION = timedelta(minutes=5)
+
+# Width of each step when drawing square lines.
+STEP = numpy.timedelta64(30, 'm')
+
+
+class RenderCache:
+    """
+    In-process LRU cache of rendered graphs, keyed by render_key.
+    """
+
+    def __init__(self, max_entries: int = RENDER_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """
+        Get a render from the cache, or None if it needs rendering.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries)}
+
+
+render_cache = RenderCache()
+
+
+def render_key(kind: str, dfs: list[pandas.DataFrame], **options) -> str:
+    """
+    Content hash of everything that goes into a render: the kind of render, each series' column
+    names, times and values, and the options (markers etc).
+    """
+    h = hashlib.sha1(kind.encode())
+    for df in dfs:
+        h.update(repr(list(df.columns)).encode())
+        h.update(numpy.ascontiguousarray(df.index.asi8).tobytes())
+        h.update(numpy.ascontiguousarray(df.values, dtype=numpy.float64).tobytes())
+    h.update(repr(sorted(options.items())).encode())
+    return h.hexdigest()
+
+
+def downsample(df: pandas.DataFrame, max_points: int) -> pandas.DataFrame:
+    """
+    Thin a series out to at most `max_points` rows, keeping the lowest and highest row in each
+    bucket of consecutive rows so that spikes and dips still show.
+
+    :param df: Single-column DataFrame
+    :param max_points: Row limit. None for no limit.
+    """
+    n = len(df)
+    if max_points is None or n <= max_points:
+        return df
+
+    bucket = -(-n // max(max_points // 2, 1))
+    values = df[df.columns[0]].to_numpy(dtype=numpy.float64)
+    padded = numpy.concatenate((values, numpy.full(-n % bucket, numpy.nan))).reshape(-1, bucket)
+    offsets = numpy.arange(0, len(padded) * bucket, bucket)
+
+    lows = offsets + numpy.argmin(numpy.where(numpy.isnan(padded), numpy.inf, padded), axis=1)
+    highs = offsets + numpy.argmax(numpy.where(numpy.isnan(padded), -numpy.inf, padded), axis=1)
+    return df.iloc[numpy.unique(numpy.concatenate((lows, highs)))]
+
+
+def step_points(df: pandas.DataFrame,
+                square_lines: bool = True,
+                max_points: int = None) -> (numpy.ndarray, numpy.ndarray):
+    """
+    Points to draw a series with: (UTC datetime64 times, values).
+
+    For square lines each point is a step `STEP` wide, drawn with the plotting library's own step
+    style. A point is added at the end of the last step (and the end of any step followed by a gap
+    in the data) with a NaN after it, so steps end where their slot does rather than running on.
+
+    :param df: Single-column DataFrame indexed by tz aware slot start times.
+    :param square_lines: Draw as steps
+    :param max_points: See downsample. Downsampled series aren't checked for gaps.
+    """
+    sampled = downsample(df, max_points)
+    times = sampled.index.tz_convert('UTC').tz_localize(None).to_numpy(dtype='datetime64[ns]')
+    values = sampled[sampled.columns[0]].to_numpy(dtype=numpy.float64)
+
+    if not square_lines or not len(times):
+        return times, values
+
+    ends = times + STEP
+    if sampled is df:
+        breaks = numpy.append(numpy.flatnonzero(ends[:-1] != times[1:]), len(times) - 1)
+    else:
+        breaks = numpy.array([len(times) - 1])
+
+    times = numpy.insert(times, numpy.repeat(breaks + 1, 2), numpy.repeat(ends[breaks], 2))
+    values = numpy.insert(values, numpy.repeat(breaks + 1, 2),
+                          numpy.column_stack((values[breaks], numpy.full(len(breaks), numpy.nan))).ravel())
+    return times, values
+
+
+def local_times(times: numpy.ndarray) -> pandas.DatetimeIndex:
+    """
+    UTC datetime64s as naive local times - Bokeh shows datetimes as given.
+    """
+    return pandas.DatetimeIndex(times).tz_localize('UTC').tz_convert(get_localzone()).tz_localize(None)
+
+
+def now_marker() -> datetime:
+    """
+    Local time now, rounded down to NOW_MARKER_RESOLUTION.
+    """
+    resolution = int(NOW_MARKER_RESOLUTION.total_seconds())
+    now = int(datetime.now(tz=timezone.utc).timestamp())
+    return datetime.fromtimestamp(now - now % resolution, tz=get_localzone())
+
 
 def plot_html(dfs: list[pandas.DataFrame],
               square_lines: bool = True,
               show_now_marker: bool = True,
               end_marker: datetime = None,
               starts_and_stops: list[tuple[datetime, datetime]] = None,
-              ):
+              max_points: int = None,
+              ) -> (str, str):
+    """
+    Bokeh (script, div) components for a graph of the series. Renders are cached (see render_cache).
+
+    :param max_points: Downsample each series to about this many points (see downsample).
+    """
+    now = now_marker() if show_now_marker else None
+    key = render_key("html", dfs, square_lines=square_lines, now=now, end_marker=end_marker,
+                     starts_and_stops=starts_and_stops, max_points=max_points)
+
+    html = render_cache.get(key)
+    if html is None:
+        html = _render_html(dfs, square_lines, now, end_marker, starts_and_stops, max_points)
+        render_cache.put(key, html)
+    return html
+
+
+def _render_html(dfs, square_lines, now, end_marker, starts_and_stops, max_points):
     plot = figure(x_axis_type='datetime')
     plot.xaxis.minor_tick_line_color = "red"
 
     line_colours = ["blue", "orange", "red", "green"]
 
-    if show_now_marker:
-        now = datetime.now()
-
+    if now is not None:
         plot.add_layout(Span(location=now.replace(tzinfo=None),
                              dimension='height', line_color='pink',
                              line_dash='dashed', line_width=1))
@@ -44,19 +206,13 @@ def plot_html(dfs: list[pandas.DataFrame],
                                  dimension='height', line_color='red',
                                  line_dash='dashed', line_width=1))
 
-    i = 0
-    for df in dfs:
+    for i, df in enumerate(dfs):
+        times, values = step_points(df, square_lines, max_points)
+        style = dict(legend_label=df.columns[0], color=line_colours[i % len(line_colours)])
         if square_lines:
-            endpoints = pandas.DataFrame(df.values,
-                                         index=df.index + timedelta(minutes=29, seconds=59),
-                                         columns=df.columns)
-            df = df.append(endpoints).sort_index()
-
-        plot.line(df.index.map(lambda x: x.astimezone(get_localzone()).replace(tzinfo=None)),
-                  df[df.columns[0]].values.tolist(),
-                  legend_label=df.columns[0],
-                  color=line_colours[i % len(line_colours)])
-        i += 1
+            plot.step(local_times(times), values, mode="after", **style)
+        else:
+            plot.line(local_times(times), values, **style)
 
     return components(plot)
 
@@ -66,66 +222,59 @@ def plot_png(dfs: list[pandas.DataFrame],
              show_now_marker: bool = True,
              end_marker: datetime = None,
              starts_and_stops: list[tuple[datetime, datetime]] = None,
-             ):
+             max_points: int = None,
+             ) -> bytes:
+    """
+    PNG of a graph of the series. Renders are cached (see render_cache).
 
-    # Debugging variable that allows one to see an interactive matplotlib plot.
-    # For normal behaviour, leave as True.
-    return_file = True
+    :param max_points: Downsample each series to about this many points (see downsample).
+    """
+    now = now_marker() if show_now_marker else None
+    key = render_key("png", dfs, square_lines=square_lines, now=now, end_marker=end_marker,
+                     starts_and_stops=starts_and_stops, max_points=max_points)
 
-    line_colours = ["b-", "y-", "r-", "g-"]
+    png = render_cache.get(key)
+    if png is None:
+        png = _render_png(dfs, square_lines, now, end_marker, starts_and_stops, max_points)
+        render_cache.put(key, png)
+    return png
 
-    if return_file:
-        matplotlib.use('AGG')
-    else:
-        matplotlib.use('macosx')
 
-    import matplotlib.pyplot as plt
+def _render_png(dfs, square_lines, now, end_marker, starts_and_stops, max_points):
+    # A Figure made directly (not through pyplot) isn't registered with any backend or global
+    # state, so it is safe to render in any thread and is freed as soon as we're done with it.
+    fig = Figure()
+    ax = fig.subplots()
 
-    plt.figure()
-    ax = plt.gca()
-    ax.grid(which='both')
+    line_colours = ["b-", "y-", "r-", "g-"]
 
-    if show_now_marker:
-        now = datetime.now(tz=get_localzone())
-        plt.axvline(x=now, color='pink', linestyle='-.')
+    if now is not None:
+        ax.axvline(x=now, color='pink', linestyle='-.')
 
     if starts_and_stops:
         for start, stop in starts_and_stops:
-            plt.axvline(x=start.astimezone(get_localzone()), color='green', linestyle=':')
-            plt.axvline(x=stop.astimezone(get_localzone()), color='red', linestyle=':')
+            ax.axvline(x=start.astimezone(get_localzone()), color='green', linestyle=':')
+            ax.axvline(x=stop.astimezone(get_localzone()), color='red', linestyle=':')
 
     if end_marker is not None:
         assert end_marker.tzinfo, "end must be tz aware"
-        end_marker = end_marker.astimezone(timezone.utc)
-        plt.axvline(x=end_marker, color='pink', linestyle='-.')
+        ax.axvline(x=end_marker.astimezone(timezone.utc), color='pink', linestyle='-.')
 
-    # ToDo: This is horribly repetitive and needs tidying up.
-
-    i = 0
     min_date = None
     max_date = None
-    for df in dfs:
+    for i, df in enumerate(dfs):
         if min_date is None or min_date > df.index.min():
             min_date = df.index.min()
         if max_date is None or max_date < df.index.max():
             max_date = df.index.max()
-        if square_lines:
-            endpoints = pandas.DataFrame(df.values,
-                                         index=df.index + timedelta(minutes=29, seconds=59),
-                                         columns=df.columns)
-            df = df.append(endpoints).sort_index()
-
-        plt.plot(df.index.map(lambda x: x.astimezone(get_localzone())),
-                 df[df.columns[0]].values.tolist(),
-                 line_colours[i],
-                 label=df.columns[0])
-        i += 1
-
-        ax = plt.gca()
-        ax.grid(which='both')
-        ax.grid(which='minor')
-
-    ax = plt.gca()
+        # UTC datetime64s - the axis formatters below show them in local time.
+        times, values = step_points(df, square_lines, max_points)
+        ax.plot(times, values,
+                line_colours[i % len(line_colours)],
+                drawstyle="steps-post" if square_lines else "default",
+                label=df.columns[0])
+
+    ax.grid(which='both')
     ax.xaxis.set_major_locator(mdates.DayLocator(tz=get_localzone()))
     ax.xaxis.set_major_formatter(mdates.DateFormatter('%a %d', tz=get_localzone()))
     ax.xaxis.set_minor_locator(mdates.HourLocator(interval=3, tz=get_localzone()))
@@ -135,14 +284,11 @@ def plot_png(dfs: list[pandas.DataFrame],
     ax.tick_params(which='minor', length=2)
 
     date_range = format_short_date_range((min_date, max_date))
-    plt.title(f"Energy Prices from {date_range}")
-    plt.xlabel("Price (p/kWh)")
+    ax.set_title(f"Energy Prices from {date_range}")
+    ax.set_xlabel("Price (p/kWh)")
     ax.legend()
 
-    if return_file:
-        plt.savefig("figure.png")
-        with open("figure.png", "rb") as f:
-            png_data = f.read()
-        return png_data
-    else:
-        plt.show()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    fig.clear()
+    return buffer.getvalue()
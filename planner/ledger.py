@@ -0,0 +1,276 @@
+"""What the energy we used actually cost.
+
+The ledger joins half-hourly usage (TimeSeries.usage) with the unit rates for the same slots.
+Both are PriceSeries, so the join just lines up two arrays by slot index. The results are rolled up
+into local days (DailyCost), and the days into weeks and months (WeeklyCost, MonthlyCost), so
+anything showing totals reads a handful of rows rather than every half-hour.
+
+update_cost_ledger is incremental. It keeps a LedgerMark for each series it reads, and rebuilds from
+the earliest day any of them has gained values for since - today's usage, usage backfilled for last
+month, or prices that arrived after their usage - and only re-sums the weeks and months from there,
+from DailyCost. Usage that has no price yet is counted as unpriced rather than dropped, and is
+costed when its prices arrive.
+
+It can also say what each charging or water heating plan actually cost, against what was expected
+when it was planned. Usage is metered for the whole house, so this includes whatever else was on at
+the time.
+
+Gas usage is assumed to be in kWh, and charged at the flat GAS_PRICE.
+"""
+
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta, timezone
+
+import numpy
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+
+from config import EV_CHARGER_KW, HW_HEATER_KW, OCTOPUS_PRODUCT, OCTOPUS_ZONE, TIMEZONE
+from octopus.octopus_api import GAS_PRICE
+from octopus.octopus_data import stored_time_series
+from octopus.price_series import SLOT_SECONDS, PriceSeries, from_slot, local_days, to_slot
+
+from .models import DailyCost, LedgerMark, MonthlyCost, SeriesValue, TimeSeries, WeeklyCost
+
+ROLLUP_FIELDS = ("elec_kwh", "elec_cost", "gas_kwh", "gas_cost", "slots", "unpriced_kwh", "unpriced_slots")
+
+EPOCH = date(1970, 1, 1)
+
+PlanCost = namedtuple("PlanCost", ["plan", "planned_kwh", "planned_cost", "kwh", "cost"])
+
+
+def join_usage(usage: PriceSeries, prices: PriceSeries) -> (numpy.ndarray, numpy.ndarray):
+    """
+    Line prices up with usage, slot by slot.
+
+    :return: (kWh, pence) for each slot of `usage`. Pence is NaN where there's no usage or no price.
+    """
+    price = numpy.full(len(usage), numpy.nan)
+    first, stop = max(usage.origin, prices.origin), min(usage.stop_slot, prices.stop_slot)
+    if first < stop:
+        price[first - usage.origin:stop - usage.origin] = prices.values[first - prices.origin:stop - prices.origin]
+    return usage.values, usage.values * price
+
+
+def elec_prices() -> TimeSeries:
+    """The import tariff we're on."""
+    return TimeSeries.prices(OCTOPUS_PRODUCT, OCTOPUS_ZONE)
+
+
+def _local_midnight(day: date) -> datetime:
+    return TIMEZONE.localize(datetime.combine(day, time()))
+
+
+def daily_totals(start: datetime, end: datetime) -> dict:
+    """
+    Usage and cost for each local day in [start, end), from the stored half-hours.
+
+    :return: {"day": days since 1970-01-01, and an array for each of ROLLUP_FIELDS}, for days with any usage
+    """
+    elec = stored_time_series(TimeSeries.usage(TimeSeries.ELEC), start, end)
+    gas = stored_time_series(TimeSeries.usage(TimeSeries.GAS), start, end)
+    prices = stored_time_series(elec_prices(), start, end)
+
+    elec_kwh, elec_cost = join_usage(elec, prices)
+    elec_kwh, elec_cost = elec_kwh[elec.valid], elec_cost[elec.valid]
+    priced = ~numpy.isnan(elec_cost)
+    elec_days = local_days(elec.slots[elec.valid], TIMEZONE)
+    gas_days = local_days(gas.slots[gas.valid], TIMEZONE)
+
+    days = numpy.union1d(elec_days, gas_days)
+    e, g = numpy.searchsorted(days, elec_days), numpy.searchsorted(days, gas_days)
+    gas_kwh = numpy.bincount(g, gas.values[gas.valid], minlength=len(days))
+
+    return {"day": days,
+            "elec_kwh": numpy.bincount(e[priced], elec_kwh[priced], minlength=len(days)),
+            "elec_cost": numpy.bincount(e[priced], elec_cost[priced], minlength=len(days)),
+            "gas_kwh": gas_kwh,
+            "gas_cost": gas_kwh * GAS_PRICE,
+            "slots": numpy.bincount(e[priced], minlength=len(days)),
+            "unpriced_kwh": numpy.bincount(e[~priced], elec_kwh[~priced], minlength=len(days)),
+            "unpriced_slots": numpy.bincount(e[~priced], minlength=len(days))}
+
+
+def _write_rollups(model, since: date, totals: dict, now: datetime) -> int:
+    """Replace `model` rows from `since` with `totals` (as from daily_totals, "day" being the period start)."""
+    rows = [model(start=EPOCH + timedelta(days=int(day)),
+                  updated=now,
+                  **{field: totals[field][i].item() for field in ROLLUP_FIELDS})
+            for i, day in enumerate(totals["day"])]
+    model.objects.filter(start__gte=since).delete()
+    model.objects.bulk_create(rows)
+    return len(rows)
+
+
+def _regroup(since: date, period_start) -> dict:
+    """
+    Sum DailyCost rows from `since` into longer periods.
+
+    :param period_start: Maps days since 1970-01-01 to the day their period starts on.
+    """
+    rows = numpy.array(DailyCost.objects.filter(start__gte=since).order_by('start')
+                       .values_list('start', *ROLLUP_FIELDS), dtype=object).reshape(-1, len(ROLLUP_FIELDS) + 1)
+    days = numpy.array([(day - EPOCH).days for day in rows[:, 0]], dtype=numpy.int64)
+    periods, group = numpy.unique(period_start(days), return_inverse=True)
+
+    totals = {"day": periods}
+    for i, field in enumerate(ROLLUP_FIELDS):
+        totals[field] = numpy.bincount(group, rows[:, i + 1].astype(numpy.float64), minlength=len(periods))
+    for field in ("slots", "unpriced_slots"):
+        totals[field] = totals[field].astype(numpy.int64)
+    return totals
+
+
+def week_start(days: numpy.ndarray) -> numpy.ndarray:
+    """Monday on or before each day (as days since 1970-01-01, which was a Thursday)."""
+    return days - (days + 3) % 7
+
+
+def month_start(days: numpy.ndarray) -> numpy.ndarray:
+    """First of the month of each day (as days since 1970-01-01)."""
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype('datetime64[D]').astype(numpy.int64)
+
+
+def _new_values(series: list) -> (int, dict):
+    """
+    What has been stored in each of `series` since the ledger last read it.
+
+    :return: (earliest slot with a new value, or None if there are none, {series id: highest value id})
+    """
+    marks = dict(LedgerMark.objects.filter(series__in=series).values_list('series_id', 'last_value_id'))
+    first, latest = None, {}
+    for s in series:
+        mark = marks.get(s.id, 0)
+        new = SeriesValue.objects.filter(series=s, id__gt=mark).aggregate(first=Min('slot'), latest=Max('id'))
+        if new["latest"] is not None:
+            first = new["first"] if first is None else min(first, new["first"])
+        latest[s.id] = new["latest"] or mark
+    return first, latest
+
+
+def update_cost_ledger(since: date = None, now: datetime = None) -> int:
+    """
+    Bring DailyCost, WeeklyCost and MonthlyCost up to date with the stored usage and prices.
+
+    :param since: Rebuild from this local day at least. Defaults to the first day with usage or
+                  prices stored since the last update.
+    :param now: Defaults to now.
+    :return: Number of days written
+    """
+    if now is None:
+        now = datetime.now(tz=timezone.utc)
+
+    # Marks are taken before the values are read, so anything stored meanwhile is picked up next time.
+    first, marks = _new_values([TimeSeries.usage(TimeSeries.ELEC), TimeSeries.usage(TimeSeries.GAS), elec_prices()])
+    if first is not None:
+        changed = min(from_slot(first).astimezone(TIMEZONE).date(), now.astimezone(TIMEZONE).date())
+        since = changed if since is None else min(since, changed)
+    if since is None:
+        return 0
+
+    totals = daily_totals(_local_midnight(since), now)
+
+    with transaction.atomic():
+        written = _write_rollups(DailyCost, since, totals, now)
+
+        first_week = EPOCH + timedelta(days=int(week_start(numpy.array([(since - EPOCH).days]))[0]))
+        _write_rollups(WeeklyCost, first_week, _regroup(first_week, week_start), now)
+
+        first_month = since.replace(day=1)
+        _write_rollups(MonthlyCost, first_month, _regroup(first_month, month_start), now)
+
+        for series_id, last_value_id in marks.items():
+            LedgerMark.objects.update_or_create(series_id=series_id, defaults={"last_value_id": last_value_id})
+
+    return written
+
+
+def _window_usage(usage: PriceSeries, start: datetime, stop: datetime) -> (numpy.ndarray, numpy.ndarray):
+    """
+    Slots overlapping [start, stop), and the fraction of each that is inside it. Usage is taken to
+    be spread evenly across each half-hour.
+    """
+    first, last = to_slot(start), to_slot(stop - timedelta(microseconds=1))
+    slots = numpy.arange(first, last + 1)
+    overlap = numpy.minimum((slots + 1) * SLOT_SECONDS, stop.timestamp()) - numpy.maximum(slots * SLOT_SECONDS,
+                                                                                         start.timestamp())
+    return slots - usage.origin, overlap / SLOT_SECONDS
+
+
+def _attribute(periods: list, usage: PriceSeries, prices: PriceSeries) -> (float, float):
+    """kWh and pence used in (start, stop) periods. NaN if any of it is missing."""
+    kwh, cost = join_usage(usage, prices)
+    total_kwh, total_cost = 0.0, 0.0
+    for start, stop in periods:
+        index, weight = _window_usage(usage, start, stop)
+        inside = (index >= 0) & (index < len(usage))
+        if not inside.all():
+            return numpy.nan, numpy.nan
+        total_kwh += float(numpy.dot(kwh[index], weight))
+        total_cost += float(numpy.dot(cost[index], weight))
+    return total_kwh, total_cost
+
+
+def _span(periods: list) -> (datetime, datetime):
+    start = min(start for start, _ in periods)
+    stop = max(stop for _, stop in periods)
+    return start - timedelta(seconds=SLOT_SECONDS), stop + timedelta(seconds=SLOT_SECONDS)
+
+
+def charging_costs(sessions) -> list:
+    """
+    What each CarChargingSession actually cost, against what was planned (its periods at
+    EV_CHARGER_KW, at its average_cost).
+
+    :return: [PlanCost] in the order given. kWh and cost are NaN until the usage is in.
+    """
+    sessions = [(session, [(p.start_time, p.stop_time) for p in session.carchargingperiod_set.all()])
+                for session in sessions]
+    windows = [window for _, periods in sessions for window in periods]
+    if not windows:
+        return [PlanCost(session, 0.0, 0.0, 0.0, 0.0) for session, _ in sessions]
+
+    start, end = _span(windows)
+    usage = stored_time_series(TimeSeries.usage(TimeSeries.ELEC), start, end)
+    prices = stored_time_series(elec_prices(), start, end)
+
+    costs = []
+    for session, periods in sessions:
+        planned_kwh = sum((stop - start).total_seconds() for start, stop in periods) / 3600 * EV_CHARGER_KW
+        kwh, cost = _attribute(periods, usage, prices) if periods else (0.0, 0.0)
+        costs.append(PlanCost(session, planned_kwh, planned_kwh * session.average_cost, kwh, cost))
+    return costs
+
+
+def water_heating_costs(periods) -> list:
+    """
+    What each WaterHeatingPeriod actually cost, against what was planned: HW_HEATER_KW for its length,
+    at the electricity prices of the time, or at the gas price for the boiler's efficiency.
+
+    :return: [PlanCost] in the order given. kWh and cost are NaN until the usage is in.
+    """
+    periods = list(periods)
+    if not periods:
+        return []
+
+    start, end = _span([(p.start_time, p.stop_time) for p in periods])
+    elec = stored_time_series(TimeSeries.usage(TimeSeries.ELEC), start, end)
+    gas = stored_time_series(TimeSeries.usage(TimeSeries.GAS), start, end)
+    prices = stored_time_series(elec_prices(), start, end)
+    flat_gas = PriceSeries(gas.origin, numpy.full(len(gas), GAS_PRICE))
+
+    costs = []
+    for p in periods:
+        planned_kwh = (p.stop_time - p.start_time).total_seconds() / 3600 * HW_HEATER_KW
+        if p.elec_heating:
+            index, weight = _window_usage(prices, p.start_time, p.stop_time)
+            inside = (index >= 0) & (index < len(prices))
+            planned_price = numpy.average(prices.values[index[inside]], weights=weight[inside]) \
+                if inside.any() else numpy.nan
+            kwh, cost = _attribute([(p.start_time, p.stop_time)], elec, prices)
+        else:
+            planned_price = GAS_PRICE / settings.AE_GAS_EFFICIENCY
+            kwh, cost = _attribute([(p.start_time, p.stop_time)], gas, flat_gas)
+        costs.append(PlanCost(p, planned_kwh, planned_kwh * planned_price, kwh, cost))
+    return costs
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from planner.dispatcher import TASK_ARCHIVE_AFTER, archive_completed_tasks
+
+
+class Command(BaseCommand):
+    help = "Move completed scheduled tasks out of the live table, into the archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=float, default=TASK_ARCHIVE_AFTER / timedelta(days=1),
+                            help="Archive tasks completed more than this many days ago")
+
+    def handle(self, *args, **options):
+        moved = archive_completed_tasks(timedelta(days=options["days"]))
+        self.stdout.write(f"Archived {moved} tasks")
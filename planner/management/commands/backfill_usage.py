@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from datetime import timedelta
+
+from config import *
+from octopus.octopus_async import AsyncOctopusAPIClient, blocking
+from octopus.octopus_data import cached_time_series
+from planner.insights.data_tools import start_of_current_period
+from planner.models import TimeSeries
+
+
+class Command(BaseCommand):
+    help = "Fill the electricity (or gas) usage cache for the last N days, fetching concurrently."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=365)
+        parser.add_argument("--chunk-days", type=int, default=7)
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--fuel", choices=[TimeSeries.ELEC, TimeSeries.GAS], default=TimeSeries.ELEC)
+
+    def handle(self, *args, **options):
+        end = start_of_current_period()
+        start = end - timedelta(days=options["days"])
+
+        with AsyncOctopusAPIClient(username=OCTOPUS_USERNAME,
+                                   zone=OCTOPUS_ZONE,
+                                   e_mpan=OCTOPUS_ELEC_MPAN,
+                                   e_msn=OCTOPUS_ELEC_MSN,
+                                   g_mprn=OCTOPUS_GAS_MPRN,
+                                   g_msn=OCTOPUS_GAS_MSN,
+                                   chunk=timedelta(days=options["chunk_days"]),
+                                   max_concurrency=options["concurrency"]) as client:
+            # One big request per hole - the client does the chunking.
+            fetch = client.get_gas_usage if options["fuel"] == TimeSeries.GAS else client.get_elec_usage
+            usage = cached_time_series(TimeSeries.usage(options["fuel"]), blocking(fetch), start, end,
+                                       max_span=options["days"] * 48)
+
+        self.stdout.write(f"{usage.count()} of {len(usage)} slots cached from {usage.start} "
+                          f"({len(client.request_timings)} requests)")
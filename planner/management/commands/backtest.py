@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from datetime import date, datetime, timedelta, timezone
+import time
+
+from config import TIMEZONE
+from planner.insights.backtest import (BACKTEST_DECISION_HOUR, CAR_ENERGY_KWH, STRATEGIES, BacktestParams,
+                                       run_backtest, stored_prices)
+
+
+class Command(BaseCommand):
+    help = "Replay stored prices to compare what charging and hot water strategies would have cost."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=365)
+        parser.add_argument("--last-day", type=date.fromisoformat, help="Last decision day (default two days ago)")
+        parser.add_argument("--strategies", nargs="+", choices=list(STRATEGIES))
+        parser.add_argument("--car-energy", type=float, default=CAR_ENERGY_KWH, help="kWh needed each night")
+        parser.add_argument("--decision-hour", type=int, default=BACKTEST_DECISION_HOUR)
+        parser.add_argument("--processes", type=int)
+
+    def handle(self, *args, **options):
+        last_day = options["last_day"] or datetime.now(tz=TIMEZONE).date() - timedelta(days=2)
+        first_day = last_day - timedelta(days=options["days"] - 1)
+
+        t = time.perf_counter()
+        prices = stored_prices(datetime.combine(first_day, datetime.min.time(), tzinfo=timezone.utc),
+                               datetime.combine(last_day + timedelta(days=3), datetime.min.time(), tzinfo=timezone.utc))
+        load_time = time.perf_counter() - t
+
+        t = time.perf_counter()
+        results = run_backtest(prices, first_day, last_day,
+                               strategies=options["strategies"],
+                               params=BacktestParams(car_energy=options["car_energy"]),
+                               decision_hour=options["decision_hour"],
+                               processes=options["processes"])
+        run_time = time.perf_counter() - t
+
+        self.stdout.write(f"{first_day} to {last_day}: {prices.count()} prices loaded in {load_time:.2f}s, "
+                          f"backtested in {run_time:.2f}s")
+        self.stdout.write(f"{'strategy':<16}{'days':>6}{'cost £':>10}{'kWh':>9}{'gas kWh':>9}"
+                          f"{'switches':>10}{'p/kWh':>8}{'saving £':>10}")
+        for name, r in results.items():
+            self.stdout.write(f"{name:<16}{r['days']:>6}{r['cost'] / 100:>10.2f}{r['kwh']:>9.0f}{r['gas_kwh']:>9.0f}"
+                              f"{r['switches']:>10}{r['average']:>8.2f}{r['saving'] / 100:>10.2f}")
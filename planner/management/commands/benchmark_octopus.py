@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from datetime import datetime, timedelta, timezone
+import asyncio
+import time
+
+from octopus.fake_server import FakeOctopusServer
+from octopus.octopus_api import OctopusAPIClient
+from octopus.octopus_async import AsyncOctopusAPIClient
+
+
+class Command(BaseCommand):
+    help = "Time a long consumption pull from a local fake Octopus server, sequentially and concurrently."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=365)
+        parser.add_argument("--latency", type=float, default=0.05, help="Seconds per fake request")
+        parser.add_argument("--page-size", type=int, default=100)
+        parser.add_argument("--chunk-days", type=int, default=7)
+        parser.add_argument("--concurrency", type=int, default=8)
+
+    def handle(self, *args, **options):
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        end = start + timedelta(days=options["days"])
+        slots = options["days"] * 48
+        usage = {start + timedelta(minutes=30) * i: round(0.1 + (i % 48) / 100, 3) for i in range(slots)}
+
+        meter = ("sk_test", "H", "mpan", "msn", "mprn", "msn")
+        with FakeOctopusServer(usage=usage, latency=options["latency"]) as server:
+            client = OctopusAPIClient(*meter, base_url=server.base_url, page_size=options["page_size"])
+            t = time.perf_counter()
+            sequential = client.get_elec_usage(start, end)
+            sequential_time = time.perf_counter() - t
+            sequential_requests = len(server.requests)
+
+            with AsyncOctopusAPIClient(*meter, base_url=server.base_url,
+                                       page_size=options["page_size"],
+                                       chunk=timedelta(days=options["chunk_days"]),
+                                       max_concurrency=options["concurrency"]) as async_client:
+                t = time.perf_counter()
+                concurrent = asyncio.run(async_client.get_elec_usage(start, end))
+                concurrent_time = time.perf_counter() - t
+            concurrent_requests = len(server.requests) - sequential_requests
+
+        assert sequential == concurrent == usage, "Results differ"
+
+        self.stdout.write(f"{options['days']} days, {slots} slots, "
+                          f"{options['latency'] * 1000:.0f}ms/request, page_size={options['page_size']}\n"
+                          f"sequential: {sequential_time:7.2f}s ({sequential_requests} requests)\n"
+                          f"concurrent: {concurrent_time:7.2f}s ({concurrent_requests} requests, "
+                          f"{options['chunk_days']} day chunks x{options['concurrency']}) "
+                          f"{sequential_time / concurrent_time:.1f}x")
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from planner.benchmarks import (BENCHMARK_SIZES, BENCHMARKS, DEFAULT_BASELINE, MEMORY_THRESHOLD, TIME_THRESHOLD,
+                                load_baseline, regressions, result_key, run_benchmarks, save_baseline)
+
+
+class Command(BaseCommand):
+    help = "Time and measure the planner's hot paths over synthetic prices, and compare against a baseline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--functions", nargs="+", choices=[b.name for b in BENCHMARKS])
+        parser.add_argument("--sizes", nargs="+", choices=list(BENCHMARK_SIZES))
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+        parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline")
+        parser.add_argument("--time-threshold", type=float, default=TIME_THRESHOLD)
+        parser.add_argument("--memory-threshold", type=float, default=MEMORY_THRESHOLD)
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(options["functions"], options["sizes"], options["repeat"], options["seed"])
+        baseline = load_baseline(options["baseline"])
+        if baseline is None and not options["save_baseline"]:
+            self.stderr.write(f"No baseline at {options['baseline']}, so nothing to compare against. "
+                              f"Run with --save-baseline first, on this machine.")
+        baseline = baseline or {}
+
+        self.stdout.write(f"{'benchmark':<32}{'best ms':>10}{'median ms':>11}{'peak KiB':>11}{'vs baseline':>13}")
+        for r in results:
+            base = baseline.get(result_key(r))
+            change = f"{r.seconds / base['seconds']:.2f}x" if base else "-"
+            self.stdout.write(f"{result_key(r):<32}{r.seconds * 1000:10.2f}{r.median * 1000:11.2f}"
+                              f"{r.peak_kb:11.0f}{change:>13}")
+
+        if options["save_baseline"]:
+            save_baseline(results, options["baseline"])
+            self.stdout.write(f"Baseline saved to {options['baseline']}")
+            return
+
+        found = regressions(results, baseline, options["time_threshold"], options["memory_threshold"])
+        if found:
+            raise CommandError("Regressions:\n" + "\n".join(f"{result_key(r)}: {reason}" for r, reason in found))
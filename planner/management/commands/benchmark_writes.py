@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from datetime import datetime, timedelta, timezone
+import time
+
+from octopus.octopus_data import store_time_series, BULK_CREATE_BATCH_SIZE
+from octopus.price_series import to_slot
+from planner.models import SeriesValue, TimeSeries
+
+
+class Command(BaseCommand):
+    help = "Compare rows/second of per-row save() against the bulk write path used by cached_time_series."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=2000)
+        parser.add_argument("--batch-size", type=int, default=BULK_CREATE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+
+        # Somewhere well before any real data, so we can clear up after ourselves.
+        start = datetime(1990, 1, 1, tzinfo=timezone.utc)
+        loop_data = {start + timedelta(minutes=30) * i: float(i % 48) for i in range(rows)}
+        bulk_data = {t + timedelta(minutes=30) * rows: v for t, v in loop_data.items()}
+        end = start + timedelta(minutes=30) * rows * 2
+
+        series = TimeSeries.usage()
+        stored = SeriesValue.objects.filter(series=series, slot__gte=to_slot(start), slot__lt=to_slot(end))
+        stored.delete()
+        try:
+            t = time.perf_counter()
+            for period_start, value in loop_data.items():
+                SeriesValue(series=series, slot=to_slot(period_start), data=value).save()
+            loop_time = time.perf_counter() - t
+
+            t = time.perf_counter()
+            store_time_series(series, bulk_data, batch_size=options["batch_size"])
+            bulk_time = time.perf_counter() - t
+
+            # Writing the same rows again should be a no-op, not an IntegrityError.
+            t = time.perf_counter()
+            store_time_series(series, bulk_data, batch_size=options["batch_size"])
+            conflict_time = time.perf_counter() - t
+        finally:
+            stored.delete()
+
+        self.stdout.write(f"{rows} rows\n"
+                          f"save() per row:      {rows / loop_time:10.0f} rows/s\n"
+                          f"bulk_create:         {rows / bulk_time:10.0f} rows/s "
+                          f"({loop_time / bulk_time:.1f}x)\n"
+                          f"bulk_create (dupes): {rows / conflict_time:10.0f} rows/s")
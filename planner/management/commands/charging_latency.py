@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from config import TESLA_PREWAKE_MINUTES
+from planner.dispatcher import start_latencies
+
+
+class Command(BaseCommand):
+    help = "Show how late recent charging periods actually started, to tune TESLA_PREWAKE_MINUTES."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--periods", type=int, default=100)
+
+    def handle(self, *args, **options):
+        latencies = sorted(start_latencies(options["periods"]))
+        if not latencies:
+            self.stdout.write("No charging periods with a recorded start yet.")
+            return
+
+        p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+        self.stdout.write(f"Pre-wake lead: {TESLA_PREWAKE_MINUTES} minutes\n"
+                          f"Start latency over {len(latencies)} periods: "
+                          f"median {latencies[len(latencies) // 2]:.1f}s, p95 {p95:.1f}s, max {latencies[-1]:.1f}s")
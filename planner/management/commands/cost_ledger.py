@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from datetime import date, datetime, timedelta, timezone
+
+from planner.insights.data_tools import start_of_current_period
+from planner.ledger import charging_costs, update_cost_ledger, water_heating_costs
+from planner.models import CarChargingSession, DailyCost, MonthlyCost, WaterHeatingPeriod, WeeklyCost
+
+
+class Command(BaseCommand):
+    help = "Update the cost ledger from stored usage and prices, and show what recent plans actually cost."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7, help="Days of usage to fetch and plans to show")
+        parser.add_argument("--since", type=date.fromisoformat, help="Rebuild the ledger from this day")
+        parser.add_argument("--no-fetch", action="store_true", help="Only use usage already stored")
+
+    def handle(self, *args, **options):
+        end = start_of_current_period()
+        start = end - timedelta(days=options["days"])
+
+        if not options["no_fetch"]:
+            from planner.common import energy_provider
+            energy_provider.get_elec_usage(start, end)
+            energy_provider.get_gas_usage(start, end)
+            energy_provider.get_elec_price(start, end)
+
+        written = update_cost_ledger(since=options["since"], now=datetime.now(tz=timezone.utc))
+        self.stdout.write(f"{written} days written")
+
+        for model in (DailyCost, WeeklyCost, MonthlyCost):
+            self.stdout.write(f"\n{model.__name__}")
+            self.stdout.write(f"{'start':<12}{'kWh':>8}{'elec £':>9}{'p/kWh':>8}{'gas kWh':>9}{'gas £':>8}{'total £':>9}"
+                              f"{'unpriced kWh':>14}")
+            for row in reversed(model.objects.order_by('-start')[:options["days"]]):
+                self.stdout.write(f"{row.start.isoformat():<12}{row.elec_kwh:>8.1f}{row.elec_cost / 100:>9.2f}"
+                                  f"{row.elec_average or 0:>8.2f}{row.gas_kwh:>9.1f}{row.gas_cost / 100:>8.2f}"
+                                  f"{row.cost / 100:>9.2f}{row.unpriced_kwh:>14.1f}")
+
+        self.stdout.write(f"\n{'plan':<40}{'planned kWh':>12}{'planned £':>10}{'kWh':>8}{'£':>8}")
+        sessions = CarChargingSession.objects.filter(departure__gte=start).order_by('departure')
+        periods = WaterHeatingPeriod.objects.filter(start_time__gte=start).order_by('start_time')
+        for plan in charging_costs(sessions):
+            self._write_plan(f"car charging for {plan.plan.departure_formatted}", plan)
+        for plan in water_heating_costs(periods):
+            self._write_plan(f"{'electric' if plan.plan.elec_heating else 'gas'} hot water "
+                             f"{plan.plan.start_time_formatted}", plan)
+
+    def _write_plan(self, label, plan):
+        self.stdout.write(f"{label:<40}{plan.planned_kwh:>12.1f}{plan.planned_cost / 100:>10.2f}"
+                          f"{plan.kwh:>8.1f}{plan.cost / 100:>8.2f}")
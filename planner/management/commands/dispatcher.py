@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from planner.dispatcher import DISPATCH_POLL_INTERVAL, Dispatcher
+
+
+class Command(BaseCommand):
+    help = "Run scheduled tasks at their action times. Runs until killed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--poll", type=float, default=DISPATCH_POLL_INTERVAL,
+                            help="Seconds between checks for newly scheduled tasks")
+
+    def handle(self, *args, **options):
+        dispatcher = Dispatcher(poll_interval=options["poll"])
+        try:
+            dispatcher.run_forever()
+        except KeyboardInterrupt:
+            self.stdout.write(f"Stopped. {dispatcher.stats()}")
@@ -4,7 +4,7 @@ from config import *
 
 from ..common import energy_planner
 from ..insights.data_tools import format_short_date, format_short_date_range, start_of_current_period
-from ..insights.visualisation_tools import plot_png
+from ..insights.daily_insights import HEADLINE_WINDOW_HOURS, get_daily_insights
 from ..models import EmailLog
 from .email import send_email
 
@@ -40,25 +40,21 @@ def notify_users_of_prices(test_mode: bool = False):
         logging.info("Data not yet available for tomorrow. Skipping")
         return False
 
-    ep_pd = energy_planner.ep_df_from_now()
-    gp_pd = energy_planner.gp_df_from_now()
+    # Windows, averages and the graph are worked out once per set of prices.
+    insights = get_daily_insights(energy_planner)
 
-    # Get best stop & start times for Electric usage.
-    best_starts_and_stops, best_price = energy_planner.plan_usage_periods(hours=3, mode="best")
-    peak_starts_and_stops, peak_price = energy_planner.plan_usage_periods(hours=3, mode="peak")
+    best_time = format_short_date_range((insights.best_start, insights.best_stop))
+    peak_time = format_short_date_range((insights.peak_start, insights.peak_stop))
 
-    # Get an HTML graph of the same
+    appliance_message = "".join(f"{name} {format_short_date_range(start_and_stop)} - {cost:.1f}p\n"
+                                for name, start_and_stop, cost in insights.appliance_plans())
 
-    best_time = format_short_date_range(best_starts_and_stops[0])
-    peak_time = format_short_date_range(peak_starts_and_stops[0])
-    average = energy_planner.average_price()
-    average_excluding_peak = energy_planner.average_price(excluded_periods=peak_starts_and_stops)
-
-    png = plot_png([ep_pd, gp_pd], starts_and_stops=best_starts_and_stops + peak_starts_and_stops)
-    price_message = f"Best 3h {best_time} - {best_price:.2f}p/kWh\n" \
-                    f"Peak 3h {peak_time} - {peak_price:.2f}p/kWh\n" \
-                    f"Average all-day {average:.2f}p/kWh\n" \
-                    f"Average outside peak {average_excluding_peak:.2f}p/kWh\n" \
+    png = bytes(insights.png)
+    price_message = f"Best {HEADLINE_WINDOW_HOURS}h {best_time} - {insights.best_price:.2f}p/kWh\n" \
+                    f"Peak {HEADLINE_WINDOW_HOURS}h {peak_time} - {insights.peak_price:.2f}p/kWh\n" \
+                    f"Average all-day {insights.average:.2f}p/kWh\n" \
+                    f"Average outside peak {insights.average_excluding_peak:.2f}p/kWh\n" \
+                    f"{appliance_message}" \
                     f"<a href=\"http://192.168.0.2:8000\">Click here</a> to view graph.\n"
 
     if test_mode:
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.3 on 2026-10-18 13:20
+
+from django.db import migrations, models
+import planner.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0004_waterheatingperiod'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='energyprices',
+            old_name='price',
+            new_name='data',
+        ),
+        migrations.CreateModel(
+            name='EnergyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(unique=True, validators=[planner.models.check_timezone])),
+                ('data', models.FloatField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.3 on 2026-10-18 15:05
+
+from django.db import migrations, models
+import planner.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0005_energy_time_series'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyInsights',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(unique=True)),
+                ('created', models.DateTimeField(validators=[planner.models.check_timezone])),
+                ('best_start', models.DateTimeField(validators=[planner.models.check_timezone])),
+                ('best_stop', models.DateTimeField(validators=[planner.models.check_timezone])),
+                ('best_price', models.FloatField()),
+                ('peak_start', models.DateTimeField(validators=[planner.models.check_timezone])),
+                ('peak_stop', models.DateTimeField(validators=[planner.models.check_timezone])),
+                ('peak_price', models.FloatField()),
+                ('average', models.FloatField()),
+                ('average_excluding_peak', models.FloatField()),
+                ('windows', models.JSONField(default=list)),
+                ('appliances', models.JSONField(default=list)),
+                ('graph_script', models.TextField()),
+                ('graph_div', models.TextField()),
+                ('png', models.BinaryField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.3 on 2026-10-18 16:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import planner.models
+
+
+def task_fk(related_name):
+    return models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL,
+                             related_name=related_name, to='planner.systemscheduletasks')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0006_dailyinsights'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SystemScheduleTasks',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action_time', models.DateTimeField(validators=[planner.models.check_timezone])),
+                ('completed', models.BooleanField(default=False)),
+                ('function', models.TextField()),
+                ('idempotency_key', models.CharField(blank=True, max_length=100, null=True, unique=True)),
+                ('claimed_by', models.CharField(blank=True, max_length=100, null=True)),
+                ('lease_expires', models.DateTimeField(blank=True, null=True, validators=[planner.models.check_timezone])),
+                ('completed_at', models.DateTimeField(blank=True, null=True, validators=[planner.models.check_timezone])),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('completed', False)), fields=['action_time', 'lease_expires'], name='pending_tasks_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SystemScheduleTasksArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.BigIntegerField(unique=True)),
+                ('action_time', models.DateTimeField(validators=[planner.models.check_timezone])),
+                ('function', models.TextField()),
+                ('idempotency_key', models.CharField(blank=True, max_length=100, null=True)),
+                ('claimed_by', models.CharField(blank=True, max_length=100, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True, validators=[planner.models.check_timezone])),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='carchargingsession',
+            name='scheduled',
+            field=models.BooleanField(default=False),
+        ),
+        # The task id columns were free text that nothing ever filled in, so they're replaced rather
+        # than converted.
+        migrations.RemoveField(model_name='carchargingperiod', name='start_task_id'),
+        migrations.RemoveField(model_name='carchargingperiod', name='stop_task_id'),
+        migrations.RemoveField(model_name='waterheatingperiod', name='start_task_id'),
+        migrations.RemoveField(model_name='waterheatingperiod', name='stop_task_id'),
+        migrations.AddField(model_name='carchargingperiod', name='start_task_id', field=task_fk('charging_starts')),
+        migrations.AddField(model_name='carchargingperiod', name='stop_task_id', field=task_fk('charging_stops')),
+        migrations.AddField(model_name='waterheatingperiod', name='start_task_id', field=task_fk('water_heating_starts')),
+        migrations.AddField(model_name='waterheatingperiod', name='stop_task_id', field=task_fk('water_heating_stops')),
+    ]
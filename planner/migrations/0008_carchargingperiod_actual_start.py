@@ -0,0 +1,19 @@
+# Generated by Django 3.2.3 on 2026-10-18 17:25
+
+from django.db import migrations, models
+import planner.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0007_task_claims'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carchargingperiod',
+            name='actual_start',
+            field=models.DateTimeField(blank=True, null=True, validators=[planner.models.check_timezone]),
+        ),
+    ]
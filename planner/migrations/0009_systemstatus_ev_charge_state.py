@@ -0,0 +1,23 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0008_carchargingperiod_actual_start'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemstatus',
+            name='ev_charge_limit',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='systemstatus',
+            name='ev_charge_current',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
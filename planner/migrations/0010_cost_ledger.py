@@ -0,0 +1,56 @@
+# Generated by Django 3.2.3 on 2026-10-18 20:40
+
+from django.db import migrations, models
+import planner.models
+
+
+def rollup_fields():
+    return [
+        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+        ('start', models.DateField(unique=True)),
+        ('elec_kwh', models.FloatField(default=0)),
+        ('elec_cost', models.FloatField(default=0)),
+        ('gas_kwh', models.FloatField(default=0)),
+        ('gas_cost', models.FloatField(default=0)),
+        ('slots', models.IntegerField(default=0)),
+        ('updated', models.DateTimeField(validators=[planner.models.check_timezone])),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0009_systemstatus_ev_charge_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GasUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(unique=True, validators=[planner.models.check_timezone])),
+                ('data', models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyCost',
+            fields=rollup_fields(),
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='WeeklyCost',
+            fields=rollup_fields(),
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyCost',
+            fields=rollup_fields(),
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
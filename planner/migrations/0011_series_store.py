@@ -0,0 +1,111 @@
+# Generated by Django 3.2.3 on 2026-10-18 22:05
+
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from config import OCTOPUS_ZONE
+
+SLOT_SECONDS = 30 * 60
+BATCH_SIZE = 5000
+
+# The product that was hard-coded before prices were stored per tariff.
+OLD_PRODUCT = "AGILE-18-02-21"
+
+
+def old_series():
+    """(old model, TimeSeries fields) for each table being folded into SeriesValue."""
+    return [("EnergyPrices", {"kind": "price", "fuel": "elec", "tariff": OLD_PRODUCT, "zone": OCTOPUS_ZONE}),
+            ("EnergyUsage", {"kind": "usage", "fuel": "elec", "tariff": "", "zone": ""}),
+            ("GasUsage", {"kind": "usage", "fuel": "gas", "tariff": "", "zone": ""})]
+
+
+def copy_to_series(apps, schema_editor):
+    TimeSeries = apps.get_model('planner', 'TimeSeries')
+    SeriesValue = apps.get_model('planner', 'SeriesValue')
+
+    for model_name, fields in old_series():
+        model = apps.get_model('planner', model_name)
+        if not model.objects.exists():
+            continue
+        series = TimeSeries.objects.create(direction="import", **fields)
+        rows = model.objects.values_list('time', 'data').iterator(BATCH_SIZE)
+        batch = []
+        for time, data in rows:
+            batch.append(SeriesValue(series=series, slot=int(time.timestamp()) // SLOT_SECONDS, data=data))
+            if len(batch) == BATCH_SIZE:
+                SeriesValue.objects.bulk_create(batch)
+                batch = []
+        SeriesValue.objects.bulk_create(batch)
+
+
+def copy_from_series(apps, schema_editor):
+    TimeSeries = apps.get_model('planner', 'TimeSeries')
+    SeriesValue = apps.get_model('planner', 'SeriesValue')
+
+    for model_name, fields in old_series():
+        model = apps.get_model('planner', model_name)
+        series = TimeSeries.objects.filter(direction="import", **fields).first()
+        if series is None:
+            continue
+        rows = SeriesValue.objects.filter(series=series).values_list('slot', 'data').iterator(BATCH_SIZE)
+        batch = []
+        for slot, data in rows:
+            batch.append(model(time=datetime.fromtimestamp(slot * SLOT_SECONDS, tz=timezone.utc), data=data))
+            if len(batch) == BATCH_SIZE:
+                model.objects.bulk_create(batch)
+                batch = []
+        model.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0010_cost_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimeSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('price', 'Price'), ('usage', 'Usage')], max_length=8)),
+                ('fuel', models.CharField(choices=[('elec', 'Electricity'), ('gas', 'Gas')], max_length=8)),
+                ('direction', models.CharField(choices=[('import', 'Import'), ('export', 'Export')], default='import',
+                                               max_length=8)),
+                ('tariff', models.CharField(blank=True, max_length=64)),
+                ('zone', models.CharField(blank=True, max_length=1)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SeriesValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.IntegerField()),
+                ('data', models.FloatField()),
+                ('series', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE,
+                                             to='planner.timeseries')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='timeseries',
+            constraint=models.UniqueConstraint(fields=('kind', 'fuel', 'direction', 'tariff', 'zone'),
+                                               name='time_series_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='seriesvalue',
+            constraint=models.UniqueConstraint(fields=('series', 'slot'), include=('data',),
+                                               name='series_value_key'),
+        ),
+        migrations.RunPython(copy_to_series, copy_from_series),
+        migrations.DeleteModel(
+            name='EnergyPrices',
+        ),
+        migrations.DeleteModel(
+            name='EnergyUsage',
+        ),
+        migrations.DeleteModel(
+            name='GasUsage',
+        ),
+    ]
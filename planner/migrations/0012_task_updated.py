@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-19 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0011_series_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemscheduletasks',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
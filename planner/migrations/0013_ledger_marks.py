@@ -0,0 +1,53 @@
+# Generated by Django 3.2.3 on 2026-10-19 11:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0012_task_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailycost',
+            name='unpriced_kwh',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dailycost',
+            name='unpriced_slots',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='weeklycost',
+            name='unpriced_kwh',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='weeklycost',
+            name='unpriced_slots',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='monthlycost',
+            name='unpriced_kwh',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='monthlycost',
+            name='unpriced_slots',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='LedgerMark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_value_id', models.BigIntegerField(default=0)),
+                ('series', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE,
+                                                to='planner.timeseries')),
+            ],
+        ),
+    ]
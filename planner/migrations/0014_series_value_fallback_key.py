@@ -0,0 +1,41 @@
+# Generated by Django 3.2.3 on 2026-10-19 14:20
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+# The plain unique index used where the covering series_value_key can't be created.
+FALLBACK_KEY = "series_value_slot_key"
+
+
+def add_fallback_key(apps, schema_editor):
+    if schema_editor.connection.features.supports_covering_indexes:
+        return
+    SeriesValue = apps.get_model('planner', 'SeriesValue')
+
+    # Without a key nothing stopped duplicates being stored - keep the first of each.
+    duplicates = SeriesValue.objects.values('series', 'slot').annotate(n=Count('id'), first=Min('id')).filter(n__gt=1)
+    for row in duplicates.iterator():
+        SeriesValue.objects.filter(series=row['series'], slot=row['slot']).exclude(id=row['first']).delete()
+
+    quote = schema_editor.quote_name
+    schema_editor.execute(f"CREATE UNIQUE INDEX {quote(FALLBACK_KEY)} ON {quote(SeriesValue._meta.db_table)} "
+                          f"({quote('series_id')}, {quote('slot')})")
+
+
+def remove_fallback_key(apps, schema_editor):
+    if schema_editor.connection.features.supports_covering_indexes:
+        return
+    SeriesValue = apps.get_model('planner', 'SeriesValue')
+    schema_editor.execute(schema_editor.sql_delete_index % {"name": schema_editor.quote_name(FALLBACK_KEY),
+                                                            "table": schema_editor.quote_name(SeriesValue._meta.db_table)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0013_ledger_marks'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_fallback_key, remove_fallback_key),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
 from datetime import datetime
 from tzlocal import get_localzone
@@ -10,24 +10,141 @@ def check_timezone(time):
         raise ValidationError("All times must have timezone going into the database")
 
 
-class EnergyPrices(models.Model):
-    __tablename__ = 'energy_prices'
+class TimeSeries(models.Model):
+    """
+    A half-hourly series: a tariff's unit rates in one zone, or one meter's readings. The values
+    are SeriesValue rows.
+    """
+    __tablename__ = 'time_series'
+
+    PRICE, USAGE = "price", "usage"
+    ELEC, GAS = "elec", "gas"
+    IMPORT, EXPORT = "import", "export"
+
+    kind = models.CharField(max_length=8, choices=[(PRICE, "Price"), (USAGE, "Usage")])
+    fuel = models.CharField(max_length=8, choices=[(ELEC, "Electricity"), (GAS, "Gas")])
+    direction = models.CharField(max_length=8, choices=[(IMPORT, "Import"), (EXPORT, "Export")], default=IMPORT)
+    tariff = models.CharField(max_length=64, blank=True)    # Octopus product code, e.g. AGILE-18-02-21
+    zone = models.CharField(max_length=1, blank=True)       # Region (GSP group) letter, e.g. H
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['kind', 'fuel', 'direction', 'tariff', 'zone'],
+                                               name='time_series_key')]
 
-    time = models.DateTimeField(unique=True, validators=[check_timezone])
+    def __repr__(self):
+        return f"<TimeSeries({self.kind}, {self.fuel} {self.direction}, tariff={self.tariff}, zone={self.zone})>"
+
+    @classmethod
+    def prices(cls, tariff: str, zone: str, fuel: str = ELEC, direction: str = IMPORT):
+        """The unit rates of a tariff in a zone, created if new."""
+        return cls._resolve(kind=cls.PRICE, fuel=fuel, direction=direction, tariff=tariff, zone=zone)
+
+    @classmethod
+    def usage(cls, fuel: str = ELEC, direction: str = IMPORT):
+        """What our meter recorded, created if new."""
+        return cls._resolve(kind=cls.USAGE, fuel=fuel, direction=direction, tariff="", zone="")
+
+    @classmethod
+    def _resolve(cls, **fields):
+        """
+        The series with these fields, looked up once per process. Series are never deleted, so one
+        is only remembered once it is committed - a series created in a transaction that is rolled
+        back is looked up (and created) again next time.
+        """
+        key = tuple(sorted(fields.items()))
+        series = _resolved_series.get(key)
+        if series is None:
+            series = cls.objects.get_or_create(**fields)[0]
+            transaction.on_commit(lambda: _resolved_series.setdefault(key, series))
+        return series
+
+
+# {TimeSeries fields: committed TimeSeries} - see TimeSeries._resolve
+_resolved_series = {}
+
+
+class SeriesValue(models.Model):
+    """
+    One half-hour of a TimeSeries. `slot` is as octopus.price_series.to_slot.
+
+    (series, slot) is the key, and the index behind it INCLUDEs `data`, so reading a range of one
+    series is an index-only scan however much history there is. Covering unique constraints are
+    PostgreSQL only - Django leaves it out entirely on other databases, so migration 0014 adds a
+    plain unique index there instead (see planner.checks).
+    """
+    __tablename__ = 'series_value'
+
+    series = models.ForeignKey(TimeSeries, on_delete=models.CASCADE, db_index=False)    # The key leads with it
+    slot = models.IntegerField()
     data = models.FloatField()
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['series', 'slot'], include=['data'],
+                                               name='series_value_key')]
+
     def __repr__(self):
-        return f"<Price(time={self.time}, price=£{self.data:.2f})>"
+        return f"<SeriesValue(series={self.series_id}, slot={self.slot}, data={self.data:.2f})>"
+
+
+class CostRollup(models.Model):
+    """
+    Energy used, and what it cost, over a local calendar period starting on `start`. Built from the
+    half-hourly usage and prices by planner.ledger, so nothing that shows totals needs to read them.
+    """
+    start = models.DateField(unique=True)
 
+    elec_kwh = models.FloatField(default=0)
+    elec_cost = models.FloatField(default=0)        # pence
+    gas_kwh = models.FloatField(default=0)
+    gas_cost = models.FloatField(default=0)         # pence
+    slots = models.IntegerField(default=0)          # Half-hours with electricity usage and a price
+    unpriced_kwh = models.FloatField(default=0)     # Electricity used in half-hours with no price yet...
+    unpriced_slots = models.IntegerField(default=0)     # ...and how many of those there were
 
-class EnergyUsage(models.Model):
-    __talename__ = 'energy_usage'
+    updated = models.DateTimeField(validators=[check_timezone])
 
-    time = models.DateTimeField(unique=True, validators=[check_timezone])
-    data = models.FloatField()
+    class Meta:
+        abstract = True
+
+    def __repr__(self):
+        return f"<{type(self).__name__}(start={self.start}, elec=£{self.elec_cost / 100:.2f}, " \
+               f"gas=£{self.gas_cost / 100:.2f})>"
+
+    @property
+    def cost(self) -> float:
+        return self.elec_cost + self.gas_cost
+
+    @property
+    def elec_average(self) -> float:
+        """p/kWh paid for electricity, or None if none was used."""
+        return self.elec_cost / self.elec_kwh if self.elec_kwh else None
+
+
+class DailyCost(CostRollup):
+    __tablename__ = 'daily_cost'
+
+
+class WeeklyCost(CostRollup):
+    __tablename__ = 'weekly_cost'       # Weeks start on Monday
+
+
+class MonthlyCost(CostRollup):
+    __tablename__ = 'monthly_cost'
+
+
+class LedgerMark(models.Model):
+    """
+    How much of a TimeSeries planner.ledger has costed: the highest SeriesValue id it had read.
+    Values are only ever added, with ever higher ids, so anything above the mark has arrived since -
+    whichever days it is for.
+    """
+    __tablename__ = 'ledger_mark'
+
+    series = models.OneToOneField(TimeSeries, on_delete=models.CASCADE)
+    last_value_id = models.BigIntegerField(default=0)
 
     def __repr__(self):
-        return f"<Usage(time={self.time}, usage={self.data:.2f}kWh)>"
+        return f"<LedgerMark(series={self.series_id}, last_value_id={self.last_value_id})>"
 
 
 class EmailLog(models.Model):
@@ -39,6 +156,57 @@ class EmailLog(models.Model):
         return f"<Price(time={self.time})>"
 
 
+class DailyInsights(models.Model):
+    """
+    Everything the dashboard and the daily email show about a set of prices, worked out once when the
+    prices are published rather than on every page load.
+
+    `version` identifies the price data it was built from: the slot index (half-hours since the epoch)
+    of the end of the published prices.
+    """
+    __tablename__ = 'daily_insights'
+
+    version = models.BigIntegerField(unique=True)
+    created = models.DateTimeField(validators=[check_timezone])
+
+    best_start = models.DateTimeField(validators=[check_timezone])
+    best_stop = models.DateTimeField(validators=[check_timezone])
+    best_price = models.FloatField()
+    peak_start = models.DateTimeField(validators=[check_timezone])
+    peak_stop = models.DateTimeField(validators=[check_timezone])
+    peak_price = models.FloatField()
+
+    average = models.FloatField()
+    average_excluding_peak = models.FloatField()
+
+    windows = models.JSONField(default=list)        # [[hours, best start, best stop, price, peak start, ...]]
+    appliances = models.JSONField(default=list)     # [[name, start, stop, cost]]
+
+    graph_script = models.TextField()
+    graph_div = models.TextField()
+    png = models.BinaryField()
+
+    def __repr__(self):
+        return f"<DailyInsights(version={self.version}, created={self.created})>"
+
+    @property
+    def graph(self) -> (str, str):
+        """As returned by plot_html."""
+        return self.graph_script, self.graph_div
+
+    def window_plans(self) -> list:
+        """[(hours, (best start, best stop), best price, (peak start, peak stop), peak price)]"""
+        return [(hours,
+                 (datetime.fromisoformat(best_start), datetime.fromisoformat(best_stop)), best_price,
+                 (datetime.fromisoformat(peak_start), datetime.fromisoformat(peak_stop)), peak_price)
+                for hours, best_start, best_stop, best_price, peak_start, peak_stop, peak_price in self.windows]
+
+    def appliance_plans(self) -> list:
+        """[(name, (start, stop), cost)], as plan_appliances."""
+        return [(name, (datetime.fromisoformat(start), datetime.fromisoformat(stop)), cost)
+                for name, start, stop, cost in self.appliances]
+
+
 class SystemStatus(models.Model):
     system_id = models.IntegerField(unique=True)
 
@@ -49,15 +217,59 @@ class SystemStatus(models.Model):
     ev_charge_override = models.BooleanField()  # If car state not reflecting `ev_charging`; will we update car?
     ev_charging = models.BooleanField()  # Should we be charging now?
     ev_soc = models.IntegerField()  # Latest SoC
+    ev_charge_limit = models.IntegerField(null=True, blank=True)  # Latest charge limit (%)
+    ev_charge_current = models.FloatField(null=True, blank=True)  # Latest requested charge current (A)
     ev_last_updated = models.DateTimeField(  # When did we last get info from the API
         validators=[check_timezone])
 
 
 class SystemScheduleTasks(models.Model):
+    """
+    A function (named in planner.tasks.TASKS) to run at action_time.
+
+    A runner claims a task by setting claimed_by and a lease. If the runner dies before marking it
+    completed, the lease expires and another runner can claim it. Completed tasks are moved to
+    SystemScheduleTasksArchive by the `archive_tasks` command, so this table only holds what's
+    pending or recent.
+    """
     action_time = models.DateTimeField(validators=[check_timezone])
     completed = models.BooleanField(default=False)
     function = models.TextField()
 
+    # Identifies the action, so scheduling the same thing twice can't create a second task.
+    idempotency_key = models.CharField(max_length=100, unique=True, null=True, blank=True)
+
+    claimed_by = models.CharField(max_length=100, null=True, blank=True)
+    lease_expires = models.DateTimeField(null=True, blank=True, validators=[check_timezone])
+    completed_at = models.DateTimeField(null=True, blank=True, validators=[check_timezone])
+
+    # Last save(), so a Dispatcher notices a pending task being moved. Anything editing tasks with
+    # QuerySet.update() must set it too.
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # The due-task query only ever looks at pending tasks.
+            models.Index(fields=['action_time', 'lease_expires'],
+                         name='pending_tasks_idx',
+                         condition=models.Q(completed=False)),
+        ]
+
+    def __repr__(self):
+        return f"<Task({self.function} at {self.action_time}, completed={self.completed})>"
+
+
+class SystemScheduleTasksArchive(models.Model):
+    """
+    Completed SystemScheduleTasks, moved out of the way of the due-task query.
+    """
+    task_id = models.BigIntegerField(unique=True)
+    action_time = models.DateTimeField(validators=[check_timezone])
+    function = models.TextField()
+    idempotency_key = models.CharField(max_length=100, null=True, blank=True)
+    claimed_by = models.CharField(max_length=100, null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True, validators=[check_timezone])
+
 
 # class SystemDailyTasks(models.Model):
 #     action_time = models.TimeField()
@@ -74,6 +286,7 @@ class CarChargingSession(models.Model):
 
     departure = models.DateTimeField(validators=[check_timezone])
     average_cost = models.FloatField()
+    scheduled = models.BooleanField(default=False)
 
     def as_dict(self):
         return {"id": self.id,
@@ -94,17 +307,29 @@ class CarChargingPeriod(models.Model):
     start_time = models.DateTimeField(validators=[check_timezone])
     stop_time = models.DateTimeField(validators=[check_timezone])
 
-    start_task_id = models.ForeignKey(SystemScheduleTasks, on_delete=models.CASCADE)
-    stop_task_id = models.ForeignKey(SystemScheduleTasks, on_delete=models.CASCADE)
+    start_task_id = models.ForeignKey(SystemScheduleTasks, on_delete=models.SET_NULL, null=True, blank=True,
+                                      related_name='charging_starts')
+    stop_task_id = models.ForeignKey(SystemScheduleTasks, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='charging_stops')
 
     parent = models.ForeignKey(CarChargingSession, on_delete=models.CASCADE)
 
+    # When the car actually started charging, to measure how late starts are (see TESLA_PREWAKE_MINUTES).
+    actual_start = models.DateTimeField(null=True, blank=True, validators=[check_timezone])
+
     def as_dict(self):
         return {"id": self.id,
                 "start_time": self.start_time.replace(tzinfo=pytz.timezone("UTC")),
                 "stop_time": self.stop_time.replace(tzinfo=pytz.timezone("UTC")),
                 "parent": self.parent_id}
 
+    @property
+    def start_latency(self) -> float:
+        """Seconds between the planned and actual start, or None if it hasn't started."""
+        if self.actual_start is None:
+            return None
+        return (self.actual_start - self.start_time).total_seconds()
+
     @property
     def start_time_formatted(self):
         return datetime.strftime(self.start_time.astimezone(get_localzone()), "%a %d %H%M")
@@ -121,8 +346,10 @@ class WaterHeatingPeriod(models.Model):
     start_time = models.DateTimeField(validators=[check_timezone])
     stop_time = models.DateTimeField(validators=[check_timezone])
 
-    start_task_id = models.ForeignKey(SystemScheduleTasks, on_delete=models.CASCADE)
-    stop_task_id = models.ForeignKey(SystemScheduleTasks, on_delete=models.CASCADE)
+    start_task_id = models.ForeignKey(SystemScheduleTasks, on_delete=models.SET_NULL, null=True, blank=True,
+                                      related_name='water_heating_starts')
+    stop_task_id = models.ForeignKey(SystemScheduleTasks, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='water_heating_stops')
 
     def as_dict(self):
         return {"id": self.id,
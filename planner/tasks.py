@@ -1,42 +1,112 @@
+import logging
+
 from tesla import TeslaAPIClient
+from planner.dispatcher import record_charging_start
 from planner.messaging import notify_users_of_prices
 
-from gpiozero import DigitalOutputDevice
-from gpiozero.pins.pigpio import PiGPIOFactory
-
 from config import *
 
-hot_water_elec = DigitalOutputDevice(PI_ELEC_WATER_HEATER_PIN, pin_factory=PiGPIOFactory(host=PI_IP))
-nest_override = DigitalOutputDevice(PI_NEST_OVERRIDE_PIN, pin_factory=PiGPIOFactory(host=PI_IP))
-hot_water_gas = DigitalOutputDevice(PI_GAS_WATER_HEATER_PIN, pin_factory=PiGPIOFactory(host=PI_IP))
-hot_water_gas.close()
-
 
-def get_tesla():
-    # The connection seems most robust if a new instance of the client is created each time.
-    # Not entirely sure why.
+def default_tesla() -> TeslaAPIClient:
     return TeslaAPIClient(TESLA_USERNAME,
                           TESLA_PASSWORD,
                           dry_run=DEV_MODE)
 
 
-def tesla_start_charging():
-    t = get_tesla()
-    t.start_charging()
+def default_outputs() -> dict:
+    """The relay outputs on the Pi at PI_IP, as {name: DigitalOutputDevice}."""
+    from gpiozero import DigitalOutputDevice
+    from gpiozero.pins.pigpio import PiGPIOFactory
+
+    outputs = {name: DigitalOutputDevice(pin, pin_factory=PiGPIOFactory(host=PI_IP))
+               for name, pin in (("hot_water_elec", PI_ELEC_WATER_HEATER_PIN),
+                                 ("nest_override", PI_NEST_OVERRIDE_PIN),
+                                 ("hot_water_gas", PI_GAS_WATER_HEATER_PIN))}
+    outputs["hot_water_gas"].close()
+    return outputs
+
+
+_make_tesla, _make_outputs = default_tesla, default_outputs
+_tesla = None
+_outputs = None
+
+
+def use_devices(make_tesla=None, make_outputs=None):
+    """
+    Run the tasks against other devices, e.g. a FakeTesla and gpiozero's MockFactory, rather than
+    the car and the Pi. Devices are only made when a task first needs them, so importing this
+    module doesn't need either.
+
+    :param make_tesla: Returns a TeslaAPIClient. Defaults to default_tesla.
+    :param make_outputs: Returns {name: output device}, as default_outputs. Defaults to default_outputs.
+    """
+    global _make_tesla, _make_outputs, _tesla, _outputs
+    _make_tesla = make_tesla or default_tesla
+    _make_outputs = make_outputs or default_outputs
+    _tesla = _outputs = None
+
+
+def get_tesla(fresh: bool = False) -> TeslaAPIClient:
+    """
+    The Tesla client, kept between tasks so the wake-up, start and stop for a period don't each
+    have to log in and list vehicles again.
 
+    :param fresh: Make a new client. The connection can go stale, so with_tesla does this on failure.
+    """
+    global _tesla
+    if _tesla is None or fresh:
+        _tesla = _make_tesla()
+    return _tesla
 
-def tesla_stop_charging():
-    t = get_tesla()
-    t.stop_charging()
 
+def get_output(name: str):
+    """One of the relay outputs, opening them all the first time any is needed."""
+    global _outputs
+    if _outputs is None:
+        _outputs = _make_outputs()
+    return _outputs[name]
 
-def water_start_heating():
-    hot_water_elec.on()
 
+def with_tesla(action):
+    """
+    Run action(client), retrying once with a new client if it fails.
+    """
+    try:
+        return action(get_tesla())
+    except Exception as e:
+        logging.warning(f"Tesla call failed ({e}). Retrying with a new client.")
+        return action(get_tesla(fresh=True))
 
-def water_stop_heating():
-    hot_water_elec.off()
 
+def tesla_wake_up(task_id: int = None):
+    with_tesla(lambda t: t.wake_up())
 
-def daily_user_notification():
+
+def tesla_start_charging(task_id: int = None):
+    with_tesla(lambda t: t.start_charging())
+    record_charging_start(task_id)
+
+
+def tesla_stop_charging(task_id: int = None):
+    with_tesla(lambda t: t.stop_charging())
+
+
+def water_start_heating(task_id: int = None):
+    get_output("hot_water_elec").on()
+
+
+def water_stop_heating(task_id: int = None):
+    get_output("hot_water_elec").off()
+
+
+def daily_user_notification(task_id: int = None):
     notify_users_of_prices()
+
+
+# Everything that can be put in SystemScheduleTasks.function - see planner.dispatcher
+TASKS = {f.__name__: f for f in (tesla_wake_up,
+                                 tesla_start_charging,
+                                 tesla_stop_charging,
+                                 water_start_heating,
+                                 water_stop_heating,
+                                 daily_user_notification)}
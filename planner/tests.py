@@ -1,21 +1,988 @@
-from django.test import TestCase
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+import asyncio
+import functools
+import multiprocessing
+import os
+import tempfile
 
+import numpy
+import pandas
+import requests
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase
+
+from octopus.cassette import recording_session, replay_session
+from octopus.fetch_plan import plan_fetches
+from octopus.fake_server import FakeOctopusServer
+from octopus.octopus_api import GAS_PRICE, OctopusAPIClient, make_session, price_horizon
+from octopus.octopus_async import AsyncOctopusAPIClient
+from octopus.octopus_data import OctopusClient, PriceCache, cached_time_series, store_time_series, stored_time_series
+from octopus.price_series import SLOT, PriceSeries, to_slot
+from planner.benchmarks import load_baseline, regressions, result_key, run_benchmarks, save_baseline, synthetic_prices
+from planner.dispatcher import (Dispatcher, archive_completed_tasks, cancel_charging_session, claim_due_tasks, claim_task,
+                                record_charging_start, schedule_charging_session, start_latencies)
+from planner import tasks
 from planner.messaging import notify_users_of_prices
-from planner.common import energy_planner
-from config import DEV_MODE
+from planner.insights import EnergyPlanner
+from planner.insights.appliances import FFT_MIN_PROFILE, start_costs
+from planner.insights.backtest import CAR_WINDOW, day_windows, run_backtest
+from planner.insights.charging import (charge_cost, charging_intervals, cheapest_charge, cheapest_charge_rows,
+                                      count_starts, fewest_starts_charge, fewest_starts_charge_rows)
+from planner.insights.daily_insights import get_daily_insights
+from planner.insights.visualisation_tools import (RenderCache, downsample, plot_html, plot_png, render_cache, render_key,
+                                                 step_points)
+from planner.insights.household import FlexibleLoad, ShiftableLoad, schedule_loads, site_import
+from planner.insights.data_tools import drop_periods_from_df, find_contiguous_periods, start_of_current_period
+from planner.checks import check_series_value_key
+from planner.ledger import charging_costs, update_cost_ledger, water_heating_costs
+from planner.models import CarChargingPeriod, CarChargingSession, DailyCost, DailyInsights, SystemStatus, MonthlyCost, SeriesValue, SystemScheduleTasks, SystemScheduleTasksArchive, TimeSeries, WaterHeatingPeriod, WeeklyCost, _resolved_series
+from planner.vehicle_state import VehicleState
+from tesla import TeslaAPIClient
+from tesla.fake_teslapy import TYPICAL_WAKE_DELAY, FakeTesla, FakeVehicle
+from config import (DEV_MODE, EV_CHARGER_KW, HW_HEATER_KW, OCTOPUS_EXPORT_PRODUCT, OCTOPUS_PRODUCT, OCTOPUS_ZONE,
+                    TIMEZONE)
 
 
 class NotificationEmail(TestCase):
     def setUp(self):
-        pass
+        # Prices from now until 2300 tomorrow, as after the 1600 publication - served by a local fake
+        # Octopus API.
+        start = start_of_current_period()
+        self.horizon = price_horizon(start.astimezone(TIMEZONE).replace(hour=16, minute=0))
+        slots = int((self.horizon - start) / timedelta(minutes=30))
+        self.prices = {start + timedelta(minutes=30) * i: 10 + 10 * numpy.sin(i / 8) for i in range(slots)}
 
     def test_emails(self):
-        response = notify_users_of_prices(test_mode=True)
-
-        if not energy_planner.tomorrows_data_available:
-            # If tomorrows data isn't available, it should be false
-            self.assertFalse(response)
-        else:
-            png, price_message = response
-            self.assertTrue(bool(png))
-            self.assertTrue("Average outside peak" in price_message)
+        with FakeOctopusServer(prices=self.prices) as server, \
+                mock.patch("octopus.octopus_data.price_horizon", return_value=self.horizon):
+            client = OctopusClient("sk_test", "H", "mpan", "msn", "mprn", "msn", base_url=server.base_url)
+            with mock.patch("planner.messaging.pricing_notification.energy_planner", EnergyPlanner(client)):
+                png, price_message = notify_users_of_prices(test_mode=True)
+
+        self.assertEqual(bytes(png[:4]), b"\x89PNG")
+        self.assertTrue("Average outside peak" in price_message)
+
+    def test_no_email_before_tomorrows_prices(self):
+        today = {t: v for t, v in self.prices.items() if t.date() <= datetime.now(tz=timezone.utc).date()}
+        with FakeOctopusServer(prices=today) as server, \
+                mock.patch("octopus.octopus_data.price_horizon", return_value=max(today) + timedelta(minutes=30)):
+            client = OctopusClient("sk_test", "H", "mpan", "msn", "mprn", "msn", base_url=server.base_url)
+            with mock.patch("planner.messaging.pricing_notification.energy_planner", EnergyPlanner(client)):
+                self.assertFalse(notify_users_of_prices(test_mode=True))
+
+
+class StaticPriceProvider:
+    """Stands in for OctopusClient with a fixed set of prices starting now."""
+
+    def __init__(self, prices, gas_price=3.0, start=None):
+        self.prices = PriceSeries(to_slot(start or start_of_current_period()), prices)
+        self.gas_price = gas_price
+
+    def get_elec_price(self, start_time, end_time=None):
+        return self.prices.slice(start_time, end_time)
+
+    def get_gas_price(self, start_time):
+        return PriceSeries(to_slot(start_time), numpy.full(len(self.prices), self.gas_price))
+
+
+class PriceSeriesTests(SimpleTestCase):
+    def test_from_dict_round_trip(self):
+        start = datetime(2021, 6, 1, 22, tzinfo=timezone.utc)
+        data = {start: 10.0, start + timedelta(minutes=30): 12.0, start + timedelta(hours=2): 5.0}
+        series = PriceSeries.from_dict(data)
+
+        self.assertEqual(len(series), 5)
+        self.assertEqual(series.count(), 3)
+        self.assertEqual(series.start, start)
+        self.assertEqual(series.to_dict(), data)
+        self.assertEqual(list(series.to_df().index), list(data.keys()))
+
+    def test_excluded_windows_are_not_planned(self):
+        prices = numpy.array([20, 1, 1, 20, 5, 5, 20], dtype=float)
+        planner = EnergyPlanner(StaticPriceProvider(prices))
+        now = start_of_current_period()
+
+        (best,), price = planner.plan_usage_periods(hours=1, mode="best")
+        self.assertEqual(best, (now + timedelta(minutes=30), now + timedelta(minutes=90)))
+        self.assertEqual(price, 1)
+
+        (best,), price = planner.plan_usage_periods(hours=1, mode="best", excluded_periods=[best])
+        self.assertEqual(best, (now + timedelta(hours=2), now + timedelta(hours=3)))
+        self.assertEqual(price, 5)
+        self.assertAlmostEqual(planner.average_price(), prices.mean())
+
+    def test_usage_windows_for_several_durations(self):
+        prices = numpy.array([20, 1, 1, 20, 5, 5, 5, 30], dtype=float)
+        planner = EnergyPlanner(StaticPriceProvider(prices))
+        now = start_of_current_period()
+
+        windows = planner.plan_usage_windows([0.5, 1.5, 4.5], top_k=2)
+
+        self.assertEqual(windows[0.5]["best"], [((now + timedelta(minutes=30), now + timedelta(hours=1)), 1),
+                                                ((now + timedelta(hours=1), now + timedelta(minutes=90)), 1)])
+        self.assertEqual(windows[0.5]["peak"][0], ((now + timedelta(hours=3.5), now + timedelta(hours=4)), 30))
+        self.assertEqual(windows[1.5]["best"][0], ((now + timedelta(hours=2), now + timedelta(hours=3.5)), 5))
+        self.assertEqual(windows[4.5], {"best": [], "peak": []})
+        with self.assertRaises(AssertionError):
+            planner.plan_usage_windows([0])
+        with self.assertRaises(AssertionError):
+            PriceSeries(0, prices).window_means(0)
+
+    def test_separate_windows(self):
+        prices = numpy.array([9, 1, 2, 1, 9, 3, 3, 9, 9, 4, 4], dtype=float)
+        planner = EnergyPlanner(StaticPriceProvider(prices))
+        now = start_of_current_period()
+        half_hour = timedelta(minutes=30)
+
+        # The cheapest 1h windows are 1-3 and 2-4, but they overlap.
+        windows = planner.plan_separate_windows(hours=1, k=3)
+        self.assertEqual(windows, [((now + 1 * half_hour, now + 3 * half_hour), 1.5),
+                                   ((now + 5 * half_hour, now + 7 * half_hour), 3),
+                                   ((now + 9 * half_hour, now + 11 * half_hour), 4)])
+
+    def test_separate_windows_per_day(self):
+        # Two days of prices from tomorrow, cheapest at 0200 and 1400 UK each day.
+        tomorrow = datetime.now(tz=TIMEZONE).date() + timedelta(days=1)
+        start = TIMEZONE.localize(datetime.combine(tomorrow, datetime.min.time()))
+        prices = numpy.full(96, 10.0)
+        prices[[4, 5, 52, 53]] = 1
+        prices[[28, 29, 76, 77]] = 2
+        planner = EnergyPlanner(StaticPriceProvider(prices, start=start))
+
+        windows = planner.plan_separate_windows(hours=1, k=1, per_day=True, excluded_periods=[])
+        self.assertEqual([w[0][0].astimezone(TIMEZONE).hour for w in windows], [2, 2])
+
+
+class PriceCacheTests(SimpleTestCase):
+    def test_served_until_next_publication(self):
+        morning = datetime(2021, 6, 1, 9, tzinfo=timezone.utc)      # 1000 BST
+        horizon = price_horizon(morning)
+        self.assertEqual(horizon, datetime(2021, 6, 1, 22, tzinfo=timezone.utc))
+
+        cache = PriceCache()
+        self.assertIsNone(cache.get(morning, now=morning))
+
+        series = PriceSeries(to_slot(morning), numpy.arange(26.0))
+        cache.put(morning, series, now=morning)
+
+        later = morning + timedelta(hours=5)
+        self.assertEqual(cache.get(later, now=later).start, later)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # Tomorrow's prices can be published from 1600 BST.
+        self.assertIsNone(cache.get(later, now=datetime(2021, 6, 1, 15, tzinfo=timezone.utc)))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_short_lived_until_prices_published(self):
+        evening = datetime(2021, 6, 1, 16, tzinfo=timezone.utc)     # 1700 BST, nothing new yet
+        cache = PriceCache(retry=timedelta(minutes=5))
+        cache.put(evening, PriceSeries(to_slot(evening), numpy.arange(12.0)), now=evening)
+
+        self.assertIsNotNone(cache.get(evening, now=evening + timedelta(minutes=4)))
+        self.assertIsNone(cache.get(evening, now=evening + timedelta(minutes=5)))
+
+
+class CachedTimeSeriesTests(TestCase):
+    def test_new_data_written_once(self):
+        start = datetime(2021, 6, 1, tzinfo=timezone.utc)
+        end = start + timedelta(hours=4)
+        calls = []
+
+        def upstream(start_time, end_time):
+            calls.append((start_time, end_time))
+            return {start + timedelta(minutes=30) * i: float(i) for i in range(8)}
+
+        first = cached_time_series(TimeSeries.usage(), upstream, start, end)
+        self.assertEqual(first.count(), 8)
+        self.assertEqual(SeriesValue.objects.count(), 8)
+
+        second = cached_time_series(TimeSeries.usage(), upstream, start, end - timedelta(minutes=30))
+        self.assertEqual(len(calls), 1)
+        numpy.testing.assert_array_equal(second.values, first.values[:len(second)])
+
+        # Part way through a slot - that slot is still read from the database.
+        third = cached_time_series(TimeSeries.usage(), upstream, start + timedelta(minutes=10), end)
+        self.assertEqual(len(calls), 1)
+        numpy.testing.assert_array_equal(third.values, first.values)
+
+    def test_nearby_holes_fetched_together(self):
+        start = datetime(2021, 6, 1, tzinfo=timezone.utc)
+        data = {start + timedelta(minutes=30) * i: float(i) for i in range(48)}
+        store_time_series(TimeSeries.usage(), {t: v for t, v in data.items() if t.hour not in (3, 5, 20)})
+        calls = []
+
+        def upstream(start_time, end_time):
+            calls.append((start_time, end_time))
+            return {t: v for t, v in data.items() if start_time <= t < end_time}
+
+        series = cached_time_series(TimeSeries.usage(), upstream, start, start + timedelta(days=1), merge_gap=4)
+        self.assertEqual(calls, [(start + timedelta(hours=3), start + timedelta(hours=6)),
+                                 (start + timedelta(hours=20), start + timedelta(hours=21))])
+        self.assertEqual(series.to_dict(), data)
+
+    def test_series_kept_apart(self):
+        start = datetime(2021, 6, 1, tzinfo=timezone.utc)
+        end = start + timedelta(days=1)
+        prices = {start + timedelta(minutes=30) * i: float(i) for i in range(48)}
+
+        with FakeOctopusServer(prices=prices) as server:
+            clients = [OctopusClient("sk_test", zone, "mpan", "msn", "mprn", "msn", product="AGILE-22-08-31",
+                                     base_url=server.base_url) for zone in "HC"]
+            for client in clients:
+                client.get_elec_price(start, end)
+                client.get_export_price(start, end)
+            self.assertEqual(len(server.requests), 4)
+            self.assertIn("/products/AGILE-22-08-31/electricity-tariffs/E-1R-AGILE-22-08-31-C/", server.requests[2])
+            self.assertIn(f"E-1R-{OCTOPUS_EXPORT_PRODUCT}-H/", server.requests[1])
+
+            # All stored, each under its own series.
+            clients[0].price_cache.invalidate()
+            self.assertEqual(clients[0].get_elec_price(start, end).to_dict(), prices)
+            self.assertEqual(len(server.requests), 4)
+
+        series = TimeSeries.objects.filter(kind=TimeSeries.PRICE)
+        self.assertEqual(sorted(series.values_list('tariff', 'zone', 'direction')),
+                         sorted((tariff, zone, direction) for zone in "HC"
+                                for tariff, direction in (("AGILE-22-08-31", "import"),
+                                                          (OCTOPUS_EXPORT_PRODUCT, "export"))))
+        self.assertEqual(SeriesValue.objects.count(), 4 * 48)
+        self.assertEqual(stored_time_series(TimeSeries.prices("AGILE-22-08-31", "C"), start + SLOT, end).count(), 47)
+
+    def test_values_unique_on_any_database(self):
+        series = TimeSeries.usage()
+        data = {datetime(2021, 6, 1, tzinfo=timezone.utc) + SLOT * i: 1.0 for i in range(4)}
+        store_time_series(series, data)
+        store_time_series(series, data)
+        self.assertEqual(SeriesValue.objects.filter(series=series).count(), 4)
+        self.assertEqual(check_series_value_key(None, databases=["default"]), [])
+
+    def test_series_resolved_once_committed(self):
+        self.addCleanup(_resolved_series.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            series = TimeSeries.usage(TimeSeries.GAS)
+        with self.assertNumQueries(0):
+            self.assertEqual(TimeSeries.usage(TimeSeries.GAS), series)
+
+        # Not committed - looked up again, in case it's rolled back.
+        series = TimeSeries.usage(TimeSeries.ELEC)
+        with self.assertNumQueries(1):
+            self.assertEqual(TimeSeries.usage(TimeSeries.ELEC), series)
+
+
+class FetchPlanTests(SimpleTestCase):
+    def test_plan(self):
+        cached = numpy.array([1, 2, 3, 5, 6, 20, 21])
+
+        # Holes at 0, 4, 7-19 and 22-29, separated by 3, 2 and 2 cached slots.
+        plan = plan_fetches(cached, 0, 30, merge_gap=2, max_span=100)
+        self.assertEqual(plan.ranges, [(0, 1), (4, 30)])
+        self.assertEqual(len(plan_fetches(cached, 0, 30, merge_gap=3, max_span=100)), 1)
+
+        plan = plan_fetches(cached, 0, 30, merge_gap=0, max_span=5)
+        self.assertEqual(plan.ranges, [(0, 1), (4, 5), (7, 12), (12, 17), (17, 20), (22, 27), (27, 30)])
+
+        # Nothing past the horizon is asked for.
+        self.assertEqual(len(plan_fetches(cached, 22, 22)), 0)
+        self.assertEqual(len(plan_fetches(numpy.arange(10), 0, 10)), 0)
+
+
+class OctopusAPIClientTests(SimpleTestCase):
+    def setUp(self):
+        start = datetime(2021, 6, 1, tzinfo=timezone.utc)
+        self.prices = {start + timedelta(minutes=30) * i: float(i) for i in range(96)}
+        self.start = start
+
+    def make_client(self, server, page_size):
+        return OctopusAPIClient("sk_test", "H", "mpan", "msn", "mprn", "msn",
+                                base_url=server.base_url,
+                                page_size=page_size,
+                                session=make_session(backoff_factor=0))
+
+    def test_paginated_prices(self):
+        with FakeOctopusServer(prices=self.prices) as server:
+            client = self.make_client(server, page_size=40)
+            prices = client.get_elec_price(self.start, self.start + timedelta(days=1))
+
+        self.assertEqual(prices, {t: v for t, v in self.prices.items() if t < self.start + timedelta(days=1)})
+        self.assertEqual([t.results for t in client.request_timings], [40, 8])
+
+    def test_retries_server_errors(self):
+        with FakeOctopusServer(usage=self.prices, fail_first=2) as server:
+            client = self.make_client(server, page_size=1500)
+            usage = client.get_elec_usage(self.start)
+
+        self.assertEqual(usage, self.prices)
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(len(client.request_timings), 1)
+
+    def test_concurrent_chunks(self):
+        with FakeOctopusServer(usage=self.prices) as server:
+            with AsyncOctopusAPIClient("sk_test", "H", "mpan", "msn", "mprn", "msn",
+                                       base_url=server.base_url,
+                                       chunk=timedelta(hours=6),
+                                       max_concurrency=3) as client:
+                usage = asyncio.run(client.get_gas_usage(self.start, self.start + timedelta(days=2)))
+            with self.assertRaises(RuntimeError):
+                client.executor.submit(print)       # Closed with the client
+
+        self.assertEqual(usage, self.prices)
+        self.assertEqual(len(server.requests), 8)
+
+
+class CassetteTests(SimpleTestCase):
+    def test_record_then_replay_offline(self):
+        start = datetime(2021, 6, 1, tzinfo=timezone.utc)
+        prices = {start + timedelta(minutes=30) * i: float(i) for i in range(96)}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "prices.json")
+            with FakeOctopusServer(prices=prices, max_page_size=40) as server, recording_session(path) as session:
+                client = OctopusAPIClient("sk_test", "H", "mpan", "msn", "mprn", "msn",
+                                          base_url=server.base_url, session=session)
+                recorded = client.get_elec_price(start, start + timedelta(days=2))
+            self.assertEqual(len(server.requests), 3)
+
+            # The server is gone - everything comes from the cassette.
+            session = replay_session(path)
+            client = OctopusAPIClient("sk_test", "H", "mpan", "msn", "mprn", "msn",
+                                      base_url="https://api.octopus.energy/v1", session=session)
+            self.assertEqual(client.get_elec_price(start, start + timedelta(days=2)), recorded)
+            self.assertEqual([t.results for t in client.request_timings], [40, 40, 16])
+
+            with self.assertRaises(requests.ConnectionError):
+                client.get_elec_usage(start)
+
+        self.assertEqual(recorded, prices)
+
+
+class DataToolsTests(SimpleTestCase):
+    def setUp(self):
+        self.start = datetime(2021, 6, 1, tzinfo=timezone.utc)
+        self.index = pandas.date_range(self.start, periods=12, freq="30min")
+
+    def test_find_contiguous_periods(self):
+        times = self.index[[5, 0, 1, 2, 7, 8]]
+        half_hour = timedelta(minutes=30)
+        self.assertEqual(find_contiguous_periods(times),
+                         [(self.start, self.start + 3 * half_hour),
+                          (self.start + 5 * half_hour, self.start + 6 * half_hour),
+                          (self.start + 7 * half_hour, self.start + 9 * half_hour)])
+        self.assertEqual(find_contiguous_periods(self.index[:0]), [])
+
+    def test_drop_periods_from_df(self):
+        df = pandas.DataFrame({"electricity price": numpy.arange(12.0)}, index=self.index)
+        periods = [(self.start + timedelta(hours=1), self.start + timedelta(hours=2)),
+                   (self.start, self.start + timedelta(minutes=30)),
+                   (self.start + timedelta(minutes=90), self.start + timedelta(hours=3))]
+
+        dropped = drop_periods_from_df(df, periods)
+        self.assertEqual(list(dropped["electricity price"]), [1.0] + list(numpy.arange(6.0, 12.0)))
+
+
+class ApplianceTests(SimpleTestCase):
+    def test_start_costs(self):
+        prices = numpy.array([10, 2, 8, numpy.nan, 4, 4], dtype=float)
+        profile = numpy.array([1.0, 0.5])
+
+        numpy.testing.assert_array_equal(start_costs(prices, profile), [11, 6, numpy.nan, numpy.nan, 6])
+
+    def test_fft_matches_direct(self):
+        rng = numpy.random.default_rng(1)
+        prices = rng.normal(15, 5, 500)
+        profile = rng.random(FFT_MIN_PROFILE)
+
+        numpy.testing.assert_allclose(start_costs(prices, profile),
+                                      numpy.correlate(prices, profile, mode="valid"))
+
+    def test_front_loaded_profile_starts_at_cheap_slot(self):
+        prices = numpy.array([30, 30, 5, 20, 20, 5, 30], dtype=float)
+        planner = EnergyPlanner(StaticPriceProvider(prices))
+        now = start_of_current_period()
+
+        plans = planner.plan_appliances({"Front": [1.0, 0.1], "Back": [0.1, 1.0]})
+        self.assertEqual(plans["Front"], ((now + timedelta(hours=1), now + timedelta(hours=2)), 7.0))
+        self.assertEqual(plans["Back"], ((now + timedelta(hours=2), now + timedelta(hours=3)), 7.0))
+
+
+class ChargingTests(SimpleTestCase):
+    prices = numpy.array([20, 5, 7, numpy.nan, 6, 30], dtype=float)
+
+    def test_cheapest_with_partial_slot(self):
+        # 2.5 slots at 4kW: two full cheapest slots, and half of the next cheapest.
+        fractions = cheapest_charge(self.prices, 5.0, 4.0)
+        numpy.testing.assert_array_equal(fractions, [0, 1, 0.5, 0, 1, 0])
+
+        total, average = charge_cost(self.prices, fractions, 4.0)
+        self.assertAlmostEqual(total, 5 * 2 + 7 * 1 + 6 * 2)
+        self.assertAlmostEqual(average, 29 / 5)
+
+        self.assertEqual(charge_cost(self.prices, numpy.zeros(len(self.prices)), 4.0), (0.0, 0.0))
+
+    def test_not_enough_slots(self):
+        fractions = cheapest_charge(self.prices, 100.0, 4.0)
+        numpy.testing.assert_array_equal(fractions, [1, 1, 1, 0, 1, 1])
+
+    def test_partial_slot_is_placed_next_to_following_slot(self):
+        slot = 1000
+        base = slot * 1800
+
+        # Next slot charging: partial slot charges at its end, merging into one interval.
+        self.assertEqual(charging_intervals(slot, numpy.array([0.5, 1.0, 0.0])),
+                         [(base + 900, base + 3600)])
+        # Otherwise at its start.
+        self.assertEqual(charging_intervals(slot, numpy.array([1.0, 0.5, 0.0, 1.0])),
+                         [(base, base + 2700), (base + 5400, base + 7200)])
+
+    def test_start_penalty_merges_runs(self):
+        prices = numpy.array([20, 5, 30, 6, 30, 7, 8, 9, 40], dtype=float)
+
+        cheapest = fewest_starts_charge(prices, 3 * 3.6, 7.2, start_penalty=0)
+        numpy.testing.assert_array_equal(cheapest, cheapest_charge(prices, 3 * 3.6, 7.2))
+        self.assertEqual(count_starts(cheapest), 3)
+
+        merged = fewest_starts_charge(prices, 3 * 3.6, 7.2, start_penalty=50)
+        numpy.testing.assert_array_equal(merged, [0, 0, 0, 0, 0, 1, 1, 1, 0])
+
+    def test_min_run(self):
+        prices = numpy.array([20, 5, 30, 6, 30, 7, 8, 9, 40], dtype=float)
+
+        fractions = fewest_starts_charge(prices, 4 * 3.6, 7.2, start_penalty=0, min_run=2)
+        numpy.testing.assert_array_equal(fractions, [1, 1, 0, 0, 0, 1, 1, 0, 0])
+
+    def test_less_than_min_run_needed(self):
+        prices = numpy.array([10, 5, 20, 30, 3, 40, 8, 9], dtype=float)
+
+        for kwh, expected in ((3.6, [0, 0, 0, 0, 1, 0, 0, 0]), (1.8, [0, 0, 0, 0, 0.5, 0, 0, 0])):
+            numpy.testing.assert_array_equal(fewest_starts_charge(prices, kwh, 7.2, start_penalty=10, min_run=2),
+                                             expected)
+            numpy.testing.assert_array_equal(fewest_starts_charge_rows(prices[None], kwh, 7.2, start_penalty=10,
+                                                                       min_run=2), [expected])
+
+    def test_partial_slot_trimmed_at_end_of_run(self):
+        prices = numpy.array([20, 5, 30, 6, 30, 7, 8, 9, 40], dtype=float)
+
+        fractions = fewest_starts_charge(prices, 2.5 * 3.6, 7.2, start_penalty=100)
+        numpy.testing.assert_array_equal(fractions, [0, 0, 0, 0, 0, 1, 1, 0.5, 0])
+
+
+class HouseholdTests(SimpleTestCase):
+    prices = numpy.array([10, 1, 1, 10, 10, 2, 2, 10], dtype=float)
+
+    def test_loads_share_site_limit(self):
+        loads = [FlexibleLoad("Car", 7.2, 7.2),
+                 FlexibleLoad("Hot water", 3.0, 3.0, start=0, stop=4, fallback_price=5.0),
+                 ShiftableLoad("Washer", [0.5, 0.5])]
+
+        plans = schedule_loads(self.prices, loads, site_limit=11.0)
+
+        numpy.testing.assert_array_equal(plans["Hot water"].fractions, [0, 1, 1, 0, 0, 0, 0, 0])
+        self.assertFalse(plans["Hot water"].fallback.any())
+        numpy.testing.assert_array_equal(plans["Car"].fractions, [0, 0, 0, 0, 0, 1, 1, 0])
+        numpy.testing.assert_array_equal(plans["Washer"].fractions, [0, 1, 1, 0, 0, 0, 0, 0])
+        self.assertAlmostEqual(plans["Car"].cost, 2 * 3.6 * 2)
+        self.assertLessEqual(site_import(self.prices, loads, plans).max(), 11.0)
+
+    def test_fallback_when_no_headroom(self):
+        loads = [FlexibleLoad("Hot water", 3.0, 3.0, fallback_price=5.0)]
+
+        plans = schedule_loads(self.prices, loads, site_limit=11.0, base_load=[10, 10, 10, 10, 10, 0, 10, 10])
+
+        # Every slot but one is full, so the rest are all gas at the same price - earliest first.
+        numpy.testing.assert_array_equal(plans["Hot water"].fractions, [1, 0, 0, 0, 0, 1, 0, 0])
+        numpy.testing.assert_array_equal(plans["Hot water"].fallback, [1, 0, 0, 0, 0, 0, 0, 0])
+        self.assertAlmostEqual(plans["Hot water"].cost, 1.5 * 5 + 1.5 * 2)
+
+
+class BacktestTests(SimpleTestCase):
+    def setUp(self):
+        self.prices = synthetic_prices(70, start=datetime(2021, 3, 1, tzinfo=timezone.utc), seed=2, gap_rate=0)
+
+    def test_rows_match_single_plans(self):
+        rows = numpy.random.default_rng(0).normal(10, 6, (40, 26))
+        rows[rows < 2] = numpy.nan
+
+        numpy.testing.assert_array_equal(cheapest_charge_rows(rows, 25, 7.2),
+                                         [cheapest_charge(row, 25, 7.2) for row in rows])
+        numpy.testing.assert_array_equal(fewest_starts_charge_rows(rows, 25, 7.2, start_penalty=10, min_run=2),
+                                         [fewest_starts_charge(row, 25, 7.2, start_penalty=10, min_run=2)
+                                          for row in rows])
+
+    def test_only_published_prices_are_used(self):
+        days = [datetime(2021, 3, 27).date(), datetime(2021, 3, 28).date()]
+
+        # The night the clocks go forward is an hour shorter.
+        windows = day_windows(self.prices, days, CAR_WINDOW)
+        self.assertEqual(windows.in_window.sum(axis=1).tolist(), [24, 26])
+        numpy.testing.assert_array_equal(windows.known, windows.actual)
+
+        # Before 1600 nothing after 2300 tonight has been published.
+        windows = day_windows(self.prices, days, CAR_WINDOW, decision_hour=10)
+        self.assertEqual((~numpy.isnan(windows.known)).sum(axis=1).tolist(), [10, 10])
+
+    def test_strategies(self):
+        first, last = datetime(2021, 3, 1).date(), datetime(2021, 5, 1).date()
+        results = run_backtest(self.prices, first, last, processes=1)
+
+        # Workers are started as on macOS, so they have to set Django up themselves.
+        spawn = functools.partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context("spawn"))
+        with mock.patch("planner.insights.backtest.ProcessPoolExecutor", spawn):
+            self.assertEqual(results, run_backtest(self.prices, first, last, processes=2, chunk_days=10))
+        self.assertEqual(results["cheapest"]["days"], 62)
+        self.assertAlmostEqual(results["cheapest"]["kwh"], results["overnight"]["kwh"])
+        self.assertLess(results["cheapest"]["cost"], results["overnight"]["cost"])
+        self.assertLess(results["fewest_starts"]["switches"], results["cheapest"]["switches"])
+        self.assertLessEqual(results["hot_water"]["cost"], results["hot_water_gas"]["cost"])
+        self.assertAlmostEqual(results["hot_water"]["saving"],
+                               results["hot_water_gas"]["cost"] - results["hot_water"]["cost"])
+
+        # A night with a missing price is left out.
+        values = self.prices.values.copy()
+        values[to_slot(datetime(2021, 3, 10, 22, tzinfo=timezone.utc)) - self.prices.origin] = numpy.nan
+        gappy = run_backtest(PriceSeries(self.prices.origin, values), first, last, ["cheapest"], processes=1)
+        self.assertEqual(gappy["cheapest"]["days"], 61)
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        # Sat 30 Jan to Tue 2 Feb 2021, across a week and a month boundary. GMT, so local days are UTC days.
+        self.start = datetime(2021, 1, 30, tzinfo=timezone.utc)
+        self.end = self.start + timedelta(days=4)
+        origin = to_slot(self.start)
+        store_time_series(TimeSeries.prices(OCTOPUS_PRODUCT, OCTOPUS_ZONE),
+                          PriceSeries(origin, numpy.full(4 * 48, 10.0)).to_dict())
+        store_time_series(TimeSeries.usage(TimeSeries.GAS), PriceSeries(origin, numpy.full(4 * 48, 0.5)).to_dict())
+        self.store_usage(self.start, self.start + timedelta(days=3), 1.0)
+
+    @staticmethod
+    def store_usage(start, end, kwh):
+        store_time_series(TimeSeries.usage(), PriceSeries(to_slot(start), numpy.full(to_slot(end) - to_slot(start), kwh))
+                          .to_dict())
+
+    def test_rollups(self):
+        self.assertEqual(update_cost_ledger(now=self.end), 4)
+
+        daily = list(DailyCost.objects.order_by('start'))
+        self.assertEqual([d.slots for d in daily], [48, 48, 48, 0])
+        self.assertEqual([d.elec_cost for d in daily], [480.0, 480.0, 480.0, 0.0])
+        self.assertEqual(daily[0].gas_cost, 24 * GAS_PRICE)
+        self.assertEqual(daily[0].elec_average, 10.0)
+        self.assertIsNone(daily[3].elec_average)
+
+        self.assertEqual([(w.start.isoformat(), w.elec_kwh) for w in WeeklyCost.objects.order_by('start')],
+                         [("2021-01-25", 96.0), ("2021-02-01", 48.0)])
+        self.assertEqual([(m.start.isoformat(), m.slots) for m in MonthlyCost.objects.order_by('start')],
+                         [("2021-01-01", 96), ("2021-02-01", 48)])
+
+        # Late usage for the last day only rebuilds from there.
+        first_rows = list(DailyCost.objects.order_by('start').values_list('pk', flat=True))[:3]
+        self.store_usage(self.start + timedelta(days=3), self.end, 2.0)
+        self.assertEqual(update_cost_ledger(now=self.end), 1)
+
+        self.assertEqual(list(DailyCost.objects.order_by('start').values_list('pk', flat=True))[:3], first_rows)
+        self.assertEqual(WeeklyCost.objects.get(start=datetime(2021, 2, 1).date()).elec_cost, 480.0 + 960.0)
+        self.assertEqual(MonthlyCost.objects.get(start=datetime(2021, 2, 1).date()).elec_kwh, 48.0 + 96.0)
+        self.assertEqual(MonthlyCost.objects.get(start=datetime(2021, 1, 1).date()).elec_kwh, 96.0)
+        self.assertEqual(update_cost_ledger(now=self.end), 0)       # Nothing new
+
+    def test_late_data_is_costed(self):
+        update_cost_ledger(now=self.end)
+        day_before = (self.start - timedelta(days=1)).date()
+
+        # Usage backfilled for a day before any we have, with no prices for it yet.
+        self.store_usage(self.start - timedelta(days=1), self.start, 1.0)
+        self.assertEqual(update_cost_ledger(now=self.end), 5)
+        self.assertEqual(DailyCost.objects.filter(start=day_before).values_list(
+            'slots', 'elec_kwh', 'unpriced_slots', 'unpriced_kwh').get(), (0, 0.0, 48, 48.0))
+        self.assertEqual(MonthlyCost.objects.get(start=datetime(2021, 1, 1).date()).unpriced_kwh, 48.0)
+
+        # Then its prices.
+        store_time_series(TimeSeries.prices(OCTOPUS_PRODUCT, OCTOPUS_ZONE),
+                          PriceSeries(to_slot(self.start) - 48, numpy.full(48, 20.0)).to_dict())
+        self.assertEqual(update_cost_ledger(now=self.end), 5)
+        self.assertEqual(DailyCost.objects.filter(start=day_before).values_list(
+            'slots', 'elec_kwh', 'elec_cost', 'unpriced_slots').get(), (48, 48.0, 960.0, 0))
+        self.assertEqual(MonthlyCost.objects.get(start=datetime(2021, 1, 1).date()).elec_cost, 960.0 + 2 * 480.0)
+
+    def test_plan_costs(self):
+        session = CarChargingSession.objects.create(departure=self.start + timedelta(hours=7), average_cost=8.0)
+        CarChargingPeriod.objects.create(parent=session,
+                                         start_time=self.start + timedelta(hours=1),
+                                         stop_time=self.start + timedelta(hours=2, minutes=15))
+        [charge] = charging_costs([session])
+        self.assertAlmostEqual(charge.planned_kwh, 1.25 * EV_CHARGER_KW)
+        self.assertAlmostEqual(charge.planned_cost, 1.25 * EV_CHARGER_KW * 8.0)
+        self.assertAlmostEqual(charge.kwh, 2.5)
+        self.assertAlmostEqual(charge.cost, 25.0)
+
+        elec, gas = water_heating_costs([
+            WaterHeatingPeriod(elec_heating=True, start_time=self.start, stop_time=self.start + timedelta(hours=1)),
+            WaterHeatingPeriod(elec_heating=False, start_time=self.start, stop_time=self.start + timedelta(hours=1))])
+        self.assertAlmostEqual(elec.planned_cost, HW_HEATER_KW * 10.0)
+        self.assertAlmostEqual((elec.kwh, elec.cost), (2.0, 20.0))
+        self.assertAlmostEqual(gas.planned_cost, HW_HEATER_KW * GAS_PRICE / settings.AE_GAS_EFFICIENCY)
+        self.assertAlmostEqual(gas.cost, 1.0 * GAS_PRICE)
+
+        # Already charged - an empty plan costs nothing, rather than NaN.
+        planner = EnergyPlanner(StaticPriceProvider(numpy.arange(48.0)))
+        full = planner.plan_car_charging(departure=start_of_current_period() + timedelta(hours=8), energy_needed=0)
+        self.assertEqual((full.average_cost, full.carchargingperiod_set.count()), (0.0, 0))
+        self.assertEqual(charging_costs([full])[0].planned_cost, 0.0)
+
+        # Nothing planned, and planned but not metered yet.
+        empty = CarChargingSession.objects.create(departure=self.end, average_cost=8.0)
+        self.assertEqual(charging_costs([empty])[0].kwh, 0.0)
+        CarChargingPeriod.objects.create(parent=empty, start_time=self.end - SLOT, stop_time=self.end + SLOT)
+        self.assertTrue(numpy.isnan(charging_costs([empty])[0].kwh))
+
+
+@mock.patch("planner.insights.daily_insights.plot_png", return_value=b"png")
+@mock.patch("planner.insights.daily_insights.plot_html", return_value=("<script>", "<div>"))
+class DailyInsightsTests(TestCase):
+    def test_built_once_per_price_version(self, plot_html, plot_png):
+        prices = numpy.arange(48.0)
+        planner = EnergyPlanner(StaticPriceProvider(prices))
+        now = start_of_current_period()
+
+        insights = get_daily_insights(planner)
+        self.assertEqual((insights.best_start, insights.best_stop, insights.best_price),
+                         (now, now + timedelta(hours=3), 2.5))
+        self.assertEqual(insights.graph, ("<script>", "<div>"))
+        self.assertEqual([hours for hours, *_ in insights.window_plans()][:2], [0.5, 1])
+
+        self.assertEqual(get_daily_insights(planner).pk, insights.pk)
+        self.assertEqual(plot_html.call_count, 1)
+
+        # New prices published - new snapshot.
+        planner.energy_provider.prices = PriceSeries(planner.energy_provider.prices.origin, numpy.arange(96.0))
+        self.assertNotEqual(get_daily_insights(planner).pk, insights.pk)
+        self.assertEqual(DailyInsights.objects.count(), 2)
+
+
+class RenderCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.df = PriceSeries(to_slot(start_of_current_period()), numpy.arange(8.0)).to_df()
+
+    def test_lru_eviction(self):
+        cache = RenderCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+
+    def test_key_follows_content(self):
+        other = self.df.copy()
+        other.iloc[0, 0] = 100.0
+
+        self.assertEqual(render_key("png", [self.df]), render_key("png", [self.df.copy()]))
+        self.assertNotEqual(render_key("png", [self.df]), render_key("png", [other]))
+        self.assertNotEqual(render_key("png", [self.df]), render_key("png", [self.df], end_marker=self.df.index[-1]))
+
+    def test_png_rendered_once_in_memory(self):
+        render_cache.clear()
+        hits = render_cache.hits
+        png = plot_png([self.df], square_lines=False, show_now_marker=False)
+
+        self.assertTrue(png.startswith(b"\x89PNG"))
+        self.assertIs(plot_png([self.df], square_lines=False, show_now_marker=False), png)
+        self.assertEqual(render_cache.hits, hits + 1)
+
+
+class StepPlotTests(SimpleTestCase):
+    def test_steps_end_at_slot_end_and_gaps(self):
+        start = datetime(2021, 6, 1, tzinfo=timezone.utc)
+        df = PriceSeries(to_slot(start), [1.0, 2.0, numpy.nan, 4.0]).to_df()
+
+        times, values = step_points(df)
+
+        expected_times = [start + timedelta(minutes=m) for m in (0, 30, 60, 60, 90, 120, 120)]
+        self.assertEqual(list(pandas.DatetimeIndex(times).tz_localize('UTC')), expected_times)
+        numpy.testing.assert_array_equal(values, [1, 2, 2, numpy.nan, 4, 4, numpy.nan])
+
+    def test_downsample_keeps_extremes(self):
+        values = numpy.sin(numpy.arange(10000.0) / 50)
+        values[1234] = 10.0
+        values[8765] = -10.0
+        df = PriceSeries(to_slot(start_of_current_period()), values).to_df()
+
+        sampled = downsample(df, 500)
+        self.assertLessEqual(len(sampled), 500)
+        self.assertEqual(sampled.iloc[:, 0].max(), 10.0)
+        self.assertEqual(sampled.iloc[:, 0].min(), -10.0)
+        self.assertTrue(sampled.index.is_monotonic_increasing)
+
+    def test_render_step_plots(self):
+        df = PriceSeries(to_slot(start_of_current_period()), numpy.arange(48.0)).to_df()
+
+        script, div = plot_html([df, df.rename(columns={df.columns[0]: "gas price"})], max_points=20)
+        self.assertIn("<script", script)
+        self.assertTrue(plot_png([df], end_marker=df.index[-1], starts_and_stops=[(df.index[0], df.index[3])])
+                        .startswith(b"\x89PNG"))
+
+
+class BenchmarkTests(TestCase):
+    def test_synthetic_prices(self):
+        start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        prices = synthetic_prices(365, start=start, seed=1)
+
+        self.assertEqual((prices.start, len(prices)), (start, 365 * 48))
+        numpy.testing.assert_array_equal(prices.values, synthetic_prices(365, start=start, seed=1).values)
+        self.assertTrue(0 < prices.count() < len(prices))          # Some gaps
+        self.assertLess(numpy.nanmin(prices.values), 0)            # Some plunges
+        self.assertLessEqual(numpy.nanmax(prices.values), 35)
+
+        # Evenings cost more than nights.
+        hours = prices.to_df().index.tz_convert(TIMEZONE).hour
+        values = prices.to_df().iloc[:, 0]
+        self.assertGreater(values[(hours >= 16) & (hours < 19)].mean(), values[hours < 6].mean() + 10)
+
+    def test_run_and_compare_to_baseline(self):
+        results = run_benchmarks(["plan_car_charging", "cached_time_series"], ["1d"], repeat=1)
+        self.assertEqual([result_key(r) for r in results], ["plan_car_charging@1d", "cached_time_series@1d"])
+        self.assertFalse(CarChargingSession.objects.exists())      # Rolled back
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "new", "baseline.json")
+            self.assertIsNone(load_baseline(path))
+            save_baseline(results, path)
+            baseline = load_baseline(path)
+        self.assertEqual(regressions(results, baseline), [])
+
+        slower = [r._replace(seconds=r.seconds * 2 + 0.01) for r in results]
+        self.assertEqual([reason[:4] for _, reason in regressions(slower, baseline)], ["time", "time"])
+
+
+class DispatcherTests(TestCase):
+    def setUp(self):
+        self.start = datetime(2021, 6, 1, 1, tzinfo=timezone.utc)
+        self.now = self.start.timestamp()
+        self.calls = []
+        self.dispatcher = Dispatcher(registry={"start": lambda task_id: self.calls.append("start"),
+                                               "stop": lambda task_id: self.calls.append("stop")},
+                                     clock=lambda: self.now)
+
+    def schedule(self, minutes, function):
+        task = SystemScheduleTasks(action_time=self.start + timedelta(minutes=minutes), function=function)
+        task.save()
+        return task
+
+    def test_runs_due_tasks_once_in_order(self):
+        self.schedule(30, "stop")
+        self.schedule(0, "start")
+        self.dispatcher.refresh()
+
+        self.assertEqual(self.dispatcher.run_due(), 1)
+        self.now += 31 * 60
+        self.assertEqual(self.dispatcher.run_due(), 1)
+        self.assertEqual(self.dispatcher.run_due(), 0)
+
+        self.assertEqual(self.calls, ["start", "stop"])
+        self.assertFalse(SystemScheduleTasks.objects.filter(completed=False).exists())
+        self.assertEqual(self.dispatcher.stats()["lag_max"], 60)
+
+    def test_picks_up_new_tasks_and_skips_completed(self):
+        self.dispatcher.refresh()
+        self.assertFalse(self.dispatcher.refresh())
+
+        task = self.schedule(0, "start")
+        self.assertTrue(self.dispatcher.refresh())
+
+        SystemScheduleTasks.objects.filter(pk=task.pk).update(completed=True)    # Another runner got it
+        self.assertEqual(self.dispatcher.run_due(), 0)
+        self.assertEqual(self.calls, [])
+
+    def test_moved_task_runs_at_its_new_time(self):
+        first = self.schedule(0, "start")
+        self.schedule(30, "stop")
+        self.dispatcher.refresh()
+
+        # Not the latest task, and the count doesn't change - but it's noticed.
+        first.action_time = self.start + timedelta(minutes=10)
+        first.save()
+        self.assertTrue(self.dispatcher.refresh())
+        self.assertEqual(self.dispatcher.run_due(), 0)
+
+        # Even a runner still working from the old time can't claim it early.
+        self.assertFalse(claim_task(first.pk, "b", self.start))
+        self.now += 10 * 60
+        self.assertEqual(self.dispatcher.run_due(), 1)
+        self.assertEqual(self.calls, ["start"])
+
+    def test_only_one_runner_claims_a_task(self):
+        task = self.schedule(0, "start")
+        now = self.start
+
+        self.assertEqual([t.pk for t in claim_due_tasks("a", now)], [task.pk])
+        self.assertEqual(claim_due_tasks("b", now), [])
+
+        # "b" selected the row before "a" claimed it (no SKIP LOCKED) - its UPDATE must not win.
+        real_filter = SystemScheduleTasks.objects.filter
+        stale_select = [SystemScheduleTasks.objects.filter(pk=task.pk)]
+
+        def filter(*args, **kwargs):
+            return stale_select.pop() if stale_select else real_filter(*args, **kwargs)
+
+        with mock.patch.object(SystemScheduleTasks.objects, "filter", side_effect=filter):
+            self.assertEqual(claim_due_tasks("b", now), [])
+        self.assertEqual(SystemScheduleTasks.objects.get(pk=task.pk).claimed_by, "a")
+        self.assertFalse(claim_task(task.pk, "b", now))
+
+        # "a" died - once its lease is up, another runner's sweep picks the task up.
+        self.now += 10 * 60
+        self.assertEqual(self.dispatcher.sweep(), 1)
+        self.assertEqual(self.calls, ["start"])
+        self.assertEqual(SystemScheduleTasks.objects.get(pk=task.pk).claimed_by, self.dispatcher.worker)
+
+    def test_archive_completed(self):
+        old = self.schedule(0, "start")
+        SystemScheduleTasks.objects.filter(pk=old.pk).update(completed=True, completed_at=self.start)
+        pending = self.schedule(30, "stop")
+
+        self.assertEqual(archive_completed_tasks(timedelta(days=1)), 1)
+        self.assertEqual(list(SystemScheduleTasks.objects.values_list('pk', flat=True)), [pending.pk])
+        self.assertEqual(SystemScheduleTasksArchive.objects.get().task_id, old.pk)
+
+    def test_schedule_session_with_prewake(self):
+        session = CarChargingSession(departure=self.start + timedelta(hours=8), average_cost=5.0)
+        session.save()
+        period = CarChargingPeriod(start_time=self.start, stop_time=self.start + timedelta(hours=1), parent=session)
+        period.save()
+
+        schedule_charging_session(session, prewake=timedelta(minutes=3))
+        schedule_charging_session(session, prewake=timedelta(minutes=3))      # Again - no more tasks
+
+        tasks = SystemScheduleTasks.objects.order_by('action_time')
+        self.assertEqual([(t.function, t.action_time) for t in tasks],
+                         [("tesla_wake_up", self.start - timedelta(minutes=3)),
+                          ("tesla_start_charging", self.start),
+                          ("tesla_stop_charging", self.start + timedelta(hours=1))])
+
+        period.refresh_from_db()
+        record_charging_start(period.start_task_id_id, self.start + timedelta(seconds=4))
+        self.assertEqual(start_latencies(), [4.0])
+
+    def test_cancel_session_removes_its_tasks(self):
+        session = CarChargingSession.objects.create(departure=self.start + timedelta(hours=8), average_cost=5.0)
+        for hours in (0, 2):
+            CarChargingPeriod.objects.create(start_time=self.start + timedelta(hours=hours),
+                                             stop_time=self.start + timedelta(hours=hours + 1), parent=session)
+        schedule_charging_session(session, prewake=timedelta(minutes=3))
+        other = self.schedule(0, "start")
+
+        # The first period is already charging - its stop stays, so the car isn't left on.
+        SystemScheduleTasks.objects.filter(function__in=["tesla_wake_up", "tesla_start_charging"],
+                                           action_time__lte=self.start).update(completed=True)
+        cancel_charging_session(session)
+
+        self.assertFalse(CarChargingSession.objects.exists())
+        self.assertEqual(list(SystemScheduleTasks.objects.filter(completed=False).order_by('action_time')
+                              .values_list('function', 'action_time')),
+                         [("start", self.start), ("tesla_stop_charging", self.start + timedelta(hours=1))])
+        self.assertTrue(SystemScheduleTasks.objects.filter(pk=other.pk).exists())
+
+
+class TaskTests(TestCase):
+    def setUp(self):
+        self.start = datetime(2021, 6, 1, 1, tzinfo=timezone.utc)
+        self.now = self.start.timestamp()
+        self.vehicle = FakeVehicle()
+        self.outputs = {"hot_water_elec": mock.Mock()}
+        tasks.use_devices(lambda: TeslaAPIClient("me@example.com", "", dry_run=False,
+                                                 tesla_class=FakeTesla.with_vehicles(self.vehicle)),
+                          lambda: self.outputs)
+        self.addCleanup(tasks.use_devices)
+        self.dispatcher = Dispatcher(clock=lambda: self.now)
+
+    def run_until(self, minutes):
+        self.now = (self.start + timedelta(minutes=minutes)).timestamp()
+        self.dispatcher.refresh()
+        return self.dispatcher.run_due()
+
+    def test_tasks_drive_fake_devices(self):
+        session = CarChargingSession.objects.create(departure=self.start + timedelta(hours=8), average_cost=5.0)
+        period = CarChargingPeriod.objects.create(start_time=self.start, stop_time=self.start + timedelta(hours=1),
+                                                  parent=session)
+        schedule_charging_session(session, prewake=timedelta(minutes=3))
+        for minutes, function in ((30, "water_start_heating"), (90, "water_stop_heating")):
+            SystemScheduleTasks.objects.create(action_time=self.start + timedelta(minutes=minutes), function=function)
+
+        self.assertEqual(self.run_until(0), 2)
+        self.assertEqual(self.vehicle.commands, ["START_CHARGE"])
+        period.refresh_from_db()
+        self.assertIsNotNone(period.actual_start)
+
+        self.assertEqual(self.run_until(90), 3)
+        self.assertEqual(self.vehicle.commands, ["START_CHARGE", "STOP_CHARGE"])
+        self.assertEqual(self.outputs["hot_water_elec"].method_calls, [mock.call.on(), mock.call.off()])
+
+
+class VehicleStateTests(TestCase):
+    def setUp(self):
+        self.vehicle = FakeVehicle(battery_level=40, charge_limit_soc_std=90, charge_current_request=32)
+        self.status = SystemStatus(id=settings.AE_SITE_ID, system_id=settings.AE_SITE_ID,
+                                   hw_nest_override=False, hw_elec_heater_on=False, hw_gas_heater_on=False,
+                                   ev_charge_override=False, ev_charging=False, ev_soc=0,
+                                   ev_last_updated=datetime(2021, 6, 1, tzinfo=timezone.utc))
+        self.status.save()
+
+    def make_client(self):
+        return TeslaAPIClient("me@example.com", "", tesla_class=FakeTesla.with_vehicles(self.vehicle))
+
+    def test_client_fetches_once_per_ttl(self):
+        client = self.make_client()
+
+        self.assertAlmostEqual(client.hours_to_target_soc, 0.5 * 75 / (32 * 0.240))
+        self.assertAlmostEqual(client.hours_to_target_soc, 0.5 * 75 / (32 * 0.240))
+        self.assertEqual((self.vehicle.wake_ups, self.vehicle.data_fetches), (1, 1))
+
+    def test_snapshot_persisted_and_reused(self):
+        state = VehicleState(client_factory=self.make_client)
+        self.assertIsNone(state.latest())
+
+        hours = state.hours_to_target_soc
+        self.assertEqual(VehicleState(client_factory=self.make_client).hours_to_target_soc, hours)
+        self.assertEqual(self.vehicle.data_fetches, 1)
+
+        self.status.refresh_from_db()
+        self.assertEqual((self.status.ev_soc, self.status.ev_charge_limit), (40, 90))
+
+        # Stale - ask the car again.
+        SystemStatus.objects.filter(pk=self.status.pk).update(ev_last_updated=datetime(2021, 6, 1, tzinfo=timezone.utc))
+        self.vehicle.charge_state["battery_level"] = 60
+        self.assertLess(state.hours_to_target_soc, hours)
+        self.assertEqual(self.vehicle.data_fetches, 2)
+
+    def test_snapshot_stored_without_a_status_row(self):
+        SystemStatus.objects.all().delete()
+        state = VehicleState(client_factory=self.make_client)
+
+        state.charge_state()
+        state.charge_state()
+        self.assertEqual(self.vehicle.data_fetches, 1)
+        self.assertEqual(state.latest()["battery_level"], 40)
+
+    def test_prewake_takes_wake_delay_off_the_start(self):
+        clock = [0.0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        self.vehicle = FakeVehicle(wake_delay=TYPICAL_WAKE_DELAY, asleep_after=600, clock=lambda: clock[0], sleep=sleep)
+        client = TeslaAPIClient("me@example.com", "", dry_run=False,
+                                tesla_class=FakeTesla.with_vehicles(self.vehicle))
+
+        client.start_charging()
+        self.assertEqual(clock[0], TYPICAL_WAKE_DELAY)
+
+        # Back to sleep overnight; woken a few minutes before the next start.
+        sleep(3600)
+        client.wake_up()
+        sleep(180)
+        started = clock[0]
+        client.start_charging()
+        self.assertEqual(clock[0], started)
+        self.assertEqual((self.vehicle.wake_ups, self.vehicle.commands), (2, ["START_CHARGE", "START_CHARGE"]))
@@ -3,6 +3,7 @@ from django.urls import path
 import planner.views.shared
 import planner.views.car_charging
 import planner.views.hot_water
+import planner.views.history
 
 urlpatterns = [
     path('', planner.views.shared.index, name='index'),
@@ -11,4 +12,5 @@ urlpatterns = [
     path('charge/schedule/<int:session_id>', planner.views.car_charging.schedule_charge),
     path('charge/cancel/<int:session_id>', planner.views.car_charging.cancel_charge),
     path('water/', planner.views.hot_water.hot_water),
+    path('history', planner.views.history.history, name='history'),
 ]
\ No newline at end of file
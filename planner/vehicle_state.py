@@ -0,0 +1,88 @@
+"""The car's charge state, without waking it more than we have to.
+
+Every read of vehicle data wakes the car, which is slow and drains the battery. VehicleState
+keeps the last charge state in SystemStatus and only asks the car again once that is more than
+`ttl` old. Anything that just wants to show what we last knew can use latest(), which never
+touches the car.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+
+from config import DEV_MODE, TESLA_PASSWORD, TESLA_STATE_TTL_MINUTES, TESLA_USERNAME
+from tesla import TeslaAPIClient
+from tesla.tesla_api import hours_to_target_soc
+
+from .models import SystemStatus
+
+
+def default_client() -> TeslaAPIClient:
+    return TeslaAPIClient(TESLA_USERNAME, TESLA_PASSWORD, dry_run=DEV_MODE)
+
+
+class VehicleState:
+    """
+    Can be passed to EnergyPlanner as its `car`.
+
+    :param client_factory: Makes a TeslaAPIClient, only when the car actually needs asking.
+    :param ttl: How old a stored snapshot can be before the car is asked again.
+    """
+
+    def __init__(self, client_factory=default_client, ttl: timedelta = None):
+        self.client_factory = client_factory
+        self.ttl = timedelta(minutes=TESLA_STATE_TTL_MINUTES) if ttl is None else ttl
+        self._client = None
+
+    def latest(self) -> dict:
+        """
+        The last stored charge state (as in vehicle_data['charge_state'], plus 'updated'), or None.
+        Never wakes the car.
+        """
+        status = SystemStatus.objects.filter(id=settings.AE_SITE_ID).first()
+        if status is None or status.ev_charge_limit is None:
+            return None
+        return {"battery_level": status.ev_soc,
+                "charge_limit_soc_std": status.ev_charge_limit,
+                "charge_current_request": status.ev_charge_current,
+                "updated": status.ev_last_updated}
+
+    def charge_state(self) -> dict:
+        """
+        The charge state, from the stored snapshot if it's fresh, otherwise from the car (and stored).
+        """
+        latest = self.latest()
+        if latest is not None and datetime.now(tz=timezone.utc) - latest["updated"] < self.ttl:
+            return latest
+        return self.refresh()
+
+    def refresh(self) -> dict:
+        """
+        Ask the car (one wake-up, one vehicle data fetch) and store the result.
+        """
+        if self._client is None:
+            self._client = self.client_factory()
+        charge_state = self._client.refresh_vehicle_data()['charge_state']
+        now = datetime.now(tz=timezone.utc)
+
+        snapshot = {"ev_soc": charge_state['battery_level'],
+                    "ev_charge_limit": charge_state['charge_limit_soc_std'],
+                    "ev_charge_current": charge_state['charge_current_request'],
+                    "ev_last_updated": now}
+        # Without somewhere to keep it, every charge_state() would wake the car again. Only the
+        # snapshot is written if the row exists; a new one starts with everything else off.
+        if not SystemStatus.objects.filter(id=settings.AE_SITE_ID).update(**snapshot):
+            SystemStatus.objects.create(id=settings.AE_SITE_ID,
+                                        system_id=settings.AE_SITE_ID,
+                                        hw_nest_override=False,
+                                        hw_elec_heater_on=False,
+                                        hw_gas_heater_on=False,
+                                        ev_charge_override=False,
+                                        ev_charging=False,
+                                        **snapshot)
+
+        return dict(charge_state, updated=now)
+
+    @property
+    def hours_to_target_soc(self) -> float:
+        return hours_to_target_soc(self.charge_state())
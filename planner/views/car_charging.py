@@ -4,10 +4,12 @@ from django.shortcuts import redirect, render
 from tzlocal import get_localzone
 
 from planner.common import energy_planner
+from planner.insights.charging import CHARGING_MODES
 from planner.insights.data_tools import start_of_current_period
 from planner.insights.visualisation_tools import plot_html
-from planner.models import CarChargingSession, SystemScheduleTasks
-from planner.tasks import tesla_start_charging, tesla_stop_charging
+from planner.dispatcher import cancel_charging_session, schedule_charging_session
+from planner.models import CarChargingSession
+from tesla.tesla_api import hours_to_target_soc
 
 
 def plan_charge(request):
@@ -19,8 +21,16 @@ def plan_charge(request):
         return redirect('/charge/session/{}'.format(future_sessions[0].pk))
 
     departure_hour = int(request.GET.get("departure_hour", 8 if datetime.now().hour < 8 else 17))
-    hours_needed = float(request.GET.get("hours_needed", 2))
+    # Last known charge state - never wakes the car.
+    vehicle = energy_planner.car.latest() if energy_planner.car is not None else None
+    if "hours_needed" in request.GET or vehicle is None:
+        hours_needed = float(request.GET.get("hours_needed", 2))
+    else:
+        hours_needed = round(max(hours_to_target_soc(vehicle), 0) * 2) / 2
     max_cost = int(request.GET.get("max_cost", 15))
+    mode = request.GET.get("mode", "cheapest")
+    if mode not in CHARGING_MODES:
+        mode = "cheapest"
 
     now = datetime.now(tz=get_localzone())
     ep_pd = energy_planner.ep_df_from_now()
@@ -34,7 +44,17 @@ def plan_charge(request):
 
     charge_session = energy_planner.plan_car_charging(departure=departure,
                                                       hours_needed=hours_needed,
-                                                      max_cost=max_cost)
+                                                      max_cost=max_cost,
+                                                      mode=mode)
+    mode_costs = energy_planner.compare_charging_modes(departure=departure,
+                                                       hours_needed=hours_needed,
+                                                       max_cost=max_cost)
+    mode_comparison = [{"mode": name.replace("_", " ").capitalize(),
+                        "selected": name == mode,
+                        "cost": result["cost"],
+                        "difference": result["cost"] - mode_costs["cheapest"]["cost"],
+                        "starts": result["starts"]}
+                       for name, result in mode_costs.items()]
     starts_and_stops = [(s.start_time, s.stop_time) for s in charge_session.carchargingperiod_set.all()]
 
     graph = plot_html([ep_pd], starts_and_stops=starts_and_stops, end_marker=departure)
@@ -43,29 +63,19 @@ def plan_charge(request):
         "departure_hour": departure_hour,
         "hours_needed": hours_needed,
         "max_cost": max_cost,
+        "mode": mode,
     }
 
     return render(request, 'plan_charge.html', context={"graph": graph,
                                                         "session_config": session_config,
-                                                        "charge_session": charge_session})
+                                                        "charge_session": charge_session,
+                                                        "mode_comparison": mode_comparison,
+                                                        "vehicle": vehicle})
 
 
 def schedule_charge(request, session_id):
     charge_session = CarChargingSession.objects.get(pk=session_id)
-
-    for period in charge_session.carchargingperiod_set.all():
-        start = SystemScheduleTasks(action_time=period.start_time,
-                                    function=tesla_start_charging.__name__)
-        start.save()
-        period.start_task_id = start
-
-        end = SystemScheduleTasks(action_time=period.stop_time,
-                                  function=tesla_stop_charging.__name__)
-        end.save()
-        period.stop_task_id = end
-
-    charge_session.scheduled = True
-    charge_session.save()
+    schedule_charging_session(charge_session)
 
     return redirect("/charge")
 
@@ -85,5 +95,5 @@ def show_charge(request, session_id):
 
 
 def cancel_charge(request, session_id):
-    CarChargingSession.objects.get(pk=session_id).delete()
+    cancel_charging_session(CarChargingSession.objects.get(pk=session_id))
     return redirect("/charge")
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.shortcuts import render
+
+from planner.common import energy_planner
+from planner.insights.data_tools import start_of_current_period
+from planner.insights.visualisation_tools import plot_html
+
+# Points per series sent to the browser, however long the history.
+HISTORY_MAX_POINTS = 2000
+
+
+def history(request):
+    days = int(request.GET.get("days", 90))
+
+    end_time = start_of_current_period()
+    start_time = end_time - timedelta(days=days)
+
+    prices = energy_planner.energy_provider.get_elec_price(start_time, end_time)
+    usage = energy_planner.energy_provider.get_elec_usage(start_time, end_time)
+
+    graph = plot_html([prices.to_df('electricity price'), usage.to_df('electricity usage (kWh)')],
+                      show_now_marker=False,
+                      max_points=HISTORY_MAX_POINTS)
+
+    return render(request, 'history.html', context={"graph": graph,
+                                                    "days": days})
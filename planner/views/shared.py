@@ -1,34 +1,37 @@
 from django.shortcuts import render
 
 from planner.common import energy_planner
+from planner.insights.daily_insights import HEADLINE_WINDOW_HOURS, get_daily_insights
 from planner.insights.data_tools import format_short_date, format_short_date_range
-from planner.insights.visualisation_tools import plot_html
 
 
 def index(request):
-    # Get Gas and Electric Prices
-    ep_pd = energy_planner.ep_df_from_now()
-    gp_pd = energy_planner.gp_df_from_now()
+    # Windows, averages and the graph are worked out once per set of prices.
+    insights = get_daily_insights(energy_planner)
 
-    # Get best stop & start times for Electric usage.
-    best_starts_and_stops, best_price = energy_planner.plan_usage_periods(hours=3, mode="best")
-    peak_starts_and_stops, peak_price = energy_planner.plan_usage_periods(hours=3, mode="peak")
+    ep = energy_planner.ep_series_from_now()
+    now_ep = ep.values[0]
+    now_time = format_short_date(ep.start)
+    best_time = format_short_date_range((insights.best_start, insights.best_stop))
+    peak_time = format_short_date_range((insights.peak_start, insights.peak_stop))
 
-    # Get an HTML graph of the same
-
-    now_ep = ep_pd.values[0][0]
-    now_time = format_short_date(ep_pd.index[0])
-    best_time = format_short_date_range(best_starts_and_stops[0])
-    peak_time = format_short_date_range(peak_starts_and_stops[0])
-    average = energy_planner.average_price()
-    average_excluding_peak = energy_planner.average_price(excluded_periods=peak_starts_and_stops)
-
-    graph = plot_html([ep_pd, gp_pd], starts_and_stops=best_starts_and_stops + peak_starts_and_stops)
     price_data = [("Current Price", now_time, f"{now_ep:.2f}"),
-                  ("Best 3h", best_time, f"{best_price:.2f}"),
-                  ("Peak 3h", peak_time, f"{peak_price:.2f}"),
-                  ("Average", "all-day", f"{average:.2f}"),
-                  ("Average", "outside peak", f"{average_excluding_peak:.2f}")]
-
-    return render(request, 'index.html', context={"graph": graph,
-                                                  "price_data": price_data})
\ No newline at end of file
+                  (f"Best {HEADLINE_WINDOW_HOURS}h", best_time, f"{insights.best_price:.2f}"),
+                  (f"Peak {HEADLINE_WINDOW_HOURS}h", peak_time, f"{insights.peak_price:.2f}"),
+                  ("Average", "all-day", f"{insights.average:.2f}"),
+                  ("Average", "outside peak", f"{insights.average_excluding_peak:.2f}")]
+
+    # Best and peak windows for each appliance run-time
+    window_data = [(f"{hours:g}h",
+                    format_short_date_range(best_window), f"{best_price:.2f}",
+                    format_short_date_range(peak_window), f"{peak_price:.2f}")
+                   for hours, best_window, best_price, peak_window, peak_price in insights.window_plans()]
+
+    # Cheapest start for each appliance, given its load profile
+    appliance_data = [(name, format_short_date_range(start_and_stop), f"{cost:.1f}")
+                      for name, start_and_stop, cost in insights.appliance_plans()]
+
+    return render(request, 'index.html', context={"graph": insights.graph,
+                                                  "price_data": price_data,
+                                                  "window_data": window_data,
+                                                  "appliance_data": appliance_data})
@@ -0,0 +1,110 @@
+"""A local stand-in for the parts of teslapy we use.
+
+FakeTesla can be passed to TeslaAPIClient in place of teslapy.Tesla, so the client (and everything
+built on it) can be exercised without an account or a car:
+
+    vehicle = FakeVehicle(battery_level=40)
+    client = TeslaAPIClient("me@example.com", "", tesla_class=FakeTesla.with_vehicles(vehicle))
+
+A real car takes anything from a few seconds to half a minute to wake, and goes back to sleep after
+some minutes without being asked anything. Give FakeVehicle a `wake_delay` and `asleep_after` to see
+what that does to the actuation paths - with a fake `clock` and `sleep` that costs no real time.
+"""
+
+import time
+
+# Seconds a sleeping car typically takes to come online.
+TYPICAL_WAKE_DELAY = 20
+
+
+class FakeVehicle(dict):
+    """
+    Pretends to be a teslapy.Vehicle. Counts wake-ups (of a sleeping car) and vehicle data fetches,
+    and records commands.
+
+    :param wake_delay: Seconds sync_wake_up takes when the car is asleep.
+    :param asleep_after: Seconds without a wake-up, fetch or command before the car falls asleep
+                         again. None to stay awake.
+    :param clock: Returns the time now, in seconds.
+    :param sleep: Sleeps for a number of seconds. Pass one that advances `clock` to fake the wait.
+    """
+
+    def __init__(self,
+                 battery_level: int = 50,
+                 charge_limit_soc_std: int = 90,
+                 charge_current_request: int = 32,
+                 asleep: bool = True,
+                 wake_delay: float = 0,
+                 asleep_after: float = None,
+                 clock=time.monotonic,
+                 sleep=time.sleep):
+        super().__init__(state="asleep" if asleep else "online", display_name="Fake")
+        self.charge_state = {"battery_level": battery_level,
+                             "charge_limit_soc_std": charge_limit_soc_std,
+                             "charge_current_request": charge_current_request,
+                             "charging_state": "Stopped"}
+        self.wake_delay = wake_delay
+        self.asleep_after = asleep_after
+        self.clock = clock
+        self.sleep = sleep
+
+        self.wake_ups = 0
+        self.wake_seconds = 0.0     # Total time spent waiting for the car to wake
+        self.data_fetches = 0
+        self.commands = []
+        self._last_active = clock()
+
+    def _doze(self):
+        """Fall asleep if nothing has happened for `asleep_after`."""
+        if self.asleep_after is not None and self.clock() - self._last_active >= self.asleep_after:
+            self["state"] = "asleep"
+
+    def _check_awake(self):
+        self._doze()
+        assert self["state"] == "online", "Vehicle is asleep"
+        self._last_active = self.clock()
+
+    def sync_wake_up(self, timeout=60, interval=2, backoff=1.15):
+        self._doze()
+        if self["state"] != "online":
+            t = self.clock()
+            self.sleep(self.wake_delay)
+            self.wake_seconds += self.clock() - t
+            self.wake_ups += 1
+            self["state"] = "online"
+        self._last_active = self.clock()
+
+    def get_vehicle_data(self):
+        self._check_awake()
+        self.data_fetches += 1
+        return {"charge_state": dict(self.charge_state)}
+
+    def command(self, name, **kwargs):
+        self._check_awake()
+        self.commands.append(name)
+        if name == "START_CHARGE":
+            self.charge_state["charging_state"] = "Charging"
+        elif name == "STOP_CHARGE":
+            self.charge_state["charging_state"] = "Stopped"
+        return True
+
+
+class FakeTesla:
+    """
+    Pretends to be a teslapy.Tesla with the vehicles given to with_vehicles.
+    """
+    vehicles = []
+
+    def __init__(self, email, password=None, **kwargs):
+        self.email = email
+        self.token_fetches = 0
+
+    @classmethod
+    def with_vehicles(cls, *vehicles):
+        return type(cls.__name__, (cls,), {"vehicles": list(vehicles)})
+
+    def fetch_token(self):
+        self.token_fetches += 1
+
+    def vehicle_list(self):
+        return self.vehicles
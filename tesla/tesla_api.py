@@ -1,11 +1,32 @@
+from datetime import datetime, timedelta, timezone
 import teslapy
 import logging
 
+from config import TESLA_STATE_TTL_MINUTES
+
+BATTERY_KWH = 75
+
+
+def hours_to_target_soc(charge_state: dict) -> float:
+    """
+    Hours of charging to get from the current battery level to the charge limit, at the requested
+    current.
+
+    :param charge_state: As returned in vehicle_data['charge_state']
+    """
+    charge = charge_state['battery_level']/100.0
+    target = charge_state['charge_limit_soc_std']/100.0
+    kw = charge_state['charge_current_request']*0.240      # Todo: Add phases
+    charge_needed = (target - charge)*BATTERY_KWH
+    return charge_needed / kw
+
 
 class TeslaAPIClient:
-    def __init__(self, email, password, dry_run=True):
-        self.tesla = teslapy.Tesla(email=email,
-                                   password=password)
+    def __init__(self, email, password, dry_run=True,
+                 ttl: timedelta = timedelta(minutes=TESLA_STATE_TTL_MINUTES),
+                 tesla_class=teslapy.Tesla):
+        self.tesla = tesla_class(email=email,
+                                 password=password)
         self.tesla.fetch_token()
         vehicles = self.tesla.vehicle_list()
         assert len(vehicles) == 1, "Can only handle one car!"
@@ -15,24 +36,42 @@ class TeslaAPIClient:
             logging.warning("Tesla created in dry_run mode. Won't do much!")
 
         self.dry_run = dry_run
+        self.ttl = ttl
+
+        self._vehicle_data = None
+        self._fetched = None
 
     @property
-    def vehicle_data(self):
+    def vehicle_data(self) -> dict:
+        """
+        Vehicle data, fetched (waking the car) at most once per `ttl`.
+        """
+        if self._fetched is None or datetime.now(tz=timezone.utc) - self._fetched >= self.ttl:
+            self.refresh_vehicle_data()
+        return self._vehicle_data
+
+    @property
+    def vehicle_data_time(self) -> datetime:
+        """When vehicle_data was fetched."""
+        return self._fetched
+
+    def refresh_vehicle_data(self) -> dict:
         self.tesla.sync_wake_up()
-        return self.tesla.get_vehicle_data()
+        self._vehicle_data = self.tesla.get_vehicle_data()
+        self._fetched = datetime.now(tz=timezone.utc)
+        return self._vehicle_data
 
     @property
     def hours_to_target_soc(self):
-        charge = self.vehicle_data['charge_state']['battery_level']/100.0
-        target = self.vehicle_data['charge_state']['charge_limit_soc_std']/100.0
-        kw = self.vehicle_data['charge_state']['charge_current_request']*0.240      # Todo: Add phases
-        charge_needed = (target - charge)*75
-        return charge_needed / kw
+        return hours_to_target_soc(self.vehicle_data['charge_state'])
+
+    def wake_up(self):
+        self.tesla.sync_wake_up()
 
     def start_charging(self):
         self.tesla.sync_wake_up()
         if self.dry_run:
-            assert self.vehicle_data
+            assert self.refresh_vehicle_data()
             logging.info("START_CHARGE: Dry-run on. Got vehicle data. Seemed to work.")
             return
         self.tesla.command("START_CHARGE")
@@ -40,7 +79,7 @@ class TeslaAPIClient:
     def stop_charging(self):
         self.tesla.sync_wake_up()
         if self.dry_run:
-            assert self.vehicle_data
+            assert self.refresh_vehicle_data()
             logging.info("STOP_CHARGE: Dry-run on. Got vehicle data. Seemed to work.")
             return
         self.tesla.command("STOP_CHARGE")